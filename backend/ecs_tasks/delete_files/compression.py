@@ -0,0 +1,288 @@
+"""
+Codecs used to read and write compressed objects, identified by their file
+extension or by the magic bytes at the start of the object.
+
+Like pigz, the gzip writer splits its input in blocks which are deflated
+independently by worker threads, each primed with the last 32 KiB of the
+previous block as a preset dictionary. Every block but the last ends with a
+sync flush, so the compressed blocks can be concatenated into a single
+standard gzip member which any gzip reader can decompress.
+"""
+import os
+import struct
+import zlib
+from bz2 import BZ2File
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from gzip import GzipFile
+from io import BufferedReader
+
+import pyarrow as pa
+
+GZIP_BLOCK_SIZE = int(os.getenv("GZIP_BLOCK_SIZE", 1024 * 1024))
+GZIP_WORKERS = int(os.getenv("GZIP_WORKERS", os.cpu_count() or 1))
+GZIP_QUEUE_DEPTH = int(os.getenv("GZIP_QUEUE_DEPTH", 2))
+DICTIONARY_SIZE = 32 * 1024
+SNAPPY_READ_SIZE = 1024 * 1024
+# Maximum uncompressed size of a chunk of the Snappy framing format
+SNAPPY_CHUNK_SIZE = 65536
+MAGIC_SIZE = 10
+
+# Magic, deflate method, no flags, no mtime, no extra flags, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def deflate_block(data, dictionary, level, last):
+    """
+    Deflates a block without header, ending with a final block if last or
+    with a sync flush otherwise, so that the next block can be appended
+    """
+    kwargs = {"zdict": dictionary} if dictionary else {}
+    compressor = zlib.compressobj(
+        level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, **kwargs
+    )
+    return compressor.compress(data) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH
+    )
+
+
+class ParallelGzipWriter:
+    """
+    File-like writer compressing the data written to it into fileobj as a
+    gzip stream. Blocks of block_size bytes are compressed by a pool of
+    workers threads, at most workers + queue_depth blocks ahead of the one
+    being written to fileobj. Closing the writer doesn't close fileobj
+    """
+
+    def __init__(
+        self,
+        fileobj,
+        level=zlib.Z_DEFAULT_COMPRESSION,
+        block_size=GZIP_BLOCK_SIZE,
+        workers=GZIP_WORKERS,
+        queue_depth=GZIP_QUEUE_DEPTH,
+    ):
+        self.fileobj = fileobj
+        self.level = zlib.Z_DEFAULT_COMPRESSION if level is None else level
+        self.block_size = block_size
+        self.workers = max(workers, 1)
+        self.queue_depth = queue_depth
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = None
+        self.crc = 0
+        self.size = 0
+        self.closed = False
+        self.fileobj.write(GZIP_HEADER)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        self.size += len(data)
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            block = bytes(self.buffer[: self.block_size])
+            del self.buffer[: self.block_size]
+            self._submit(block, False)
+        return len(data)
+
+    def _submit(self, block, last):
+        self.pending.append(
+            self.executor.submit(
+                deflate_block, block, self.dictionary, self.level, last
+            )
+        )
+        self.dictionary = block[-DICTIONARY_SIZE:]
+        while len(self.pending) > self.workers + self.queue_depth:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._submit(bytes(self.buffer), True)
+            self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            self.fileobj.write(struct.pack("<II", self.crc, self.size & 0xFFFFFFFF))
+        finally:
+            self.abort()
+
+    def abort(self):
+        self.closed = True
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+
+
+class UnclosableStream:
+    """
+    Forwards writes to a stream without closing it when closed, for writers
+    which close the stream they write to
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.closed = False
+
+    def write(self, data):
+        return self.stream.write(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class SnappyFramedReader:
+    """
+    File-like reader decompressing a stream in the Snappy framing format
+    """
+
+    def __init__(self, fileobj):
+        import snappy
+
+        self.fileobj = fileobj
+        self.decompressor = snappy.StreamDecompressor()
+        self.buffer = bytearray()
+        self.eof = False
+
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) < size):
+            data = self.fileobj.read(SNAPPY_READ_SIZE)
+            if data:
+                self.buffer += self.decompressor.decompress(data)
+            else:
+                self.decompressor.flush()
+                self.eof = True
+        size = len(self.buffer) if size < 0 else size
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class SnappyFramedWriter:
+    """
+    File-like writer compressing the data written to it into fileobj in the
+    Snappy framing format. Closing the writer doesn't close fileobj
+    """
+
+    def __init__(self, fileobj):
+        import snappy
+
+        self.fileobj = fileobj
+        self.compressor = snappy.StreamCompressor()
+
+    def write(self, data):
+        data = bytes(data)
+        for i in range(0, len(data), SNAPPY_CHUNK_SIZE):
+            chunk = data[i : i + SNAPPY_CHUNK_SIZE]
+            self.fileobj.write(self.compressor.add_chunk(chunk))
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def open_arrow_reader(codec):
+    return lambda fileobj: pa.CompressedInputStream(fileobj, codec)
+
+
+def open_arrow_writer(codec):
+    return lambda fileobj, level: pa.CompressedOutputStream(
+        pa.PythonFile(UnclosableStream(fileobj), mode="w"), codec
+    )
+
+
+Codec = namedtuple("Codec", ["name", "extensions", "magic", "reader", "writer"])
+
+CODECS = [
+    Codec(
+        "gzip",
+        (".gz", ".gzip"),
+        b"\x1f\x8b",
+        lambda fileobj: GzipFile(None, "rb", fileobj=fileobj),
+        ParallelGzipWriter,
+    ),
+    Codec(
+        "zstd",
+        (".zst", ".zstd"),
+        b"\x28\xb5\x2f\xfd",
+        open_arrow_reader("zstd"),
+        open_arrow_writer("zstd"),
+    ),
+    Codec(
+        "bz2",
+        (".bz2",),
+        b"BZh",
+        lambda fileobj: BZ2File(fileobj, "rb"),
+        lambda fileobj, level: BZ2File(fileobj, "wb", compresslevel=level or 9),
+    ),
+    Codec(
+        "snappy",
+        (".sz", ".snappy"),
+        b"\xff\x06\x00\x00sNaPpY",
+        SnappyFramedReader,
+        lambda fileobj, level: SnappyFramedWriter(fileobj),
+    ),
+    Codec(
+        "lz4",
+        (".lz4",),
+        b"\x04\x22\x4d\x18",
+        open_arrow_reader("lz4"),
+        open_arrow_writer("lz4"),
+    ),
+]
+
+
+def get_codec(name):
+    for codec in CODECS:
+        if codec.name == name:
+            return codec
+    raise ValueError("Unsupported compression codec: {}".format(name))
+
+
+def detect_codec(object_path, input_file=None):
+    """
+    Returns the name of the codec an object is compressed with according to
+    its extension or, if it has no known extension and input_file is given,
+    to its first bytes. Returns None if the object isn't compressed
+    """
+    for codec in CODECS:
+        if object_path.lower().endswith(codec.extensions):
+            return codec.name
+    if input_file is None:
+        return None
+    position = input_file.tell()
+    head = input_file.read(MAGIC_SIZE)
+    input_file.seek(position)
+    for codec in CODECS:
+        if head.startswith(codec.magic):
+            return codec.name
+    return None
+
+
+def open_streams(input_file, out_stream, compressed, compression_level, buffer_size):
+    """
+    Returns a buffered reader for the input file, decompressing it
+    incrementally if compressed, and a writer compressing the output
+    incrementally with the same codec if compressed. compressed is the name
+    of a codec, or True for gzip. The input is read in blocks of buffer_size
+    bytes and closing the writer doesn't close out_stream
+    """
+    input_file = BufferedReader(input_file, buffer_size=buffer_size)
+    if not compressed:
+        return input_file, None
+    codec = get_codec("gzip" if compressed is True else compressed)
+    return codec.reader(input_file), codec.writer(out_stream, compression_level)
@@ -0,0 +1,293 @@
+import os
+import re
+from collections import Counter
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+from pyarrow import BufferOutputStream
+
+from compression import open_streams
+from match_plan import get_match_plan
+from utils import read_blocks, get_line_bounds, ChunkedWriter
+
+READ_BUFFER_SIZE = int(os.getenv("CSV_READ_BUFFER_SIZE", 8 * 1024 * 1024))
+WRITE_BUFFER_SIZE = int(os.getenv("CSV_WRITE_BUFFER_SIZE", 1024 * 1024))
+ARROW_BLOCK_SIZE = int(os.getenv("CSV_ARROW_BLOCK_SIZE", 1024 * 1024))
+
+# Text accepted by Hive when reading integer and floating point columns
+INTEGER_PATTERN = r"^[+-]?[0-9]+$"
+# Bounds of the digits of int64 values, without their sign
+INT64_MAX_DIGITS = str(2 ** 63 - 1)
+INT64_MIN_DIGITS = str(2 ** 63)
+FLOAT_PATTERN = r"^[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?$"
+
+
+def get_parse_options(format_options):
+    """
+    Converts the CSV options of a data mapper, which are generated from the
+    SerDe parameters of its Glue table, to pyarrow parse options. Values
+    spanning several lines aren't supported by the SerDes, so each line is
+    a row
+    """
+    return pv.ParseOptions(
+        delimiter=format_options.get("FieldDelimiter", ","),
+        quote_char=format_options.get("QuoteChar") or False,
+        escape_char=format_options.get("EscapeChar") or False,
+        newlines_in_values=False,
+    )
+
+
+def get_columns(column_names, identifiers):
+    """
+    Returns a dict of the names of the columns of the table for the given
+    identifiers, which are matched case-insensitively like Hive does
+    """
+    lower_names = {}
+    for name in column_names:
+        lower_names.setdefault(name.lower(), name)
+    return {
+        identifier: lower_names.get(identifier.lower(), identifier)
+        for identifier in identifiers
+    }
+
+
+def read_rows(data, column_names, columns, parse_options):
+    """
+    Parses the given columns of CSV data as strings, exactly as written
+    """
+    try:
+        return pv.read_csv(
+            pa.BufferReader(pa.py_buffer(data)),
+            read_options=pv.ReadOptions(
+                column_names=column_names, block_size=ARROW_BLOCK_SIZE
+            ),
+            parse_options=parse_options,
+            convert_options=pv.ConvertOptions(
+                column_types={column: pa.string() for column in columns},
+                include_columns=columns,
+                strings_can_be_null=False,
+                quoted_strings_can_be_null=False,
+            ),
+        )
+    except pa.ArrowInvalid as e:
+        raise ValueError(
+            "Serialization error when processing CSV object: {}".format(str(e))
+        )
+
+
+def get_int64_values(column):
+    """
+    Returns the values of a string column parsed as int64. Values which
+    aren't integers or are out of the int64 range are null. The sign and
+    leading zeros are removed first, as Arrow doesn't parse a plus sign, so
+    that the number of digits can be compared with the bounds of int64
+    """
+    valid = pc.match_substring_regex(column, INTEGER_PATTERN)
+    digits = pc.replace_substring_regex(column, r"^[+-]?0*", "")
+    digits = pc.if_else(pc.equal(digits, ""), "0", digits)
+    negative = pc.starts_with(column, "-")
+    length = pc.utf8_length(digits)
+    # Digit strings of the same length compare like the numbers they spell
+    bound = pc.if_else(negative, INT64_MIN_DIGITS, INT64_MAX_DIGITS)
+    in_range = pc.or_(
+        pc.less(length, len(INT64_MAX_DIGITS)),
+        pc.and_(pc.equal(length, len(INT64_MAX_DIGITS)), pc.less_equal(digits, bound)),
+    )
+    text = pc.if_else(negative, pc.binary_join_element_wise("-", digits, ""), digits)
+    return pc.cast(
+        pc.if_else(pc.and_(valid, in_range), text, pa.scalar(None, pa.string())),
+        pa.int64(),
+    )
+
+
+def get_typed_values(column, value_type):
+    """
+    Returns the values of a string column parsed as value_type. Values which
+    aren't valid numbers are null
+    """
+    if value_type is str:
+        return column
+    if value_type is int:
+        return get_int64_values(column)
+    valid = pc.match_substring_regex(column, FLOAT_PATTERN)
+    return pc.cast(
+        pc.if_else(valid, column, pa.scalar(None, pa.string())), pa.float64()
+    )
+
+
+def get_value_type(value):
+    if isinstance(value, str):
+        return str
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int
+    return float
+
+
+def get_value_sets(match_ids, arrow_type):
+    """
+    Groups the MatchIds by type, returning the type and the Arrow array of
+    the MatchIds of each type. Empty values are dropped as they never match
+    """
+    value_sets = []
+    for value_type in (str, int, float):
+        values = [v for v in match_ids if v and get_value_type(v) is value_type]
+        if values:
+            value_sets.append((value_type, pa.array(values)))
+    return value_sets
+
+
+def get_candidates(column, column_plan, index):
+    """
+    Returns a boolean numpy array which is True for the values of column
+    equal to one of the MatchIds of the identifier at index. MatchIds have
+    been cast to the type of the column in the Glue table, so numbers are
+    compared with the values parsed as numbers
+    """
+    mask = np.zeros(len(column), dtype=bool)
+    for value_type, value_set in column_plan.get_typed_values(
+        index, column.type, get_value_sets
+    ):
+        typed = get_typed_values(column, value_type)
+        matches = pc.is_in(typed, value_set=value_set)
+        mask |= pc.fill_null(matches, False).to_numpy(zero_copy_only=False)
+    return mask
+
+
+def is_equal(text, value):
+    value_type = get_value_type(value)
+    if value_type is str:
+        return text == value
+    pattern = INTEGER_PATTERN if value_type is int else FLOAT_PATTERN
+    return re.match(pattern, text) is not None and value_type(text) == value
+
+
+def get_mask(table, plan, columns):
+    """
+    Returns a boolean numpy array which is True for the rows of the table
+    which match any of the columns to delete, where columns maps the
+    identifiers of the plan to the columns of the table
+    """
+    mask = np.zeros(table.num_rows, dtype=bool)
+    for column in plan:
+        values = [table.column(columns[c]).combine_chunks() for c in column.identifiers]
+        if column.simple:
+            mask |= get_candidates(values[0], column, 0)
+            continue
+        candidates = np.ones(table.num_rows, dtype=bool)
+        for i, col_values in enumerate(values):
+            candidates &= get_candidates(col_values, column, i)
+        # Candidates match each column separately: check the combinations
+        indices = np.flatnonzero(candidates)
+        if len(indices) == 0:
+            continue
+        rows = zip(*[v.take(pa.array(indices)).to_pylist() for v in values])
+        for index, row in zip(indices, rows):
+            mask[index] = any(
+                all(is_equal(text, value) for text, value in zip(row, match_id))
+                for match_id in column.match_ids
+            )
+    return mask
+
+
+def get_deleted_lines(block, position, end, plan, column_names, columns, parse_options):
+    """
+    Parses the rows of block[position:end] and returns the number of rows and
+    the (start, end) offsets of the lines to delete. Empty lines are skipped
+    by the parser, so rows are mapped to the lines which aren't empty
+    """
+    data = memoryview(block)[position:end]
+    starts, ends = get_line_bounds(data)
+    content = np.frombuffer(data, dtype=np.uint8)
+    content_ends = ends - (content[ends - 1] == ord("\n"))
+    content_ends -= (content_ends > starts) & (
+        content[np.maximum(content_ends - 1, 0)] == ord("\r")
+    )
+    rows = np.flatnonzero(content_ends > starts)
+    # Identifiers differing only in case are read from the same column
+    included = list(dict.fromkeys(columns.values()))
+    table = read_rows(data, column_names, included, parse_options)
+    if table.num_rows != len(rows):
+        raise ValueError(
+            "Serialization error when processing CSV object: "
+            "found {} rows in {} lines".format(table.num_rows, len(rows))
+        )
+    deleted = rows[np.flatnonzero(get_mask(table, plan, columns))]
+    return len(rows), [(position + starts[i], position + ends[i]) for i in deleted]
+
+
+def skip_lines(block, position, end, count):
+    """
+    Returns the offset after the first count lines of block[position:end]
+    and the number of lines skipped
+    """
+    skipped = 0
+    while skipped < count and position < end:
+        line_end = block.find(b"\n", position, end)
+        position = end if line_end == -1 else line_end + 1
+        skipped += 1
+    return position, skipped
+
+
+def delete_matches_from_csv_file(
+    input_file,
+    to_delete,
+    compressed=False,
+    out_stream=None,
+    format_options=None,
+    compression_level=None,
+):
+    """
+    Deletes matches from a CSV file, where format_options contains the
+    ColumnNames of the table, its FieldDelimiter, QuoteChar and EscapeChar,
+    and the HeaderLineCount of lines to keep as they are at the start of the
+    file. The file is read in blocks of complete lines which are parsed with
+    pyarrow.csv, and the delete mask is computed with Arrow compute kernels.
+    Contiguous rows to keep are written to out_stream (an in-memory buffer by
+    default) as slices of the input blocks, so quoting and formatting are
+    preserved. Compressed output is written with the codec of the input
+    """
+    plan = get_match_plan(to_delete)
+    format_options = format_options or {}
+    column_names = format_options["ColumnNames"]
+    columns = get_columns(column_names, plan.get_identifiers())
+    parse_options = get_parse_options(format_options)
+    header_lines = int(format_options.get("HeaderLineCount", 0))
+    if out_stream is None:
+        out_stream = BufferOutputStream()
+    input_file, compressor = open_streams(
+        input_file, out_stream, compressed, compression_level, READ_BUFFER_SIZE
+    )
+    writer = ChunkedWriter(compressor or out_stream, WRITE_BUFFER_SIZE)
+    total_rows = 0
+    deleted_rows = 0
+    try:
+        for block, position, end in read_blocks(input_file, READ_BUFFER_SIZE):
+            kept = position
+            if header_lines:
+                position, skipped = skip_lines(block, position, end, header_lines)
+                header_lines -= skipped
+            deleted = []
+            if position < end:
+                rows, deleted = get_deleted_lines(
+                    block, position, end, plan, column_names, columns, parse_options
+                )
+                total_rows += rows
+                deleted_rows += len(deleted)
+            view = memoryview(block)
+            for start, next_position in deleted:
+                if kept < start:
+                    writer.write(view[kept:start])
+                kept = next_position
+            if kept < end:
+                writer.write(view[kept:end])
+        writer.flush()
+    except BaseException:
+        if hasattr(compressor, "abort"):
+            compressor.abort()
+        raise
+    if compressor:
+        compressor.close()
+    stats = Counter({"ProcessedRows": total_rows, "DeletedRows": deleted_rows})
+    return out_stream, stats
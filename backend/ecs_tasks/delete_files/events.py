@@ -7,6 +7,7 @@ from collections.abc import Iterable
 from functools import lru_cache
 
 from boto_utils import emit_event
+from match_plan import read_cached_columns
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +44,8 @@ def sanitize_message(err_message, message_body):
             message_body = json.loads(message_body)
         matches = []
         cols = message_body.get("Columns", [])
+        if "ColumnsHash" in message_body:
+            cols = read_cached_columns(message_body["ColumnsHash"]) or []
         for col in cols:
             match_ids = col.get("MatchIds")
             if isinstance(match_ids, Iterable):
@@ -0,0 +1,95 @@
+"""
+Heartbeat extending the visibility timeout of the messages received from the
+deletion queue, so that messages for objects which take longer to rewrite
+than the visibility timeout of the queue, or which wait for a worker, don't
+become visible again and get processed twice. SQS doesn't extend a message
+beyond 12 hours after it was received.
+"""
+import logging
+import os
+from threading import Event, Lock, Thread
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+logger = logging.getLogger(__name__)
+
+VISIBILITY_TIMEOUT = int(os.getenv("VISIBILITY_TIMEOUT_SECONDS", 10800))
+HEARTBEAT_INTERVAL = int(os.getenv("HEARTBEAT_INTERVAL_SECONDS", 1800))
+# Maximum number of entries of a ChangeMessageVisibilityBatch call
+BATCH_SIZE = 10
+
+
+class VisibilityHeartbeat:
+    """
+    Sets the visibility timeout of the messages in the messages dict to
+    visibility_timeout seconds every interval seconds from a background
+    thread, until stopped. Messages are extended for as long as they are in
+    the dict, so they should be removed from it with discard() as soon as they
+    are processed. An interval of 0 disables the heartbeat
+    """
+
+    def __init__(self, client, queue_url, messages, visibility_timeout, interval):
+        self.client = client
+        self.queue_url = queue_url
+        self.messages = messages
+        self.visibility_timeout = visibility_timeout
+        self.interval = interval
+        self.stopped = Event()
+        self.lock = Lock()
+        self.thread = None
+        if interval > 0:
+            self.thread = Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.lock:
+                    self.extend(list(self.messages.values()))
+            except (ClientError, BotoCoreError) as e:
+                logger.warning("Unable to extend message visibility: %s", str(e))
+
+    def extend(self, messages):
+        for i in range(0, len(messages), BATCH_SIZE):
+            batch = messages[i : i + BATCH_SIZE]
+            resp = self.client.change_message_visibility_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {
+                        "Id": str(index),
+                        "ReceiptHandle": msg.receipt_handle,
+                        "VisibilityTimeout": self.visibility_timeout,
+                    }
+                    for index, msg in enumerate(batch)
+                ],
+            )
+            for failure in resp.get("Failed", []):
+                # Messages deleted by a worker since the batch was built fail
+                logger.warning(
+                    "Unable to extend message visibility: %s",
+                    failure.get("Message", failure.get("Code")),
+                )
+
+    def discard(self, key):
+        """
+        Removes a message from the messages dict and returns it. Once removed,
+        the message is no longer extended, even by a visibility change in
+        progress, so its visibility can be changed
+        """
+        with self.lock:
+            return self.messages.pop(key)
+
+    def stop(self):
+        """
+        Stops the heartbeat, waiting for the visibility change in progress if
+        any, so that it can't override a later change of visibility
+        """
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
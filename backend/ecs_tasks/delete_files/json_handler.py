@@ -1,18 +1,124 @@
-from gzip import GzipFile
-from io import BytesIO
+from io import SEEK_END
 import json
-from collections import Counter
+import logging
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-from pyarrow import BufferOutputStream, CompressedOutputStream
+import ahocorasick
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.json as pj
+from pyarrow import BufferOutputStream
 
-def initialize(input_file, out_stream, compressed):
-    if compressed:
-        bytestream = BytesIO(input_file.read())
-        input_file = GzipFile(None, "rb", fileobj=bytestream)
-    gzip_stream = CompressedOutputStream(out_stream, "gzip") if compressed else None
-    writer = gzip_stream if compressed else out_stream
-    return input_file, writer
+from compression import open_streams
+from match_plan import get_match_plan
+from utils import parallel_map, read_blocks, get_line_bounds, ChunkedWriter
+
+logger = logging.getLogger(__name__)
+
+READ_BUFFER_SIZE = int(os.getenv("JSON_READ_BUFFER_SIZE", 8 * 1024 * 1024))
+WRITE_BUFFER_SIZE = int(os.getenv("JSON_WRITE_BUFFER_SIZE", 1024 * 1024))
+KEY_CACHE_SIZE = int(os.getenv("JSON_KEY_CACHE_SIZE", 4096))
+ARROW_BLOCK_SIZE = int(os.getenv("JSON_ARROW_BLOCK_SIZE", 1024 * 1024))
+PIPELINE_QUEUE_DEPTH = int(os.getenv("JSON_PIPELINE_QUEUE_DEPTH", 2))
+PARALLEL_SIZE_THRESHOLD = int(
+    os.getenv("JSON_PARALLEL_SIZE_THRESHOLD", 256 * 1024 * 1024)
+)
+PARALLEL_WORKERS = int(os.getenv("JSON_PARALLEL_WORKERS", os.cpu_count() or 1))
+JSON_DECODER = os.getenv("JSON_DECODER")
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+# Escape sequences which JSON writers may use for characters of a string
+JSON_ESCAPES = {
+    '"': b'\\"',
+    "\\": b"\\\\",
+    "/": b"\\/",
+    "\b": b"\\b",
+    "\f": b"\\f",
+    "\n": b"\\n",
+    "\r": b"\\r",
+    "\t": b"\\t",
+}
+# Any character can be written as a \uXXXX escape sequence
+UNICODE_ESCAPE = b"\\u"
+# Numbers written with an exponent don't contain the digits of their value
+EXPONENT_NUMBER = re.compile(rb"[:,\[]\s*-?[0-9]+(\.[0-9]*)?[eE]")
+# Numbers with at least as many digits as the largest 64 bit integers are
+# found by mapping every digit to 0, which is faster than a regex
+DIGITS_TO_ZERO = bytes.maketrans(b"0123456789", b"0" * 10)
+LONG_NUMBER = b"0" * 19
+
+
+def decode_with_json(line):
+    return json.loads(line.decode("utf-8"))
+
+
+def decode_with_orjson(line):
+    """
+    Decodes a line with orjson, which differs from the json module: it
+    rejects NaN and lone surrogates, and decodes integers larger than 64 bits
+    as floats. Lines it rejects or which contain long numbers are decoded
+    with the json module instead, so that the results and the errors are the
+    same as decode_with_json
+    """
+    if LONG_NUMBER in line.translate(DIGITS_TO_ZERO):
+        return decode_with_json(line)
+    try:
+        return orjson.loads(line)
+    except orjson.JSONDecodeError:
+        return decode_with_json(line)
+
+
+DECODERS = {"json": decode_with_json}
+if orjson:
+    DECODERS["orjson"] = decode_with_orjson
+
+
+def get_decoder(name=None):
+    """
+    Returns the function used to decode lines, orjson if installed unless
+    another decoder name is given. Decoders raise json.JSONDecodeError
+    """
+    if name is None:
+        name = "orjson" if "orjson" in DECODERS else "json"
+    if name not in DECODERS:
+        raise ValueError("Unsupported JSON decoder: {}".format(name))
+    return DECODERS[name]
+
+
+decode = get_decoder(JSON_DECODER)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def resolve_key(segment, keys):
+    """
+    Returns the first of an object's keys matching a lowercase path segment.
+    Objects of the same shape have the same keys tuple, so the lowercasing
+    and scanning is only done once per shape and segment
+    """
+    for key in keys:
+        if key.lower() == segment:
+            return key
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def compile_key_path(key):
+    """
+    Splits a nested key in lowercase segments. Example:
+    key="user.Id"
+    result=("user", "id")
+    """
+    return tuple(segment.lower() for segment in key.split("."))
 
 
 def find_key(key, obj):
@@ -25,9 +131,7 @@ def find_key(key, obj):
     """
     if not obj:
         return None
-    for found_key in obj.keys():
-        if key.lower() == found_key.lower():
-            return found_key
+    return resolve_key(key.lower(), tuple(obj.keys()))
 
 
 def get_value(key, obj):
@@ -37,53 +141,439 @@ def get_value(key, obj):
     obj='{"user":{"id": 1234}}'
     result=1234
     """
-    for segment in key.split("."):
-        current_key = find_key(segment, obj)
+    return get_path_value(compile_key_path(key), obj)
+
+
+def get_path_value(path, obj):
+    """
+    Finds a value given the lowercase segments of a nested key
+    """
+    for segment in path:
+        if not obj:
+            return None
+        current_key = resolve_key(segment, tuple(obj.keys()))
         if not current_key:
             return None
         obj = obj[current_key]
     return obj
 
 
-def delete_matches_from_json_file(input_file, to_delete, compressed=False):
-    deleted_rows = 0
-    with BufferOutputStream() as out_stream:
-        input_file, writer = initialize(input_file, out_stream, compressed)
-        content = input_file.read().decode("utf-8")
-        lines = content.split("\n")
-        if lines[-1] == "":
-            lines.pop()
-        total_rows = len(lines)
-        for i, line in enumerate(lines):
+def is_match(parsed, plan):
+    for column in plan:
+        if column.simple:
+            record = get_path_value(column.paths[0], parsed)
+            if record and column.contains(record):
+                return True
+        else:
+            matched = []
+            for path in column.paths:
+                record = get_path_value(path, parsed)
+                if record:
+                    matched.append(record)
+            if column.contains(matched):
+                return True
+    return False
+
+
+def get_match_patterns(plan):
+    """
+    Returns byte strings at least one of which is found in the raw line of
+    any object matching one of the MatchIds, and whether numbers written
+    with an exponent can match. Returns None if lines can't be filtered.
+
+    Matches are found by value equality after parsing, so a MatchId can match
+    differently written values: strings with escape sequences, integers
+    written as floats, 1 written as true and true written as 1. Falsy values
+    never match. Floats which aren't integers, or which are written with an
+    exponent by Python, have too many spellings to be filtered.
+    """
+    patterns = set()
+    numeric = False
+    for column in plan:
+        values = [value for column_values in column.values for value in column_values]
+        for value in values:
+            if isinstance(value, bool):
+                numeric = True
+                patterns.update([b"true", b"1"] if value else [b"false", b"0"])
+            elif not value:
+                continue
+            elif isinstance(value, str):
+                patterns.add(value.encode("utf-8"))
+                patterns.add(UNICODE_ESCAPE)
+                patterns.update(JSON_ESCAPES[c] for c in JSON_ESCAPES if c in value)
+            elif isinstance(value, int):
+                numeric = True
+                if value == 1:
+                    patterns.add(b"true")
+                patterns.add(str(value).encode())
+            elif isinstance(value, float):
+                if not value.is_integer() or "e" in repr(value).lower():
+                    return None
+                numeric = True
+                if value == 1:
+                    patterns.add(b"true")
+                patterns.add(str(int(value)).encode())
+            else:
+                return None
+    return patterns, numeric
+
+
+def get_prefilter(plan):
+    """
+    Returns a function telling whether a raw line may contain any of the
+    MatchIds, using an Aho-Corasick automaton of the patterns returned by
+    get_match_patterns, or None if lines can't be filtered. Lines are mapped
+    to str with latin-1, which maps each byte to a single character, so that
+    the automaton matches UTF-8 byte sequences
+    """
+    match_patterns = get_match_patterns(plan)
+    if match_patterns is None:
+        return None
+    patterns, numeric = match_patterns
+    if not patterns:
+        return lambda line: False
+    automaton = ahocorasick.Automaton()
+    for pattern in patterns:
+        automaton.add_word(pattern.decode("latin-1"), None)
+    automaton.make_automaton()
+
+    def can_match(line):
+        if next(automaton.iter(line.decode("latin-1")), None) is not None:
+            return True
+        return numeric and EXPONENT_NUMBER.search(line) is not None
+
+    return can_match
+
+
+class UnsupportedJsonBlockError(Exception):
+    pass
+
+
+def get_arrow_column(table, path):
+    """
+    Returns the values of a nested key for each row of a table parsed by
+    pyarrow.json, resolving each of the lowercase segments of its path case
+    insensitively like get_value. Returns None if no row has the key
+    """
+    column = None
+    fields = table.schema
+    key = ".".join(path)
+    for segment in path:
+        if column is not None:
+            if pa.types.is_null(column.type):
+                return None
+            if not pa.types.is_struct(column.type):
+                raise UnsupportedJsonBlockError(
+                    "{} is not an object in every row".format(key)
+                )
+            fields = list(column.type)
+        indices = [i for i, f in enumerate(fields) if f.name.lower() == segment]
+        if not indices:
+            return None
+        if len(indices) > 1:
+            raise UnsupportedJsonBlockError("{} has ambiguous keys".format(key))
+        if column is None:
+            column = table.column(indices[0])
+        else:
+            column = pc.struct_field(column, indices)
+    return column
+
+
+def get_arrow_match_ids(match_ids, arrow_type):
+    """
+    Converts MatchIds to the values they are equal to once parsed by
+    pyarrow.json as arrow_type, so that the comparison is the same as
+    comparing the values parsed by json.loads. Falsy values never match.
+    Returns None if values of this type can't be compared
+    """
+    numbers = [v for v in match_ids if v and isinstance(v, (bool, int, float))]
+    if pa.types.is_string(arrow_type):
+        return [v for v in match_ids if v and isinstance(v, str)]
+    if pa.types.is_integer(arrow_type):
+        return [
+            int(v)
+            for v in numbers
+            if (not isinstance(v, float) or v.is_integer())
+            and INT64_MIN <= v <= INT64_MAX
+        ]
+    if pa.types.is_floating(arrow_type):
+        return [float(v) for v in numbers]
+    if pa.types.is_boolean(arrow_type):
+        return [True] if any(v == 1 for v in numbers) else []
+    if pa.types.is_nested(arrow_type) or pa.types.is_null(arrow_type):
+        return []
+    return None
+
+
+def get_arrow_value_set(match_ids, arrow_type):
+    """
+    Returns the MatchIds as an Arrow array of arrow_type, or None if values
+    of this type can't be compared
+    """
+    values = get_arrow_match_ids(match_ids, arrow_type)
+    return None if values is None else pa.array(values, arrow_type)
+
+
+def get_arrow_candidates(column, column_plan, index):
+    """
+    Returns a boolean numpy array which is True for the values of column
+    equal to one of the MatchIds of the identifier at index
+    """
+    value_set = column_plan.get_typed_values(index, column.type, get_arrow_value_set)
+    if value_set is None:
+        raise UnsupportedJsonBlockError(
+            "Unsupported identifier type {}".format(column.type)
+        )
+    if len(value_set) == 0:
+        return np.zeros(len(column), dtype=bool)
+    mask = pc.fill_null(pc.is_in(column, value_set=value_set), False)
+    return np.concatenate(
+        [np.zeros(0, dtype=bool)]
+        + [chunk.to_numpy(zero_copy_only=False) for chunk in mask.chunks]
+    )
+
+
+def get_arrow_mask(table, plan):
+    """
+    Returns a boolean numpy array which is True for the rows of a table
+    parsed by pyarrow.json which match is_match
+    """
+    mask = np.zeros(table.num_rows, dtype=bool)
+    for column in plan:
+        values = [get_arrow_column(table, path) for path in column.paths]
+        if any(v is None for v in values):
+            continue
+        if column.simple:
+            mask |= get_arrow_candidates(values[0], column, 0)
+            continue
+        candidates = np.ones(table.num_rows, dtype=bool)
+        for i, col_values in enumerate(values):
+            candidates &= get_arrow_candidates(col_values, column, i)
+        # Candidates match each column separately: check the combinations
+        indices = np.flatnonzero(candidates)
+        if len(indices) == 0:
+            continue
+        rows = zip(*[v.take(pa.array(indices)).to_pylist() for v in values])
+        for index, row in zip(indices, rows):
+            if column.contains(row):
+                mask[index] = True
+    return mask
+
+
+def get_deleted_lines_with_arrow(block, position, end, plan):
+    """
+    Parses the lines of block[position:end] with pyarrow.json and computes
+    which of them match with Arrow compute kernels. Returns the number of
+    lines and the (start, end) offsets of the lines to delete. Raises
+    UnsupportedJsonBlockError if the block can't be processed this way
+    """
+    data = memoryview(block)[position:end]
+    starts, ends = get_line_bounds(data)
+    try:
+        table = pj.read_json(
+            pa.BufferReader(pa.py_buffer(data)),
+            read_options=pj.ReadOptions(block_size=ARROW_BLOCK_SIZE),
+        )
+    except pa.ArrowInvalid as e:
+        raise UnsupportedJsonBlockError(str(e))
+    # Blank lines are skipped by the parser, so rows can't be mapped to lines
+    if table.num_rows != len(starts):
+        raise UnsupportedJsonBlockError("Rows don't match lines")
+    indices = np.flatnonzero(get_arrow_mask(table, plan))
+    deleted = [(position + starts[i], position + ends[i]) for i in indices]
+    return len(starts), deleted
+
+
+def get_deleted_lines(block, position, end, plan, can_match, first_row):
+    """
+    Parses the lines of block[position:end] one at a time. Returns the number
+    of lines and the (start, end) offsets of the lines to delete
+    """
+    rows = 0
+    deleted = []
+    while position < end:
+        line_end = block.find(b"\n", position, end)
+        next_position = end if line_end == -1 else line_end + 1
+        line = block[position : end if line_end == -1 else line_end]
+        rows += 1
+        if not can_match or can_match(line):
             try:
-                parsed = json.loads(line)
+                parsed = decode(line)
             except (json.JSONDecodeError) as e:
                 raise ValueError(
                     "Serialization error when processing JSON object: {}".format(
-                        str(e).replace("line 1", "line {}".format(i + 1))
+                        str(e).replace("line 1", "line {}".format(first_row + rows))
                     )
                 )
-            should_delete = False
-            for column in to_delete:
-                if column["Type"] == "Simple":
-                    record = get_value(column["Column"], parsed)
-                    if record and record in column["MatchIds"]:
-                        should_delete = True
-                        break
-                else:
-                    matched = []
-                    for col in column["Columns"]:
-                        record = get_value(col, parsed)
-                        if record:
-                            matched.append(record)
-                    if matched in column["MatchIds"]:
-                        should_delete = True
-                        break
-            if should_delete:
-                deleted_rows += 1
-            else:
-                writer.write(bytes(line + "\n", "utf-8"))
-        if compressed:
-            writer.close()
-        stats = Counter({"ProcessedRows": total_rows, "DeletedRows": deleted_rows})
-        return out_stream, stats
+            if is_match(parsed, plan):
+                deleted.append((position, next_position))
+        position = next_position
+    return rows, deleted
+
+
+def find_deleted_lines(block, position, end, plan, can_match, engine, first_row):
+    """
+    Returns the number of lines of block[position:end] and the (start, end)
+    offsets of the lines to delete, using the given engine
+    """
+    if engine == "arrow":
+        try:
+            if can_match and not can_match(block[position:end]):
+                rows = block.count(b"\n", position, end)
+                return rows + (block[end - 1 : end] != b"\n"), []
+            return get_deleted_lines_with_arrow(block, position, end, plan)
+        except UnsupportedJsonBlockError as e:
+            logger.debug("Parsing block line by line: %s", str(e))
+    return get_deleted_lines(block, position, end, plan, can_match, first_row)
+
+
+def get_size(input_file):
+    position = input_file.tell()
+    size = input_file.seek(0, SEEK_END)
+    input_file.seek(position)
+    return size
+
+
+def delete_matches_from_json_file(
+    input_file,
+    to_delete,
+    compressed=False,
+    out_stream=None,
+    engine=None,
+    compression_level=None,
+    parallel_threshold=PARALLEL_SIZE_THRESHOLD,
+    workers=PARALLEL_WORKERS,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+):
+    """
+    Deletes matches from a newline delimited JSON file, reading it in blocks
+    and writing the lines to keep to out_stream (an in-memory buffer by
+    default) as they are processed, so that memory usage doesn't depend on
+    the size of the file. Lines which can't contain any MatchId according to
+    the prefilter are kept without being parsed. Contiguous lines to keep
+    are written as slices of the input blocks, so they are byte-identical
+    to the input. A newline is added after the last line if it's missing.
+
+    With the "arrow" engine, each block is parsed with pyarrow.json, falling
+    back to parsing it line by line if its schema can't be handled.
+
+    Uncompressed files of at least parallel_threshold bytes have their blocks
+    processed by a pool of worker processes, at most workers + queue_depth
+    blocks ahead of the one being written. Compressed output is written with
+    the codec of the input and compression_level, when the codec supports it
+    """
+    plan = get_match_plan(to_delete)
+    if out_stream is None:
+        out_stream = BufferOutputStream()
+    parallel = (
+        not compressed and workers > 1 and get_size(input_file) >= parallel_threshold
+    )
+    input_file, compressor = open_streams(
+        input_file, out_stream, compressed, compression_level, READ_BUFFER_SIZE
+    )
+    executor = None
+    try:
+        can_match = get_prefilter(plan)
+        writer = ChunkedWriter(compressor or out_stream, WRITE_BUFFER_SIZE)
+        if parallel:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=init_block_worker,
+                initargs=(to_delete, engine),
+            )
+        total_rows, deleted_rows = write_retained_lines(
+            input_file, writer, plan, can_match, engine, executor, workers, queue_depth
+        )
+    except BaseException:
+        # Writers other than ParallelGzipWriter don't have workers to stop
+        if hasattr(compressor, "abort"):
+            compressor.abort()
+        raise
+    finally:
+        if executor:
+            executor.shutdown()
+    if compressor:
+        compressor.close()
+    stats = Counter({"ProcessedRows": total_rows, "DeletedRows": deleted_rows})
+    return out_stream, stats
+
+
+# Match plan, prefilter and engine of the processes processing blocks
+block_worker = {}
+
+
+def init_block_worker(to_delete, engine):
+    """
+    Builds the match plan and the prefilter used by find_in_block once per
+    process of the pool processing the blocks of a file
+    """
+    plan = get_match_plan(to_delete)
+    block_worker.update(plan=plan, can_match=get_prefilter(plan), engine=engine)
+
+
+def find_in_block(item):
+    """
+    Returns the lines of a block to delete in a process initialised with
+    init_block_worker, or None if the block has a serialization error: line
+    numbers of errors depend on the previous blocks, so blocks with errors
+    are processed again in order
+    """
+    try:
+        return find_deleted_lines(
+            *item,
+            block_worker["plan"],
+            block_worker["can_match"],
+            block_worker["engine"],
+            0
+        )
+    except ValueError:
+        return None
+
+
+def write_retained_lines(
+    input_file, writer, plan, can_match, engine, executor, workers, queue_depth
+):
+    """
+    Writes the lines of input_file which don't match to writer and returns
+    the number of lines processed and deleted. Blocks are sent to executor,
+    if any, to be processed ahead of the one being written
+    """
+    total_rows = 0
+    deleted_rows = 0
+    missing_newline = False
+
+    blocks = read_blocks(input_file, READ_BUFFER_SIZE)
+    if executor:
+        # Only the lines to delete are sent back, the blocks are kept here
+        sent = deque()
+
+        def send(items):
+            for item in items:
+                sent.append(item)
+                yield item
+
+        deleted_lines = parallel_map(
+            find_in_block, send(blocks), workers, queue_depth, executor
+        )
+        results = ((sent.popleft(), lines) for lines in deleted_lines)
+    else:
+        results = ((item, None) for item in blocks)
+    for (block, position, end), found in results:
+        rows, deleted = found or find_deleted_lines(
+            block, position, end, plan, can_match, engine, total_rows
+        )
+        total_rows += rows
+        deleted_rows += len(deleted)
+        view = memoryview(block)
+        kept = position
+        for start, next_position in deleted:
+            if kept < start:
+                writer.write(view[kept:start])
+            kept = next_position
+        if kept < end:
+            writer.write(view[kept:end])
+        missing_newline = kept < end and block[end - 1 : end] != b"\n"
+    if missing_newline:
+        writer.write(b"\n")
+    writer.flush()
+    return total_rows, deleted_rows
@@ -5,28 +5,34 @@ import sys
 import signal
 import time
 import logging
-from multiprocessing import Pool, cpu_count
+from functools import lru_cache
+from multiprocessing import cpu_count
 from operator import itemgetter
 
 import boto3
-import pyarrow as pa
 import s3fs
 from boto_utils import parse_s3_url, get_session
 from botocore.exceptions import ClientError
 from pyarrow.lib import ArrowException
 
+from compression import detect_codec
+from csv_handler import delete_matches_from_csv_file
 from events import sanitize_message, emit_failure_event, emit_deletion_event
+from heartbeat import HEARTBEAT_INTERVAL, VISIBILITY_TIMEOUT, VisibilityHeartbeat
 from json_handler import delete_matches_from_json_file
+from match_plan import MatchPlan, get_plan_path, read_cached_columns
 from parquet_handler import delete_matches_from_parquet_file
 from s3 import (
+    download_match_plan,
     validate_bucket_versioning,
-    save,
+    MultipartUploadStream,
     verify_object_versions_integrity,
     delete_old_versions,
     IntegrityCheckFailedError,
     rollback_object_version,
     DeleteOldVersionsError,
 )
+from worker_pool import WorkerPool
 
 logger = logging.getLogger(__name__)
 logger.setLevel(os.getenv("LOG_LEVEL", logging.INFO))
@@ -35,6 +41,14 @@ handler = logging.StreamHandler(stream=sys.stdout)
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+MATCH_PLAN_CACHE_SIZE = int(os.getenv("MATCH_PLAN_CACHE_SIZE", 16))
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 16))
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", 300))
+RSS_WATERMARK = int(os.getenv("WORKER_RSS_WATERMARK", 2048))
+PREFETCH_MESSAGES = int(os.getenv("PREFETCH_MESSAGES", 1))
+# Maximum number of messages returned by a ReceiveMessage call
+RECEIVE_BATCH_SIZE = 10
+
 
 def handle_error(
     sqs_msg,
@@ -54,31 +68,123 @@ def handle_error(
         logger.error("Unable to emit failure event: %s", str(e))
 
     if change_msg_visibility:
-        try:
-            sqs_msg.change_visibility(VisibilityTimeout=0)
-        except (
-            sqs_msg.meta.client.exceptions.MessageNotInflight,
-            sqs_msg.meta.client.exceptions.ReceiptHandleIsInvalid,
-        ) as e:
-            logger.error("Unable to change message visibility: %s", str(e))
+        reset_visibility(sqs_msg)
+
+
+def reset_visibility(sqs_msg):
+    try:
+        sqs_msg.change_visibility(VisibilityTimeout=0)
+    except (
+        sqs_msg.meta.client.exceptions.MessageNotInflight,
+        sqs_msg.meta.client.exceptions.ReceiptHandleIsInvalid,
+    ) as e:
+        logger.error("Unable to change message visibility: %s", str(e))
 
 
 def validate_message(message):
     body = json.loads(message)
-    mandatory_keys = ["JobId", "Object", "Columns"]
+    mandatory_keys = ["JobId", "Object"]
     for k in mandatory_keys:
         if k not in body:
             raise ValueError("Malformed message. Missing key: %s", k)
+    if "Columns" not in body and "ColumnsHash" not in body:
+        raise ValueError("Malformed message. Missing key: %s", "Columns")
+
+
+@lru_cache(maxsize=MATCH_PLAN_CACHE_SIZE)
+def load_match_plan(job_id, plan_hash):
+    """
+    Returns the compiled match plan for the columns of a job offloaded to the
+    match plan bucket with the given hash. Columns are downloaded once per
+    task to a local cache shared by its processes, and compiled once per
+    process
+    """
+    path = get_plan_path(plan_hash)
+    if not os.path.exists(path):
+        logger.info("Downloading match plan %s", plan_hash)
+        download_match_plan(
+            boto3.client("s3"), os.getenv("MatchPlanBucket"), job_id, plan_hash, path
+        )
+    return MatchPlan(read_cached_columns(plan_hash))
 
 
-def delete_matches_from_file(input_file, to_delete, file_format, compressed=False):
+@lru_cache(maxsize=SESSION_CACHE_SIZE)
+def get_cached_session(role_arn, period):
+    session = get_session(role_arn)
+    return session, session.client("s3")
+
+
+def get_session_and_client(role_arn):
+    """
+    Returns a session for the role and an S3 client. As workers process many
+    messages, they are reused for up to SESSION_TTL seconds so that roles
+    aren't assumed again and the S3 lookups cached by client are kept
+    """
+    return get_cached_session(role_arn, int(time.time() // SESSION_TTL))
+
+
+def get_columns(body):
+    """
+    Returns the columns to delete from a message, which either contains them
+    or the hash of the columns offloaded to the match plan bucket
+    """
+    if "ColumnsHash" in body:
+        return load_match_plan(body["JobId"], body["ColumnsHash"])
+    return body["Columns"]
+
+
+def delete_matches_from_file(
+    input_file,
+    to_delete,
+    file_format,
+    compressed=False,
+    out_stream=None,
+    format_options=None,
+):
     logger.info("Generating new file without matches")
+    format_options = format_options or {}
     if file_format == "json":
-        return delete_matches_from_json_file(input_file, to_delete, compressed)
-    return delete_matches_from_parquet_file(input_file, to_delete)
+        return delete_matches_from_json_file(
+            input_file,
+            to_delete,
+            compressed,
+            out_stream,
+            engine=format_options.get("JsonEngine"),
+            compression_level=format_options.get("CompressionLevel"),
+        )
+    if file_format == "csv":
+        return delete_matches_from_csv_file(
+            input_file,
+            to_delete,
+            compressed,
+            out_stream,
+            format_options=format_options,
+            compression_level=format_options.get("CompressionLevel"),
+        )
+    return delete_matches_from_parquet_file(
+        input_file,
+        to_delete,
+        out_stream=out_stream,
+        compression=format_options.get("Compression"),
+        compression_level=format_options.get("CompressionLevel"),
+    )
+
+
+def validate_deletions(stats, object_path):
+    if stats["DeletedRows"] == 0:
+        raise ValueError(
+            "The object {} was processed successfully but no rows required deletion".format(
+                object_path
+            )
+        )
 
 
 def execute(queue_url, message_body, receipt_handle):
+    """
+    Processes a message, returning whether it was deleted from the queue. The
+    visibility of messages which couldn't be processed is reset by the caller
+    once they are no longer extended by the heartbeat
+    """
     logger.info("Message received")
     queue = get_queue(queue_url)
     msg = queue.Message(receipt_handle)
@@ -86,11 +192,9 @@ def execute(queue_url, message_body, receipt_handle):
         # Parse and validate incoming message
         validate_message(message_body)
         body = json.loads(message_body)
-        session = get_session(body.get("RoleArn"))
-        client = session.client("s3")
-        cols, object_path, job_id, file_format = itemgetter(
-            "Columns", "Object", "JobId", "Format"
-        )(body)
+        session, client = get_session_and_client(body.get("RoleArn"))
+        object_path, job_id, file_format = itemgetter("Object", "JobId", "Format")(body)
+        cols = get_columns(body)
         input_bucket, input_key = parse_s3_url(object_path)
         validate_bucket_versioning(client, input_bucket)
         creds = session.get_credentials().get_frozen_credentials()
@@ -103,24 +207,27 @@ def execute(queue_url, message_body, receipt_handle):
             default_fill_cache=False,
             version_aware=True,
         )
-        # Download the object in-memory and convert to PyArrow NativeFile
-        logger.info("Downloading and opening %s object in-memory", object_path)
+        logger.info("Opening %s object", object_path)
         with s3.open(object_path, "rb") as f:
             source_version = f.version_id
             logger.info("Using object version %s as source", source_version)
-            # Write new file in-memory
-            compressed = object_path.endswith(".gz")
-            out_sink, stats = delete_matches_from_file(f, cols, file_format, compressed)
-        if stats["DeletedRows"] == 0:
-            raise ValueError(
-                "The object {} was processed successfully but no rows required deletion".format(
-                    object_path
-                )
-            )
-        with pa.BufferReader(out_sink.getvalue()) as output_buf:
-            new_version = save(
-                s3, client, output_buf, input_bucket, input_key, source_version
+            compressed = detect_codec(
+                object_path, f if file_format != "parquet" else None
             )
+            # Stream new file to S3 as it is generated
+            with MultipartUploadStream(
+                client, input_bucket, input_key, source_version
+            ) as out_stream:
+                _, stats = delete_matches_from_file(
+                    f,
+                    cols,
+                    file_format,
+                    compressed,
+                    out_stream,
+                    body.get("FormatOptions"),
+                )
+                validate_deletions(stats, object_path)
+            new_version = out_stream.version_id
         logger.info("New object version: %s", new_version)
         verify_object_versions_integrity(
             client, input_bucket, input_key, source_version, new_version
@@ -134,34 +241,35 @@ def execute(queue_url, message_body, receipt_handle):
             delete_old_versions(client, input_bucket, input_key, new_version)
         msg.delete()
         emit_deletion_event(body, stats)
+        return True
     except (KeyError, ArrowException) as e:
         err_message = "Apache Arrow processing error: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except IOError as e:
         err_message = "Unable to retrieve object: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except MemoryError as e:
         err_message = "Insufficient memory to work on object: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except ClientError as e:
         err_message = "ClientError: {}".format(str(e))
         if e.operation_name == "PutObjectAcl":
             err_message += ". Redacted object uploaded successfully but unable to restore WRITE ACL"
         if e.operation_name == "ListObjectVersions":
             err_message += ". Could not verify redacted object version integrity"
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except ValueError as e:
         err_message = "Unprocessable message: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except DeleteOldVersionsError as e:
         err_message = "Unable to delete previous versions: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
     except IntegrityCheckFailedError as e:
         err_description, client, bucket, key, version_id = e.args
         err_message = "Object version integrity check failed: {}".format(
             err_description
         )
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
         rollback_object_version(
             client,
             bucket,
@@ -173,11 +281,14 @@ def execute(queue_url, message_body, receipt_handle):
         )
     except Exception as e:
         err_message = "Unknown error during message processing: {}".format(str(e))
-        handle_error(msg, message_body, err_message)
+        handle_error(msg, message_body, err_message, change_msg_visibility=False)
+    return False
 
 
-def kill_handler(msgs, process_pool):
+def kill_handler(msgs, process_pool, heartbeat=None):
     logger.info("Received shutdown signal. Cleaning up %s messages", str(len(msgs)))
+    if heartbeat:
+        heartbeat.stop()
     process_pool.terminate()
     for msg in msgs:
         try:
@@ -196,25 +307,79 @@ def get_queue(queue_url, **resource_kwargs):
     return sqs.Queue(queue_url)
 
 
-def main(queue_url, max_messages, wait_time, sleep_time):
+def main(
+    queue_url,
+    max_messages,
+    wait_time,
+    sleep_time,
+    rss_watermark=RSS_WATERMARK,
+    prefetch=PREFETCH_MESSAGES,
+    visibility_timeout=VISIBILITY_TIMEOUT,
+    heartbeat_interval=HEARTBEAT_INTERVAL,
+):
+    """
+    Keeps up to max_messages messages in flight in a pool of long-lived
+    workers, which are replaced once their resident set size exceeds
+    rss_watermark MiB. With a watermark of 0, each message is processed by a
+    new worker. More messages are received as soon as any of them is
+    processed, so a large object doesn't hold up the other workers, and up
+    to prefetch extra messages are received ahead, waiting for a worker.
+    Whilst messages are in flight, their visibility timeout is set to
+    visibility_timeout seconds every heartbeat_interval seconds
+    """
     logger.info("CPU count for system: %s", cpu_count())
-    messages = []
+    in_flight = {}
     queue = get_queue(queue_url)
-    with Pool(maxtasksperchild=1) as pool:
-        signal.signal(signal.SIGINT, lambda *_: kill_handler(messages, pool))
-        signal.signal(signal.SIGTERM, lambda *_: kill_handler(messages, pool))
+    capacity = max_messages + prefetch
+    with WorkerPool(
+        processes=max_messages, rss_watermark=rss_watermark * 1024 * 1024
+    ) as pool, VisibilityHeartbeat(
+        queue.meta.client, queue_url, in_flight, visibility_timeout, heartbeat_interval
+    ) as heartbeat:
+        signal.signal(
+            signal.SIGINT,
+            lambda *_: kill_handler(list(in_flight.values()), pool, heartbeat),
+        )
+        signal.signal(
+            signal.SIGTERM,
+            lambda *_: kill_handler(list(in_flight.values()), pool, heartbeat),
+        )
         while 1:
-            logger.info("Fetching messages...")
-            messages = queue.receive_messages(
-                WaitTimeSeconds=wait_time, MaxNumberOfMessages=max_messages
-            )
-            if len(messages) == 0:
+            received = []
+            if len(in_flight) < capacity:
+                logger.info("Fetching messages...")
+                received = queue.receive_messages(
+                    WaitTimeSeconds=0 if in_flight else wait_time,
+                    MaxNumberOfMessages=min(
+                        capacity - len(in_flight), RECEIVE_BATCH_SIZE
+                    ),
+                )
+                for m in received:
+                    task_id = pool.submit(
+                        execute, (queue_url, m.body, m.receipt_handle)
+                    )
+                    in_flight[task_id] = m
+            if not in_flight:
                 logger.info("No messages. Sleeping")
                 time.sleep(sleep_time)
-            else:
-                processes = [(queue_url, m.body, m.receipt_handle) for m in messages]
-                pool.starmap(execute, processes)
-                messages = []
+                continue
+            if received and len(in_flight) < capacity:
+                continue
+            # Wait for a worker, polling the queue again after sleep_time
+            # seconds if messages can still be prefetched
+            result = pool.get_result(
+                timeout=sleep_time if len(in_flight) < capacity else None
+            )
+            if result:
+                task_id, success, value = result
+                msg = heartbeat.discard(task_id)
+                if not success:
+                    # Errors are handled by execute unless the worker died
+                    handle_error(
+                        msg, msg.body, "Unable to process message: {}".format(value)
+                    )
+                elif not value:
+                    reset_visibility(msg)
 
 
 def parse_args(args):
@@ -224,6 +389,10 @@ def parse_args(args):
     parser.add_argument("--wait_time", type=int, default=5)
     parser.add_argument("--max_messages", type=int, default=1)
     parser.add_argument("--sleep_time", type=int, default=30)
+    parser.add_argument("--rss_watermark", type=int, default=RSS_WATERMARK)
+    parser.add_argument("--prefetch", type=int, default=PREFETCH_MESSAGES)
+    parser.add_argument("--visibility_timeout", type=int, default=VISIBILITY_TIMEOUT)
+    parser.add_argument("--heartbeat_interval", type=int, default=HEARTBEAT_INTERVAL)
     parser.add_argument(
         "--queue_url", type=str, default=os.getenv("DELETE_OBJECTS_QUEUE")
     )
@@ -232,4 +401,13 @@ def parse_args(args):
 
 if __name__ == "__main__":
     opts = parse_args(sys.argv[1:])
-    main(opts.queue_url, opts.max_messages, opts.wait_time, opts.sleep_time)
+    main(
+        opts.queue_url,
+        opts.max_messages,
+        opts.wait_time,
+        opts.sleep_time,
+        opts.rss_watermark,
+        opts.prefetch,
+        opts.visibility_timeout,
+        opts.heartbeat_interval,
+    )
@@ -0,0 +1,162 @@
+"""
+Match plans are compiled once from the Columns of a deletion message and
+shared by the format handlers, so that MatchIds are indexed and converted
+once per message rather than once per row, block or row group.
+"""
+import json
+import os
+import re
+import tempfile
+
+PLAN_CACHE_DIR = os.getenv(
+    "MATCH_PLAN_CACHE_DIR", os.path.join(tempfile.gettempdir(), "match_plans")
+)
+PLAN_HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+
+def to_set(items):
+    """
+    Returns a set of items, or None if some of them aren't hashable
+    """
+    try:
+        return set(items)
+    except TypeError:
+        return None
+
+
+def distinct(values):
+    """
+    Returns the distinct values in order of first appearance
+    """
+    values = list(values)
+    try:
+        return list(dict.fromkeys(values))
+    except TypeError:
+        unique = []
+        for value in values:
+            if value not in unique:
+                unique.append(value)
+        return unique
+
+
+def to_tuple(match_id):
+    """
+    Composite MatchIds are lists, which are compared to the lists of values
+    of a row. They are stored as tuples so that they can be hashed
+    """
+    return tuple(match_id) if isinstance(match_id, (list, tuple)) else match_id
+
+
+class ColumnPlan:
+    """
+    Compiled form of one of the Columns of a deletion message:
+    - identifiers: the column identifiers, a single one for simple columns
+    - paths: the identifiers split in lowercase segments
+    - match_ids: the MatchIds, as tuples for composite columns
+    - values: for each identifier, the distinct values of the MatchIds
+    """
+
+    def __init__(self, column):
+        self.simple = column["Type"] == "Simple"
+        if self.simple:
+            self.identifiers = [column["Column"]]
+            self.match_ids = list(column["MatchIds"])
+            self.values = [distinct(self.match_ids)]
+        else:
+            self.identifiers = list(column["Columns"])
+            self.match_ids = [to_tuple(m) for m in column["MatchIds"]]
+            self.values = [
+                distinct(
+                    m[i] for m in self.match_ids if isinstance(m, tuple) and len(m) > i
+                )
+                for i in range(len(self.identifiers))
+            ]
+        self.paths = [
+            tuple(segment.lower() for segment in identifier.split("."))
+            for identifier in self.identifiers
+        ]
+        self.match_set = to_set(self.match_ids)
+        self.typed_values = {}
+
+    def contains(self, value):
+        """
+        Tells whether a value (a list of values for composite columns) is
+        equal to one of the MatchIds, as a membership test on the MatchIds
+        list would, but in constant time when the value can be hashed
+        """
+        if not self.simple:
+            value = to_tuple(value)
+        if self.match_set is not None:
+            try:
+                return value in self.match_set
+            except TypeError:
+                pass
+        return value in self.match_ids
+
+    def get_typed_values(self, index, arrow_type, convert):
+        """
+        Returns convert(values, arrow_type) for the distinct values of the
+        identifier at index. The result is computed once per column type, so
+        convert should be a module level function rather than a lambda
+        """
+        key = (index, arrow_type, convert)
+        if key not in self.typed_values:
+            self.typed_values[key] = convert(self.values[index], arrow_type)
+        return self.typed_values[key]
+
+
+class MatchPlan:
+    """
+    Compiled form of the Columns of a deletion message, iterating over the
+    ColumnPlan of each column
+    """
+
+    def __init__(self, to_delete):
+        self.columns = [ColumnPlan(column) for column in to_delete]
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+    def get_identifiers(self):
+        return list(
+            dict.fromkeys(
+                identifier
+                for column in self.columns
+                for identifier in column.identifiers
+            )
+        )
+
+
+def get_match_plan(to_delete):
+    """
+    Compiles the Columns of a deletion message, unless they already are a
+    compiled MatchPlan
+    """
+    if isinstance(to_delete, MatchPlan):
+        return to_delete
+    return MatchPlan(to_delete)
+
+
+def get_plan_path(plan_hash):
+    """
+    Returns the path of the local copy of the columns offloaded to the state
+    bucket with the given SHA-256 hash
+    """
+    if not isinstance(plan_hash, str) or not PLAN_HASH_PATTERN.match(plan_hash):
+        raise ValueError("Invalid match plan hash: {}".format(plan_hash))
+    return os.path.join(PLAN_CACHE_DIR, "{}.json".format(plan_hash))
+
+
+def read_cached_columns(plan_hash):
+    """
+    Returns the columns with the given hash from the local cache, or None if
+    they haven't been downloaded
+    """
+    path = get_plan_path(plan_hash)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return json.load(f)
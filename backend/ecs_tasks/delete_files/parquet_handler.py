@@ -1,15 +1,46 @@
 import logging
+import operator
+import os
+from bisect import bisect_left
 from collections import Counter
+from functools import reduce
 
 import numpy as np
 import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 
+from match_plan import get_match_plan
+from parquet_raw import PageReader, RawParquetWriter, UnsupportedParquetFileError
+from utils import prefetch, parallel_map, BackgroundConsumer
+
 logger = logging.getLogger(__name__)
 
+PIPELINE_QUEUE_DEPTH = int(os.getenv("PARQUET_PIPELINE_QUEUE_DEPTH", 2))
+PARALLEL_SIZE_THRESHOLD = int(
+    os.getenv("PARQUET_PARALLEL_SIZE_THRESHOLD", 1024 * 1024 * 1024)
+)
+PARALLEL_WORKERS = int(os.getenv("PARQUET_PARALLEL_WORKERS", os.cpu_count() or 1))
+
+# Codecs recorded in Parquet footers and the matching ParquetWriter codecs
+WRITER_CODECS = {
+    "UNCOMPRESSED": "NONE",
+    "SNAPPY": "SNAPPY",
+    "GZIP": "GZIP",
+    "BROTLI": "BROTLI",
+    "LZ4": "LZ4",
+    "LZ4_RAW": "LZ4",
+    "ZSTD": "ZSTD",
+}
+WRITER_VERSIONS = ["1.0", "2.4", "2.6"]
+# Codecs which accept a compression level
+LEVEL_CODECS = ["GZIP", "BROTLI", "LZ4", "ZSTD"]
+# Number of composite keys which can be represented with int64 values
+MAX_COMPOSITE_KEYS = 2 ** 63
+
 
-def load_parquet(f):
-    return pq.ParquetFile(f, memory_map=False)
+def load_parquet(f, **kwargs):
+    return pq.ParquetFile(f, memory_map=False, **kwargs)
 
 
 def case_insensitive_getter(from_array, value):
@@ -24,52 +55,178 @@ def case_insensitive_getter(from_array, value):
     return next(x for x in from_array if value.lower() == x.lower())
 
 
-def get_row_indexes_to_delete_for_composite(table, identifiers, to_delete):
+def get_value_set(values, arrow_type):
     """
-    Iterates over the values of a particular group of columns and returns a
-    numpy mask identifying the rows to delete. The column identifier is a
-    list of simple or complex identifiers, like ["user_first_name", "user.last_name"]
+    Converts a list of MatchIds to an Arrow array of the given type so that it
+    can be used as value set by the compute kernels. Values which cannot be
+    represented with the column type, or which would be altered by the
+    conversion (for instance 12.5 in an int column), are dropped as they could
+    never be equal to any of the values of the column.
     """
-    indexes = []
-    data = {}
-    for identifier in identifiers:
-        column_first_level = identifier.split(".")[0].lower()
-        if not column_first_level in data:
-            column_identifier = case_insensitive_getter(
-                table.column_names, column_first_level
-            )
-            data[column_first_level] = table.column(column_identifier).to_pylist()
-    for i in range(table.num_rows):
-        values_array = []
-        for identifier in identifiers:
-            segments = identifier.split(".")
-            current = data[segments[0].lower()][i]
-            for j in range(1, len(segments)):
-                next_segment = case_insensitive_getter(
-                    list(current.keys()), segments[j]
-                )
-                current = current[next_segment]
-            values_array.append(current)
-        indexes.append(values_array in to_delete)
-    return np.array(indexes)
-
-
-def get_row_indexes_to_delete(table, identifier, to_delete):
-    """
-    Iterates over the values of a particular column and returns a
-    numpy mask identifying the rows to delete. The column identifier
-    can be simple like "customer_id" or complex like "user.info.id"
+    try:
+        typed = pa.array(values, type=arrow_type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        typed = None
+    if typed is not None and typed.to_pylist() == list(values):
+        return typed
+    compatible = []
+    for value in values:
+        try:
+            if pa.array([value], type=arrow_type).to_pylist() == [value]:
+                compatible.append(value)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            continue
+    return pa.array(compatible, type=arrow_type)
+
+
+def get_value_list(values, arrow_type):
+    """
+    Returns the MatchIds which can be found in a column of the given type,
+    converted like get_value_set
+    """
+    return get_value_set(values, arrow_type).to_pylist()
+
+
+def get_column(table, identifier):
+    """
+    Returns the (possibly nested) column identified by a simple identifier like
+    "customer_id" or a complex one like "user.info.id". Nested fields are
+    resolved case insensitively by position, so no Python objects are created.
     """
-    indexes = []
     segments = identifier.split(".")
     column_identifier = case_insensitive_getter(table.column_names, segments[0])
-    for obj in table.column(column_identifier).to_pylist():
-        current = obj
-        for i in range(1, len(segments)):
-            next_segment = case_insensitive_getter(list(current.keys()), segments[i])
-            current = current[next_segment]
-        indexes.append(current in to_delete)
-    return np.array(indexes)
+    column = table.column(column_identifier)
+    for segment in segments[1:]:
+        names = [field.name for field in column.type]
+        field_name = case_insensitive_getter(names, segment)
+        column = pc.struct_field(column, [names.index(field_name)])
+    return column
+
+
+def get_value_type(arrow_type):
+    """
+    Returns the type of the values of a column, which for dictionary encoded
+    columns is the type of the dictionary
+    """
+    if pa.types.is_dictionary(arrow_type):
+        return arrow_type.value_type
+    return arrow_type
+
+
+def apply_to_values(column, fn, result_type):
+    """
+    Applies a vectorised function to the values of a column. For dictionary
+    encoded columns, fn is evaluated once per distinct value against the
+    dictionary and the results are mapped to the rows through the indices, so
+    the cost is proportional to the number of distinct values rather than to
+    the number of rows. Other columns are evaluated directly
+    """
+    if not pa.types.is_dictionary(column.type):
+        return fn(column)
+    return pa.chunked_array(
+        [pc.take(fn(chunk.dictionary), chunk.indices) for chunk in column.chunks],
+        type=result_type,
+    )
+
+
+def get_row_indexes_to_delete_for_composite(table, column_plan):
+    """
+    Returns a boolean mask identifying the rows to delete for a group of
+    columns. The column identifier is a list of simple or complex identifiers,
+    like ["user_first_name", "user.last_name"]. Each column is mapped to the
+    position of its value in the set of MatchIds for that column, and the
+    positions are combined into a single key which is then looked up in the
+    set of keys of the MatchIds tuples. When the keys wouldn't fit in int64,
+    the tuples of positions of the rows found in every set are checked instead
+    """
+    columns = [get_column(table, identifier) for identifier in column_plan.identifiers]
+    indexes = []
+    sizes = []
+    match_positions = [[] for _ in column_plan.match_ids]
+    for i, column in enumerate(columns):
+        value_set = column_plan.get_typed_values(
+            i, get_value_type(column.type), get_value_set
+        )
+        positions = {value: pos for pos, value in enumerate(value_set.to_pylist())}
+        indexes.append(
+            apply_to_values(
+                column,
+                lambda values: pc.cast(
+                    pc.index_in(values, value_set=value_set), pa.int64()
+                ),
+                pa.int64(),
+            )
+        )
+        sizes.append(len(positions))
+        for match_position, match in zip(match_positions, column_plan.match_ids):
+            match_position.append(positions.get(match[i]))
+    match_positions = [p for p in match_positions if None not in p]
+    if reduce(operator.mul, sizes, 1) > MAX_COMPOSITE_KEYS:
+        return get_rows_with_positions(indexes, match_positions, table.num_rows)
+    keys = indexes[0]
+    for index, size in zip(indexes[1:], sizes[1:]):
+        keys = pc.add_checked(pc.multiply_checked(keys, size), index)
+    match_keys = pa.array(
+        [
+            reduce(lambda key, item: key * item[1] + item[0], zip(p, sizes), 0)
+            for p in match_positions
+        ],
+        type=pa.int64(),
+    )
+    return pc.fill_null(pc.is_in(keys, value_set=match_keys), False)
+
+
+def get_rows_with_positions(indexes, match_positions, num_rows):
+    """
+    Returns a boolean mask identifying the rows whose tuple of positions in
+    the sets of MatchIds of each column is one of match_positions. Only the
+    rows found in every set are converted to Python objects
+    """
+    candidates = np.ones(num_rows, dtype=bool)
+    for index in indexes:
+        candidates &= pc.is_valid(index).to_numpy(zero_copy_only=False)
+    mask = np.zeros(num_rows, dtype=bool)
+    rows = np.flatnonzero(candidates)
+    if len(rows) == 0:
+        return pa.array(mask)
+    expected = set(map(tuple, match_positions))
+    values = [pc.take(index, pa.array(rows)).to_pylist() for index in indexes]
+    for row, position in zip(rows, zip(*values)):
+        mask[row] = position in expected
+    return pa.array(mask)
+
+
+def get_row_indexes_to_delete(table, identifier, column_plan):
+    """
+    Returns a boolean mask identifying the rows to delete where the value of a
+    particular column is one of the MatchIds of a simple column plan. The
+    column identifier can be simple like "customer_id" or complex like
+    "user.info.id"
+    """
+    column = get_column(table, identifier)
+    value_set = column_plan.get_typed_values(
+        0, get_value_type(column.type), get_value_set
+    )
+    mask = apply_to_values(
+        column, lambda values: pc.is_in(values, value_set=value_set), pa.bool_()
+    )
+    return pc.fill_null(mask, False)
+
+
+def get_rows_to_delete(table, plan):
+    """
+    Returns a boolean mask identifying the rows of an Arrow Table where any of
+    the MatchIds is found as value in any of the columns
+    """
+    mask = pc.fill_null(pa.nulls(table.num_rows, type=pa.bool_()), False)
+    for column in plan:
+        indexes = (
+            get_row_indexes_to_delete(table, column.identifiers[0], column)
+            if column.simple
+            else get_row_indexes_to_delete_for_composite(table, column)
+        )
+        mask = pc.or_(mask, indexes)
+    return mask
 
 
 def delete_from_table(table, to_delete):
@@ -78,39 +235,524 @@ def delete_from_table(table, to_delete):
     value in any of the columns
     """
     initial_rows = table.num_rows
-    for column in to_delete:
-        indexes = (
-            get_row_indexes_to_delete(table, column["Column"], column["MatchIds"])
-            if column["Type"] == "Simple"
-            else get_row_indexes_to_delete_for_composite(
-                table, column["Columns"], column["MatchIds"]
-            )
-        )
-        table = table.filter(~indexes)
+    plan = get_match_plan(to_delete)
+    table = table.filter(pc.invert(get_rows_to_delete(table, plan)))
     deleted_rows = initial_rows - table.num_rows
     return table, deleted_rows
 
 
-def delete_matches_from_parquet_file(input_file, to_delete):
+def get_column_chunk(row_group_metadata, identifier):
+    """
+    Returns the metadata of the column chunk for the given identifier, or None
+    when the identifier doesn't map to a single leaf column (for instance for
+    repeated fields)
+    """
+    for i in range(row_group_metadata.num_columns):
+        column_chunk = row_group_metadata.column(i)
+        if column_chunk.path_in_schema.lower() == identifier.lower():
+            return column_chunk
+    return None
+
+
+def filter_by_statistics(column_chunk, values):
+    """
+    Returns the values which may be found in a column chunk according to the
+    min/max statistics stored in the footer of the Parquet file
+    """
+    if not column_chunk.is_stats_set:
+        return values
+    statistics = column_chunk.statistics
+    if statistics.has_null_count and statistics.null_count == column_chunk.num_values:
+        return []
+    if not statistics.has_min_max:
+        return values
+    try:
+        return [v for v in values if statistics.min <= v <= statistics.max]
+    except TypeError:
+        return values
+
+
+def filter_by_dictionary(dictionary_column, values):
+    """
+    Returns the values which are found in the dictionaries of a dictionary
+    encoded column. Dictionaries only hold the distinct values of the column,
+    so this is a lot cheaper than evaluating each row
+    """
+    if not values or not pa.types.is_dictionary(dictionary_column.type):
+        return values
+    value_set = pa.array(values, type=dictionary_column.type.value_type)
+    for chunk in dictionary_column.chunks:
+        found = pc.is_in(value_set, value_set=chunk.dictionary)
+        value_set = value_set.filter(pc.invert(found))
+    missing = set(value_set.to_pylist())
+    return [v for v in values if v not in missing]
+
+
+def get_candidate_values(parquet_file, dictionary_file, row_group, column_plan, index):
+    """
+    Returns the MatchIds for the identifier at index which cannot be ruled out
+    for a row group using the column statistics and, when the column chunk has
+    a dictionary page, the column dictionary
+    """
+    schema = parquet_file.schema_arrow
+    identifier = column_plan.identifiers[index]
+    column_type = get_value_type(get_column(schema.empty_table(), identifier).type)
+    candidates = column_plan.get_typed_values(index, column_type, get_value_list)
+    column_chunk = get_column_chunk(
+        parquet_file.metadata.row_group(row_group), identifier
+    )
+    if column_chunk is None:
+        return candidates
+    candidates = filter_by_statistics(column_chunk, candidates)
+    # Only top level columns are read as dictionaries, see get_dictionary_columns
+    if (
+        candidates
+        and dictionary_file
+        and "." not in identifier
+        and column_chunk.has_dictionary_page
+    ):
+        column_name = case_insensitive_getter(schema.names, identifier)
+        if column_name in dictionary_file.schema_arrow.names:
+            dictionary_column = dictionary_file.read_row_group(
+                row_group, columns=[column_name]
+            ).column(0)
+            candidates = filter_by_dictionary(dictionary_column, candidates)
+    return candidates
+
+
+def can_contain_matches(parquet_file, dictionary_file, row_group, plan):
+    """
+    Checks whether a row group may contain any of the MatchIds. A row group is
+    pruned only if it provably doesn't contain any match for all the columns
+    """
+
+    def candidates(column, index):
+        return get_candidate_values(
+            parquet_file, dictionary_file, row_group, column, index
+        )
+
+    for column in plan:
+        if column.simple:
+            if candidates(column, 0):
+                return True
+        else:
+            matches = column.match_ids
+            for i in range(len(column.identifiers)):
+                found = set(candidates(column, i))
+                matches = [m for m in matches if m[i] in found]
+            if matches:
+                return True
+    return False
+
+
+def get_dictionary_columns(parquet_file, plan):
+    """
+    Returns the top level identifier columns which are dictionary encoded in at
+    least one row group
+    """
+    identifiers = [
+        identifier for identifier in plan.get_identifiers() if "." not in identifier
+    ]
+    metadata = parquet_file.metadata
+    return list(
+        {
+            column_chunk.path_in_schema
+            for row_group in range(metadata.num_row_groups)
+            for column_chunk in [
+                get_column_chunk(metadata.row_group(row_group), identifier)
+                for identifier in identifiers
+            ]
+            if column_chunk is not None and column_chunk.has_dictionary_page
+        }
+    )
+
+
+def get_identifier_columns(parquet_file, row_group, plan):
+    """
+    Returns the paths of the columns referenced by the identifiers, so that
+    only the leaves needed to evaluate the matches are read from a row group
+    rather than the whole (possibly nested) top level column
+    """
+    row_group_metadata = parquet_file.metadata.row_group(row_group)
+    paths = []
+    for identifier in [i for column in plan for i in column.identifiers]:
+        column_chunk = get_column_chunk(row_group_metadata, identifier)
+        path = (
+            column_chunk.path_in_schema
+            if column_chunk
+            else case_insensitive_getter(
+                parquet_file.schema_arrow.names, identifier.split(".")[0]
+            )
+        )
+        if path not in paths:
+            paths.append(path)
+    return paths
+
+
+def get_page_bound(arrow_type):
+    """
+    Returns a function converting values of a column to the type of the min
+    and max values of its column index, or None if pages can't be compared
+    """
+    if pa.types.is_signed_integer(arrow_type):
+        return lambda value: value
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return lambda value: value.encode("utf-8")
+    return None
+
+
+def get_page_bounds(values, arrow_type):
+    """
+    Returns the sorted MatchIds which can be found in a column of the given
+    type, converted to the type of the min and max values of its column index
+    """
+    to_bound = get_page_bound(arrow_type)
+    return sorted(to_bound(value) for value in get_value_list(values, arrow_type))
+
+
+def get_row_indexes_to_delete_from_pages(page_reader, parquet_file, row_group, column):
+    """
+    Returns the mask of the rows of a row group matching a simple identifier,
+    decoding only the data pages whose min and max values can contain a
+    MatchId. Returns None if the page index of the column can't be used or
+    doesn't allow any page to be skipped
+    """
+    identifier = column.identifiers[0]
+    if "." in identifier:
+        return None
+    path = case_insensitive_getter(parquet_file.schema_arrow.names, identifier)
+    column_type = get_value_type(parquet_file.schema_arrow.field(path).type)
+    has_bounds = get_page_bound(column_type) is not None
+    pages = page_reader.get_pages(row_group, path) if has_bounds else None
+    if not pages:
+        return None
+    bounds = column.get_typed_values(0, column_type, get_page_bounds)
+    candidates = []
+    for page in pages:
+        i = bisect_left(bounds, page.min_value) if page.min_value is not None else 0
+        candidates.append(
+            page.min_value is not None
+            and i < len(bounds)
+            and bounds[i] <= page.max_value
+        )
+    if all(candidates):
+        return None
+    logger.info(
+        "Reading %s/%s pages of column %s", str(sum(candidates)), str(len(pages)), path
+    )
+    matches = None
+    if any(candidates):
+        selected = [page for page, candidate in zip(pages, candidates) if candidate]
+        table = pa.table({path: page_reader.read_pages(row_group, path, selected)})
+        matches = get_row_indexes_to_delete(table, path, column)
+    segments = []
+    offset = 0
+    for page, candidate in zip(pages, candidates):
+        if candidate:
+            segments.extend(matches.slice(offset, page.num_rows).chunks)
+            offset += page.num_rows
+        else:
+            segments.append(pa.repeat(False, page.num_rows))
+    return pa.chunked_array(segments, type=pa.bool_())
+
+
+def get_row_group_mask(
+    parquet_file, dictionary_file, row_group, plan, stats, page_reader=None
+):
+    """
+    Returns the mask of the rows to delete from a row group, or None if the
+    row group doesn't contain any match. When a page reader is given, simple
+    identifiers with a page index are evaluated reading only the pages which
+    can contain matches
+    """
+    if not can_contain_matches(parquet_file, dictionary_file, row_group, plan):
+        logger.info("Row group pruned using column statistics")
+        stats.update({"PrunedRowGroups": 1})
+        return None
+    masks = []
+    remaining = []
+    for column in plan:
+        mask = (
+            get_row_indexes_to_delete_from_pages(
+                page_reader, parquet_file, row_group, column
+            )
+            if page_reader and column.simple
+            else None
+        )
+        if mask is None:
+            remaining.append(column)
+        else:
+            masks.append(mask)
+    if remaining:
+        # Dictionary encoded identifier columns are read as DictionaryArray
+        identifiers = (dictionary_file or parquet_file).read_row_group(
+            row_group,
+            columns=get_identifier_columns(parquet_file, row_group, remaining),
+        )
+        masks.append(get_rows_to_delete(identifiers, remaining))
+    mask = reduce(pc.or_, masks)
+    deleted_rows = pc.sum(mask).as_py() or 0
+    if deleted_rows == 0:
+        return None
+    stats.update({"DeletedRows": deleted_rows})
+    return mask
+
+
+def get_writer_profile(metadata, compression=None, compression_level=None):
+    """
+    Returns the ParquetWriter options reproducing the codec, dictionary and
+    statistics settings of each column of the source file, so that rewritten
+    row groups are encoded like the original ones. Compression levels are not
+    recorded in Parquet files so the codec default level is used unless a
+    compression override accepting a level is given
+    """
+    codecs = {}
+    dictionary_columns = set()
+    statistics_columns = set()
+    for row_group in range(metadata.num_row_groups):
+        row_group_metadata = metadata.row_group(row_group)
+        for col in range(row_group_metadata.num_columns):
+            column_chunk = row_group_metadata.column(col)
+            path = column_chunk.path_in_schema
+            codec = WRITER_CODECS.get(column_chunk.compression)
+            if codec:
+                codecs.setdefault(path, codec)
+            if column_chunk.has_dictionary_page:
+                dictionary_columns.add(path)
+            if column_chunk.is_stats_set:
+                statistics_columns.add(path)
+    profile = {
+        "compression": compression or codecs or "SNAPPY",
+        "use_dictionary": sorted(dictionary_columns),
+        "write_statistics": sorted(statistics_columns),
+    }
+    if (
+        compression_level is not None
+        and compression
+        and compression.upper() in LEVEL_CODECS
+    ):
+        profile["compression_level"] = compression_level
+    if metadata.format_version in WRITER_VERSIONS:
+        profile["version"] = metadata.format_version
+    return profile
+
+
+def get_page_reader(input_file):
+    """
+    Returns a reader of the pages of the file selected with its page index,
+    or None if its footer can't be decoded
+    """
+    try:
+        return PageReader(input_file)
+    except UnsupportedParquetFileError as e:
+        logger.warning("Unable to use page indexes: %s", str(e))
+        return None
+
+
+def get_writer(out_stream, input_file, schema, raw_passthrough, **writer_kwargs):
+    """
+    Returns a writer copying untouched row groups verbatim if supported by the
+    source file, otherwise a writer encoding every row group
+    """
+    if raw_passthrough:
+        try:
+            return RawParquetWriter(out_stream, input_file, schema, **writer_kwargs)
+        except UnsupportedParquetFileError as e:
+            logger.warning("Unable to copy row groups verbatim: %s", str(e))
+    return pq.ParquetWriter(out_stream, schema, **writer_kwargs)
+
+
+def read_row_groups(
+    parquet_file, dictionary_file, page_reader, plan, stats, copy_untouched
+):
+    """
+    Generator reading the row groups of a file. Yields tuples containing the
+    row group index, the mask of the rows to delete and the row group table.
+    The table is not read (and is None) for row groups without matches when
+    untouched row groups can be copied verbatim
+    """
+    for row_group in range(parquet_file.num_row_groups):
+        logger.info(
+            "Row group %s/%s", str(row_group + 1), str(parquet_file.num_row_groups),
+        )
+        mask = get_row_group_mask(
+            parquet_file, dictionary_file, row_group, plan, stats, page_reader
+        )
+        table = (
+            None
+            if mask is None and copy_untouched
+            else parquet_file.read_row_group(row_group)
+        )
+        yield row_group, mask, table
+
+
+def rewrite_row_group(
+    input_file, metadata, dictionary_columns, page_reader, plan, writer, row_group
+):
+    """
+    Masks and encodes a single row group using its own readers, so that it can
+    run concurrently with other row groups. Returns the row group index, the
+    mask, the encoded row group (None if no rows are left or the row group has
+    no matches) and the statistics for the row group
+    """
+    stats = Counter()
+    parquet_file = load_parquet(input_file, metadata=metadata)
+    dictionary_file = (
+        load_parquet(input_file, metadata=metadata, read_dictionary=dictionary_columns)
+        if dictionary_columns
+        else None
+    )
+    logger.info("Row group %s/%s", str(row_group + 1), str(metadata.num_row_groups))
+    mask = get_row_group_mask(
+        parquet_file, dictionary_file, row_group, plan, stats, page_reader
+    )
+    if mask is None:
+        return row_group, mask, None, stats
+    table = parquet_file.read_row_group(row_group).filter(pc.invert(mask))
+    encoded = writer.encode(table) if table.num_rows > 0 else None
+    return row_group, mask, encoded, stats
+
+
+def write_encoded_row_group(writer, row_group, mask, encoded):
+    if mask is None:
+        writer.copy_row_group(row_group)
+    elif encoded is not None:
+        writer.write_encoded(encoded)
+
+
+def rewrite_row_groups_in_parallel(
+    writer,
+    input_file,
+    parquet_file,
+    dictionary_columns,
+    page_reader,
+    plan,
+    stats,
+    workers,
+    queue_depth,
+):
+    """
+    Masks and encodes row groups in a pool of worker threads, whilst the
+    encoded row groups are appended in order by a background writer
+    """
+    logger.info("Processing row groups using %s workers", str(workers))
+    row_groups = parallel_map(
+        lambda row_group: rewrite_row_group(
+            input_file,
+            parquet_file.metadata,
+            dictionary_columns,
+            page_reader,
+            plan,
+            writer,
+            row_group,
+        ),
+        range(parquet_file.num_row_groups),
+        workers,
+        queue_depth,
+    )
+    with BackgroundConsumer(
+        lambda item: write_encoded_row_group(writer, *item), queue_depth
+    ) as consumer:
+        for row_group, mask, encoded, row_group_stats in row_groups:
+            stats.update(row_group_stats)
+            consumer.put((row_group, mask, encoded))
+
+
+def write_row_group(writer, row_group, table):
+    if table is None:
+        writer.copy_row_group(row_group)
+    elif isinstance(writer, RawParquetWriter):
+        writer.write_table(table)
+    else:
+        # Keep one row group per source row group whatever its size
+        writer.write_table(table, row_group_size=max(table.num_rows, 1))
+
+
+def delete_matches_from_parquet_file(
+    input_file,
+    to_delete,
+    raw_passthrough=True,
+    out_stream=None,
+    queue_depth=PIPELINE_QUEUE_DEPTH,
+    compression=None,
+    compression_level=None,
+    parallel_threshold=PARALLEL_SIZE_THRESHOLD,
+    workers=PARALLEL_WORKERS,
+):
     """
     Deletes matches from Parquet file where to_delete is a list of dicts where
     each dict contains a column to search and the MatchIds to search for in
-    that particular column
+    that particular column. When raw_passthrough is enabled, row groups
+    without matches are copied without being decoded and encoded again.
+    Each row group is written to out_stream as soon as it is processed, which
+    defaults to an in-memory buffer.
+
+    Reading, filtering and writing run as a pipeline: the next row groups are
+    read in a background thread and the previous ones are written in another
+    one, buffering at most queue_depth row groups between each stage.
+
+    Rewritten row groups mirror the encoding settings of the source file
+    unless a compression codec (and optionally level) is given.
+
+    When the writer produced page indexes, only the data pages of simple
+    identifier columns whose min and max values can contain a MatchId are
+    decoded to find the matches of a row group.
+
+    Files of at least parallel_threshold bytes whose row groups can be copied
+    verbatim have their row groups masked and encoded by a pool of worker
+    threads, as Arrow releases the GIL whilst decoding, filtering and encoding.
+    The encoded row groups are assembled in order by the writer
     """
+    if not isinstance(input_file, pa.NativeFile):
+        input_file = pa.PythonFile(input_file, mode="r")
     parquet_file = load_parquet(input_file)
+    plan = get_match_plan(to_delete)
+    dictionary_columns = get_dictionary_columns(parquet_file, plan)
+    dictionary_file = (
+        load_parquet(
+            input_file,
+            metadata=parquet_file.metadata,
+            read_dictionary=dictionary_columns,
+        )
+        if dictionary_columns
+        else None
+    )
+    page_reader = get_page_reader(input_file)
     schema = parquet_file.metadata.schema.to_arrow_schema().remove_metadata()
     total_rows = parquet_file.metadata.num_rows
-    stats = Counter({"ProcessedRows": total_rows, "DeletedRows": 0})
-    with pa.BufferOutputStream() as out_stream:
-        with pq.ParquetWriter(out_stream, schema) as writer:
-            for row_group in range(parquet_file.num_row_groups):
-                logger.info(
-                    "Row group %s/%s",
-                    str(row_group + 1),
-                    str(parquet_file.num_row_groups),
-                )
-                table = parquet_file.read_row_group(row_group)
-                table, deleted_rows = delete_from_table(table, to_delete)
-                writer.write_table(table)
-                stats.update({"DeletedRows": deleted_rows})
-        return out_stream, stats
+    stats = Counter(
+        {"ProcessedRows": total_rows, "DeletedRows": 0, "PrunedRowGroups": 0}
+    )
+    if out_stream is None:
+        out_stream = pa.BufferOutputStream()
+    writer_profile = get_writer_profile(
+        parquet_file.metadata, compression, compression_level
+    )
+    with get_writer(
+        out_stream, input_file, schema, raw_passthrough, **writer_profile
+    ) as writer:
+        copy_untouched = isinstance(writer, RawParquetWriter)
+        if copy_untouched and workers > 1 and input_file.size() >= parallel_threshold:
+            rewrite_row_groups_in_parallel(
+                writer,
+                input_file,
+                parquet_file,
+                dictionary_columns,
+                page_reader,
+                plan,
+                stats,
+                workers,
+                queue_depth,
+            )
+        else:
+            row_groups = read_row_groups(
+                parquet_file, dictionary_file, page_reader, plan, stats, copy_untouched,
+            )
+            with BackgroundConsumer(
+                lambda item: write_row_group(writer, *item), queue_depth
+            ) as consumer:
+                for row_group, mask, table in prefetch(row_groups, queue_depth):
+                    if table is not None and mask is not None:
+                        table = table.filter(pc.invert(mask))
+                    consumer.put((row_group, table))
+    return out_stream, stats
@@ -0,0 +1,638 @@
+"""
+Raw access to the row groups of a Parquet file. Row groups which don't
+contain any match can be copied verbatim into the output file, without being
+decoded and encoded again, by copying the bytes of their column chunks and
+rewriting the offsets stored in the footer.
+
+The footer is a FileMetaData struct serialised with the Thrift Compact
+Protocol. Structs are decoded into dicts of field id to (type, value) so that
+they can be written back exactly as they were read, including fields which
+are unknown to this module.
+
+When the writer produced page indexes, the data pages of a column chunk whose
+value range may contain a match can also be read on their own, without
+decoding the rest of the column chunk.
+"""
+import struct
+from collections import namedtuple
+from io import BytesIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MAGIC = b"PAR1"
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Thrift Compact Protocol types
+STOP = 0
+BOOL_TRUE = 1
+BOOL_FALSE = 2
+BYTE = 3
+I16 = 4
+I32 = 5
+I64 = 6
+DOUBLE = 7
+BINARY = 8
+LIST = 9
+SET = 10
+MAP = 11
+STRUCT = 12
+
+# Field ids from parquet.thrift
+FILE_METADATA_VERSION = 1
+FILE_METADATA_SCHEMA = 2
+FILE_METADATA_NUM_ROWS = 3
+FILE_METADATA_ROW_GROUPS = 4
+FILE_METADATA_CREATED_BY = 6
+SCHEMA_ELEMENT_REPETITION_TYPE = 3
+SCHEMA_ELEMENT_NAME = 4
+SCHEMA_ELEMENT_NUM_CHILDREN = 5
+ROW_GROUP_COLUMNS = 1
+ROW_GROUP_TOTAL_BYTE_SIZE = 2
+ROW_GROUP_NUM_ROWS = 3
+ROW_GROUP_FILE_OFFSET = 5
+ROW_GROUP_TOTAL_COMPRESSED_SIZE = 6
+ROW_GROUP_ORDINAL = 7
+COLUMN_CHUNK_FILE_OFFSET = 2
+COLUMN_CHUNK_META_DATA = 3
+COLUMN_CHUNK_OFFSET_INDEX_OFFSET = 4
+COLUMN_CHUNK_OFFSET_INDEX_LENGTH = 5
+COLUMN_CHUNK_COLUMN_INDEX_OFFSET = 6
+COLUMN_CHUNK_COLUMN_INDEX_LENGTH = 7
+COLUMN_CHUNK_INDEX_FIELDS = [4, 5, 6, 7]
+COLUMN_META_DATA_TYPE = 1
+COLUMN_META_DATA_PATH_IN_SCHEMA = 3
+COLUMN_META_DATA_NUM_VALUES = 5
+COLUMN_META_DATA_TOTAL_UNCOMPRESSED_SIZE = 6
+COLUMN_META_DATA_TOTAL_COMPRESSED_SIZE = 7
+COLUMN_META_DATA_DATA_PAGE_OFFSET = 9
+COLUMN_META_DATA_INDEX_PAGE_OFFSET = 10
+COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET = 11
+COLUMN_META_DATA_STATISTICS = 12
+COLUMN_META_DATA_BLOOM_FILTER_FIELDS = [14, 15]
+COLUMN_INDEX_NULL_PAGES = 1
+COLUMN_INDEX_MIN_VALUES = 2
+COLUMN_INDEX_MAX_VALUES = 3
+OFFSET_INDEX_PAGE_LOCATIONS = 1
+PAGE_LOCATION_OFFSET = 1
+PAGE_LOCATION_COMPRESSED_PAGE_SIZE = 2
+PAGE_LOCATION_FIRST_ROW_INDEX = 3
+
+REPEATED = 2
+
+# Decoders for the plain encoded min and max values of the column index
+PLAIN_DECODERS = {
+    1: lambda value: struct.unpack("<i", value)[0],  # INT32
+    2: lambda value: struct.unpack("<q", value)[0],  # INT64
+    6: bytes,  # BYTE_ARRAY
+}
+
+Page = namedtuple(
+    "Page", ["offset", "length", "first_row", "num_rows", "min_value", "max_value"]
+)
+
+
+class UnsupportedParquetFileError(Exception):
+    pass
+
+
+class CompactReader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def read_byte(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def read_varint(self):
+        shift = 0
+        result = 0
+        while True:
+            byte = self.read_byte()
+            result |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def read_zigzag(self):
+        n = self.read_varint()
+        return (n >> 1) ^ -(n & 1)
+
+    def read_value(self, value_type):
+        if value_type in (BOOL_TRUE, BOOL_FALSE):
+            return value_type == BOOL_TRUE
+        if value_type == BYTE:
+            return struct.unpack("<b", bytes([self.read_byte()]))[0]
+        if value_type in (I16, I32, I64):
+            return self.read_zigzag()
+        if value_type == DOUBLE:
+            value = struct.unpack("<d", self.data[self.pos : self.pos + 8])[0]
+            self.pos += 8
+            return value
+        if value_type == BINARY:
+            length = self.read_varint()
+            value = bytes(self.data[self.pos : self.pos + length])
+            self.pos += length
+            return value
+        if value_type in (LIST, SET):
+            header = self.read_byte()
+            size = header >> 4
+            if size == 15:
+                size = self.read_varint()
+            element_type = header & 0x0F
+            return element_type, [self.read_element(element_type) for _ in range(size)]
+        if value_type == MAP:
+            size = self.read_varint()
+            if size == 0:
+                return STOP, STOP, []
+            header = self.read_byte()
+            key_type, value_type = header >> 4, header & 0x0F
+            return (
+                key_type,
+                value_type,
+                [
+                    (self.read_element(key_type), self.read_element(value_type))
+                    for _ in range(size)
+                ],
+            )
+        if value_type == STRUCT:
+            return self.read_struct()
+        raise UnsupportedParquetFileError(
+            "Unknown Thrift type {} in Parquet footer".format(value_type)
+        )
+
+    def read_element(self, element_type):
+        # Booleans inside collections are encoded as a single byte
+        if element_type in (BOOL_TRUE, BOOL_FALSE):
+            return self.read_byte() == BOOL_TRUE
+        return self.read_value(element_type)
+
+    def read_struct(self):
+        fields = {}
+        field_id = 0
+        while True:
+            header = self.read_byte()
+            field_type = header & 0x0F
+            if field_type == STOP:
+                return fields
+            delta = header >> 4
+            field_id = field_id + delta if delta else self.read_zigzag()
+            fields[field_id] = (field_type, self.read_value(field_type))
+
+
+class CompactWriter:
+    def __init__(self):
+        self.buf = BytesIO()
+
+    def getvalue(self):
+        return self.buf.getvalue()
+
+    def write_byte(self, value):
+        self.buf.write(bytes([value & 0xFF]))
+
+    def write_varint(self, n):
+        while True:
+            if n < 0x80:
+                self.write_byte(n)
+                return
+            self.write_byte((n & 0x7F) | 0x80)
+            n >>= 7
+
+    def write_zigzag(self, n):
+        self.write_varint((n << 1) ^ (n >> 63))
+
+    def write_value(self, value_type, value):
+        if value_type in (BOOL_TRUE, BOOL_FALSE):
+            return
+        if value_type == BYTE:
+            self.buf.write(struct.pack("<b", value))
+        elif value_type in (I16, I32, I64):
+            self.write_zigzag(value)
+        elif value_type == DOUBLE:
+            self.buf.write(struct.pack("<d", value))
+        elif value_type == BINARY:
+            self.write_varint(len(value))
+            self.buf.write(value)
+        elif value_type in (LIST, SET):
+            element_type, elements = value
+            if len(elements) < 15:
+                self.write_byte(len(elements) << 4 | element_type)
+            else:
+                self.write_byte(0xF0 | element_type)
+                self.write_varint(len(elements))
+            for element in elements:
+                self.write_element(element_type, element)
+        elif value_type == MAP:
+            key_type, val_type, items = value
+            self.write_varint(len(items))
+            if items:
+                self.write_byte(key_type << 4 | val_type)
+            for k, v in items:
+                self.write_element(key_type, k)
+                self.write_element(val_type, v)
+        elif value_type == STRUCT:
+            self.write_struct(value)
+
+    def write_element(self, element_type, element):
+        if element_type in (BOOL_TRUE, BOOL_FALSE):
+            self.write_byte(BOOL_TRUE if element else BOOL_FALSE)
+        else:
+            self.write_value(element_type, element)
+
+    def write_struct(self, fields):
+        last_id = 0
+        for field_id in sorted(fields):
+            field_type, value = fields[field_id]
+            if field_type in (BOOL_TRUE, BOOL_FALSE):
+                field_type = BOOL_TRUE if value else BOOL_FALSE
+            delta = field_id - last_id
+            if 0 < delta <= 15:
+                self.write_byte(delta << 4 | field_type)
+            else:
+                self.write_byte(field_type)
+                self.write_zigzag(field_id)
+            self.write_value(field_type, value)
+            last_id = field_id
+        self.write_byte(STOP)
+
+
+def read_file_metadata(f):
+    """
+    Reads and decodes the footer of a Parquet file. f must be a NativeFile:
+    positional reads don't move the file position and are thread safe, so the
+    file can be shared with a ParquetFile reading other row groups
+    """
+    size = f.size()
+    tail = f.read_at(8, size - 8)
+    if tail[4:] != MAGIC:
+        raise UnsupportedParquetFileError("Footer is encrypted or not valid")
+    footer_length = struct.unpack("<I", tail[:4])[0]
+    return CompactReader(
+        f.read_at(footer_length, size - 8 - footer_length)
+    ).read_struct()
+
+
+def serialize_file_metadata(file_metadata):
+    writer = CompactWriter()
+    writer.write_struct(file_metadata)
+    return writer.getvalue()
+
+
+def get_chunk_range(column_chunk):
+    """
+    Returns the offset and length of the pages of a column chunk. The
+    dictionary page, if any, precedes the data pages
+    """
+    meta_data = column_chunk[COLUMN_CHUNK_META_DATA][1]
+    start = meta_data[COLUMN_META_DATA_DATA_PAGE_OFFSET][1]
+    if COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET in meta_data:
+        dictionary_offset = meta_data[COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET][1]
+        if 0 < dictionary_offset < start:
+            start = dictionary_offset
+    return start, meta_data[COLUMN_META_DATA_TOTAL_COMPRESSED_SIZE][1]
+
+
+def relocate_column_chunk(column_chunk, delta):
+    """
+    Returns a copy of the column chunk metadata with its page offsets shifted
+    by delta. Page indexes and bloom filters are stored outside of the column
+    chunk and are not copied, so references to them are dropped
+    """
+    column_chunk = dict(column_chunk)
+    meta_data = dict(column_chunk[COLUMN_CHUNK_META_DATA][1])
+    for field_id in [
+        COLUMN_META_DATA_DATA_PAGE_OFFSET,
+        COLUMN_META_DATA_INDEX_PAGE_OFFSET,
+        COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET,
+    ]:
+        if field_id in meta_data and meta_data[field_id][1] > 0:
+            field_type, offset = meta_data[field_id]
+            meta_data[field_id] = (field_type, offset + delta)
+    for field_id in COLUMN_META_DATA_BLOOM_FILTER_FIELDS:
+        meta_data.pop(field_id, None)
+    for field_id in COLUMN_CHUNK_INDEX_FIELDS:
+        column_chunk.pop(field_id, None)
+    if column_chunk.get(COLUMN_CHUNK_FILE_OFFSET, (I64, 0))[1] > 0:
+        field_type, offset = column_chunk[COLUMN_CHUNK_FILE_OFFSET]
+        column_chunk[COLUMN_CHUNK_FILE_OFFSET] = (field_type, offset + delta)
+    column_chunk[COLUMN_CHUNK_META_DATA] = (STRUCT, meta_data)
+    return column_chunk
+
+
+def get_schema_elements(file_metadata):
+    """
+    Returns the schema of a file, ignoring the name of the root element which
+    differs between writers
+    """
+    elements = [dict(e) for e in file_metadata[FILE_METADATA_SCHEMA][1][1]]
+    elements[0].pop(SCHEMA_ELEMENT_NAME, None)
+    return elements
+
+
+def encode_table(table, schema, **writer_kwargs):
+    """
+    Encodes an Arrow Table as a standalone Parquet file with a single row group
+    """
+    with pa.BufferOutputStream() as out_stream:
+        with pq.ParquetWriter(out_stream, schema, **writer_kwargs) as writer:
+            writer.write_table(table, row_group_size=max(table.num_rows, 1))
+        return pa.BufferReader(out_stream.getvalue())
+
+
+class RawParquetWriter:
+    """
+    Writes a Parquet file made of row groups copied verbatim from a source
+    file and of row groups encoded from Arrow Tables. The footer of the source
+    file is reused, updating only the row groups and the number of rows.
+    """
+
+    def __init__(self, out_stream, source, schema, **writer_kwargs):
+        self.out_stream = out_stream
+        self.source = source
+        self.schema = schema
+        self.writer_kwargs = writer_kwargs
+        self.file_metadata = read_file_metadata(source)
+        self.row_groups = []
+        self.num_rows = 0
+        self.position = 0
+        encoded = read_file_metadata(encode_table(schema.empty_table(), schema))
+        if get_schema_elements(encoded) != get_schema_elements(self.file_metadata):
+            raise UnsupportedParquetFileError(
+                "Encoded schema differs from the source file schema"
+            )
+        self._write(MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        if not args[0]:
+            self.close()
+
+    def _write(self, data):
+        self.out_stream.write(data)
+        self.position += len(data)
+
+    def _copy(self, f, start, length):
+        while length > 0:
+            data = f.read_at(min(length, COPY_BUFFER_SIZE), start)
+            if not data:
+                raise UnsupportedParquetFileError("Unexpected end of file")
+            self._write(data)
+            start += len(data)
+            length -= len(data)
+
+    def _copy_row_group(self, f, row_group):
+        columns = []
+        for column_chunk in row_group[ROW_GROUP_COLUMNS][1][1]:
+            start, length = get_chunk_range(column_chunk)
+            columns.append(relocate_column_chunk(column_chunk, self.position - start))
+            self._copy(f, start, length)
+        row_group = dict(row_group)
+        row_group[ROW_GROUP_COLUMNS] = (LIST, (STRUCT, columns))
+        first_offset = get_chunk_range(columns[0])[0] if columns else self.position
+        row_group[ROW_GROUP_FILE_OFFSET] = (I64, first_offset)
+        row_group[ROW_GROUP_TOTAL_COMPRESSED_SIZE] = (
+            I64,
+            sum(get_chunk_range(c)[1] for c in columns),
+        )
+        row_group[ROW_GROUP_ORDINAL] = (I16, len(self.row_groups))
+        self.row_groups.append(row_group)
+        self.num_rows += row_group[ROW_GROUP_NUM_ROWS][1]
+
+    def copy_row_group(self, index):
+        """
+        Copies the compressed bytes of a row group of the source file
+        """
+        row_group = self.file_metadata[FILE_METADATA_ROW_GROUPS][1][1][index]
+        self._copy_row_group(self.source, row_group)
+
+    def encode(self, table):
+        """
+        Encodes a table as a standalone file which can be appended with
+        write_encoded. This doesn't modify the writer so it can be used from
+        multiple threads
+        """
+        return encode_table(table, self.schema, **self.writer_kwargs)
+
+    def write_encoded(self, encoded):
+        """
+        Copies the row groups of a file returned by encode
+        """
+        for row_group in read_file_metadata(encoded)[FILE_METADATA_ROW_GROUPS][1][1]:
+            self._copy_row_group(encoded, row_group)
+
+    def write_table(self, table):
+        """
+        Encodes a table as a new row group
+        """
+        if table.num_rows == 0:
+            return
+        self.write_encoded(self.encode(table))
+
+    def close(self):
+        file_metadata = dict(self.file_metadata)
+        file_metadata[FILE_METADATA_ROW_GROUPS] = (LIST, (STRUCT, self.row_groups))
+        file_metadata[FILE_METADATA_NUM_ROWS] = (I64, self.num_rows)
+        footer = serialize_file_metadata(file_metadata)
+        self._write(footer)
+        self._write(struct.pack("<I", len(footer)))
+        self._write(MAGIC)
+
+
+def get_top_level_element(file_metadata, name):
+    """
+    Returns the schema element of a top level column
+    """
+    elements = file_metadata[FILE_METADATA_SCHEMA][1][1]
+    index = 1
+    while index < len(elements):
+        if elements[index][SCHEMA_ELEMENT_NAME][1] == name:
+            return elements[index]
+        # Skip the descendants of the element
+        remaining = 1
+        while remaining:
+            remaining += elements[index].get(SCHEMA_ELEMENT_NUM_CHILDREN, (I32, 0))[1]
+            remaining -= 1
+            index += 1
+    return None
+
+
+class PageReader:
+    """
+    Reads the data pages of top level primitive columns whose value range, as
+    recorded in the column index, may contain a match. Pages are located with
+    the offset index and copied, with the dictionary page of their column
+    chunk, into a standalone file so that only these pages are decoded.
+    """
+
+    def __init__(self, source, file_metadata=None):
+        self.source = source
+        self.file_metadata = file_metadata or read_file_metadata(source)
+
+    def _read_struct(self, column_chunk, offset_field, length_field):
+        if offset_field not in column_chunk or length_field not in column_chunk:
+            return None
+        offset = column_chunk[offset_field][1]
+        length = column_chunk[length_field][1]
+        return CompactReader(self.source.read_at(length, offset)).read_struct()
+
+    def get_column_chunk(self, row_group, path):
+        row_group = self.file_metadata[FILE_METADATA_ROW_GROUPS][1][1][row_group]
+        for column_chunk in row_group[ROW_GROUP_COLUMNS][1][1]:
+            meta_data = column_chunk[COLUMN_CHUNK_META_DATA][1]
+            if meta_data[COLUMN_META_DATA_PATH_IN_SCHEMA][1][1] == [path.encode()]:
+                return column_chunk
+        return None
+
+    def get_pages(self, row_group, path):
+        """
+        Returns the data pages of a top level primitive column in a row group,
+        or None if the column chunk has no page index or if its min and max
+        values can't be decoded. Min and max values are None for pages which
+        only contain nulls
+        """
+        column_chunk = self.get_column_chunk(row_group, path)
+        leaf = get_top_level_element(self.file_metadata, path.encode())
+        if (
+            not column_chunk
+            or not leaf
+            or leaf.get(SCHEMA_ELEMENT_REPETITION_TYPE, (I32, 0))[1] == REPEATED
+        ):
+            return None
+        column_index = self._read_struct(
+            column_chunk,
+            COLUMN_CHUNK_COLUMN_INDEX_OFFSET,
+            COLUMN_CHUNK_COLUMN_INDEX_LENGTH,
+        )
+        offset_index = self._read_struct(
+            column_chunk,
+            COLUMN_CHUNK_OFFSET_INDEX_OFFSET,
+            COLUMN_CHUNK_OFFSET_INDEX_LENGTH,
+        )
+        meta_data = column_chunk[COLUMN_CHUNK_META_DATA][1]
+        decode = PLAIN_DECODERS.get(meta_data[COLUMN_META_DATA_TYPE][1])
+        if not column_index or not offset_index or not decode:
+            return None
+        null_pages = column_index[COLUMN_INDEX_NULL_PAGES][1][1]
+        min_values = column_index[COLUMN_INDEX_MIN_VALUES][1][1]
+        max_values = column_index[COLUMN_INDEX_MAX_VALUES][1][1]
+        locations = offset_index[OFFSET_INDEX_PAGE_LOCATIONS][1][1]
+        row_group_rows = self.file_metadata[FILE_METADATA_ROW_GROUPS][1][1][row_group][
+            ROW_GROUP_NUM_ROWS
+        ][1]
+        pages = []
+        for i, location in enumerate(locations):
+            first_row = location[PAGE_LOCATION_FIRST_ROW_INDEX][1]
+            next_row = (
+                locations[i + 1][PAGE_LOCATION_FIRST_ROW_INDEX][1]
+                if i + 1 < len(locations)
+                else row_group_rows
+            )
+            bounds = (None, None)
+            if not null_pages[i]:
+                bounds = (decode(min_values[i]), decode(max_values[i]))
+            pages.append(
+                Page(
+                    location[PAGE_LOCATION_OFFSET][1],
+                    location[PAGE_LOCATION_COMPRESSED_PAGE_SIZE][1],
+                    first_row,
+                    next_row - first_row,
+                    *bounds
+                )
+            )
+        return pages
+
+    def read_pages(self, row_group, path, pages):
+        """
+        Reads the values of the given data pages of a column chunk. Runs of
+        consecutive pages are stored as row groups of a standalone file, each
+        preceded by a copy of the dictionary page of the column chunk. Columns
+        with a dictionary page are read as DictionaryArray
+        """
+        column_chunk = self.get_column_chunk(row_group, path)
+        meta_data = column_chunk[COLUMN_CHUNK_META_DATA][1]
+        dictionary = b""
+        start = get_chunk_range(column_chunk)[0]
+        first_page = meta_data[COLUMN_META_DATA_DATA_PAGE_OFFSET][1]
+        if start < first_page:
+            dictionary = self.source.read_at(first_page - start, start)
+        runs = []
+        for page in pages:
+            if runs and runs[-1][-1].offset + runs[-1][-1].length == page.offset:
+                runs[-1].append(page)
+            else:
+                runs.append([page])
+        out = BytesIO()
+        out.write(MAGIC)
+        row_groups = []
+        for run in runs:
+            start = out.tell()
+            out.write(dictionary)
+            data_offset = out.tell()
+            length = sum(page.length for page in run)
+            out.write(self.source.read_at(length, run[0].offset))
+            num_rows = sum(page.num_rows for page in run)
+            run_meta_data = {
+                k: v
+                for k, v in meta_data.items()
+                if k
+                not in [COLUMN_META_DATA_INDEX_PAGE_OFFSET, COLUMN_META_DATA_STATISTICS]
+                + COLUMN_META_DATA_BLOOM_FILTER_FIELDS
+            }
+            run_meta_data.update(
+                {
+                    COLUMN_META_DATA_NUM_VALUES: (I64, num_rows),
+                    COLUMN_META_DATA_TOTAL_UNCOMPRESSED_SIZE: (
+                        I64,
+                        out.tell() - start,
+                    ),
+                    COLUMN_META_DATA_TOTAL_COMPRESSED_SIZE: (I64, out.tell() - start),
+                    COLUMN_META_DATA_DATA_PAGE_OFFSET: (I64, data_offset),
+                }
+            )
+            if dictionary:
+                run_meta_data[COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET] = (I64, start)
+            else:
+                run_meta_data.pop(COLUMN_META_DATA_DICTIONARY_PAGE_OFFSET, None)
+            row_groups.append(
+                {
+                    ROW_GROUP_COLUMNS: (
+                        LIST,
+                        (
+                            STRUCT,
+                            [
+                                {
+                                    COLUMN_CHUNK_FILE_OFFSET: (I64, start),
+                                    COLUMN_CHUNK_META_DATA: (STRUCT, run_meta_data),
+                                }
+                            ],
+                        ),
+                    ),
+                    ROW_GROUP_TOTAL_BYTE_SIZE: (I64, out.tell() - start),
+                    ROW_GROUP_NUM_ROWS: (I64, num_rows),
+                }
+            )
+        root = dict(self.file_metadata[FILE_METADATA_SCHEMA][1][1][0])
+        root[SCHEMA_ELEMENT_NUM_CHILDREN] = (I32, 1)
+        leaf = get_top_level_element(self.file_metadata, path.encode())
+        file_metadata = {
+            FILE_METADATA_VERSION: self.file_metadata[FILE_METADATA_VERSION],
+            FILE_METADATA_SCHEMA: (LIST, (STRUCT, [root, leaf])),
+            FILE_METADATA_NUM_ROWS: (I64, sum(p.num_rows for p in pages)),
+            FILE_METADATA_ROW_GROUPS: (LIST, (STRUCT, row_groups)),
+        }
+        if FILE_METADATA_CREATED_BY in self.file_metadata:
+            file_metadata[FILE_METADATA_CREATED_BY] = self.file_metadata[
+                FILE_METADATA_CREATED_BY
+            ]
+        footer = serialize_file_metadata(file_metadata)
+        out.write(footer)
+        out.write(struct.pack("<I", len(footer)))
+        out.write(MAGIC)
+        return pq.read_table(
+            pa.BufferReader(out.getvalue()),
+            read_dictionary=[path] if dictionary else None,
+        ).column(0)
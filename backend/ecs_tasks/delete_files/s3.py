@@ -1,46 +1,195 @@
+import gzip
+import hashlib
 import logging
+import os
 from functools import lru_cache
+from io import BytesIO
 from urllib.parse import urlencode, quote_plus
 
-from boto_utils import paginate
+from boto_utils import paginate, get_match_plan_key
 from botocore.exceptions import ClientError
 
 from utils import remove_none, retry_wrapper
 
 logger = logging.getLogger(__name__)
 
+UPLOAD_PART_SIZE = 16 * 1024 * 1024
 
-def save(s3, client, buf, bucket, key, source_version=None):
+
+def get_object_settings(client, bucket, key, source_version=None):
     """
-    Save a buffer to S3, preserving any existing properties on the object
+    Generates a dict containing the args to use when writing a new version of
+    an object, preserving any existing properties on the object
     """
-    # Get Object Settings
     request_payer_args, _ = get_requester_payment(client, bucket)
     object_info_args, _ = get_object_info(client, bucket, key, source_version)
     tagging_args, _ = get_object_tags(client, bucket, key, source_version)
-    acl_args, acl_resp = get_object_acl(client, bucket, key, source_version)
+    acl_args, _ = get_object_acl(client, bucket, key, source_version)
     extra_args = {**request_payer_args, **object_info_args, **tagging_args, **acl_args}
     logger.info("Object settings: %s", extra_args)
-    # Write Object Back to S3
-    logger.info("Saving updated object to s3://%s/%s", bucket, key)
-    contents = buf.read()
-    with s3.open("s3://{}/{}".format(bucket, key), "wb", **extra_args) as f:
-        f.write(contents)
-    s3.invalidate_cache()  # TODO: remove once https://github.com/dask/s3fs/issues/294 is resolved
-    new_version_id = f.version_id
-    logger.info("Object uploaded to S3")
-    # GrantWrite cannot be set whilst uploading therefore ACLs need to be restored separately
+    return extra_args
+
+
+def restore_write_grantees(client, bucket, key, version_id, source_version=None):
+    """
+    GrantWrite cannot be set whilst uploading therefore ACLs need to be
+    restored separately
+    """
+    request_payer_args, _ = get_requester_payment(client, bucket)
+    acl_args, acl_resp = get_object_acl(client, bucket, key, source_version)
     write_grantees = ",".join(get_grantees(acl_resp, "WRITE"))
     if write_grantees:
         logger.info("WRITE grant found. Restoring additional grantees for object")
         client.put_object_acl(
             Bucket=bucket,
             Key=key,
-            VersionId=new_version_id,
+            VersionId=version_id,
             **{**request_payer_args, **acl_args, "GrantWrite": write_grantees,}
         )
-    logger.info("Processing of file s3://%s/%s complete", bucket, key)
-    return new_version_id
+
+
+class MultipartUploadStream:
+    """
+    Writable file-like object which saves a new version of an object to S3,
+    preserving any existing properties on the object. Data is uploaded as
+    multipart upload parts as soon as part_size bytes are buffered, so memory
+    usage doesn't depend on the size of the object. The upload is completed
+    when the stream is closed and aborted if the stream is used as context
+    manager and an exception is raised, or if completing it fails.
+    """
+
+    def __init__(
+        self, client, bucket, key, source_version=None, part_size=UPLOAD_PART_SIZE
+    ):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.source_version = source_version
+        self.part_size = part_size
+        self.extra_args = get_object_settings(client, bucket, key, source_version)
+        self.request_payer_args, _ = get_requester_payment(client, bucket)
+        self.buffer = BytesIO()
+        self.position = 0
+        self.upload_id = None
+        self.parts = []
+        self.version_id = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.abort()
+        else:
+            self.close()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("I/O operation on closed stream")
+        written = self.buffer.write(data)
+        self.position += written
+        if self.buffer.tell() >= self.part_size:
+            self._upload_part()
+        return written
+
+    def _upload_part(self):
+        if not self.upload_id:
+            logger.info(
+                "Starting multipart upload to s3://%s/%s", self.bucket, self.key
+            )
+            self.upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args
+            )["UploadId"]
+        part_number = len(self.parts) + 1
+        resp = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=self.buffer.getvalue(),
+            **self.request_payer_args
+        )
+        self.parts.append({"ETag": resp["ETag"], "PartNumber": part_number})
+        self.buffer = BytesIO()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        logger.info("Saving updated object to s3://%s/%s", self.bucket, self.key)
+        if self.upload_id:
+            try:
+                if self.buffer.tell() > 0:
+                    self._upload_part()
+                resp = self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={"Parts": self.parts},
+                    **self.request_payer_args
+                )
+            except Exception:
+                # Uploaded parts are billed until the upload is aborted
+                self._abort_upload()
+                raise
+        else:
+            resp = self.client.put_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Body=self.buffer.getvalue(),
+                **self.extra_args
+            )
+        self.buffer = BytesIO()
+        self.version_id = resp.get("VersionId")
+        logger.info("Object uploaded to S3")
+        restore_write_grantees(
+            self.client, self.bucket, self.key, self.version_id, self.source_version
+        )
+
+    def abort(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.buffer = BytesIO()
+        if self.upload_id:
+            self._abort_upload()
+
+    def _abort_upload(self):
+        logger.info("Aborting multipart upload to s3://%s/%s", self.bucket, self.key)
+        self.client.abort_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            **self.request_payer_args
+        )
+
+
+def download_match_plan(client, bucket, job_id, plan_hash, path):
+    """
+    Downloads the columns of a job offloaded to the match plan bucket with the
+    given hash to path, after checking that their content matches the hash.
+    The file is written atomically as the local cache is shared by the task
+    processes
+    """
+    resp = client.get_object(Bucket=bucket, Key=get_match_plan_key(job_id, plan_hash))
+    columns = gzip.decompress(resp["Body"].read())
+    if hashlib.sha256(columns).hexdigest() != plan_hash:
+        raise ValueError("Match plan {} doesn't match its hash".format(plan_hash))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = "{}.{}".format(path, os.getpid())
+    with open(temp_path, "wb") as f:
+        f.write(columns)
+    os.replace(temp_path, path)
 
 
 @lru_cache()
@@ -1,6 +1,14 @@
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Thread
+
+import numpy as np
 from botocore.exceptions import ClientError
 
+_DONE = object()
+
 
 def remove_none(d: dict):
     return {k: v for k, v in d.items() if v is not None and v is not ""}
@@ -28,3 +36,192 @@ def retry_wrapper(fn, retry_wait_seconds=2, retry_factor=2, max_retries=5):
         raise last_error
 
     return wrapper
+
+
+def prefetch(iterable, queue_depth):
+    """
+    Generator consuming an iterable in a background thread, so that the next
+    items are produced whilst the current one is being processed. At most
+    queue_depth items are buffered. Exceptions raised by the iterable are
+    raised again in the calling thread
+    """
+    queue = Queue(maxsize=queue_depth)
+    stopped = []
+
+    def produce():
+        try:
+            for item in iterable:
+                if stopped:
+                    return
+                queue.put((item, None))
+            queue.put((_DONE, None))
+        except BaseException as e:
+            queue.put((_DONE, e))
+
+    thread = Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = queue.get()
+            if error:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        stopped.append(True)
+        while thread.is_alive():
+            while not queue.empty():
+                queue.get()
+            thread.join(0.01)
+
+
+def parallel_map(fn, iterable, workers, queue_depth, executor=None):
+    """
+    Generator applying fn to the items of an iterable in a pool of worker
+    threads, or in the given executor, and yielding the results in the order
+    of the items. At most workers + queue_depth items are processed ahead of
+    the calling thread. Exceptions raised by fn are raised again in the
+    calling thread
+    """
+    with executor or ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for item in iterable:
+                pending.append(executor.submit(fn, item))
+                if len(pending) > workers + queue_depth:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def read_blocks(input_file, block_size):
+    """
+    Reads a file in blocks of block_size bytes and yields (block, start, end)
+    tuples where block[start:end] contains only complete lines. A line
+    spanning several blocks is yielded as a block of its own, so that the
+    bytes of the other lines are never copied
+    """
+    partial = []
+    while True:
+        block = input_file.read(block_size)
+        if not block:
+            break
+        start = 0
+        if partial:
+            start = block.find(b"\n") + 1
+            if start == 0:
+                partial.append(block)
+                continue
+            partial.append(block[:start])
+            line = b"".join(partial)
+            partial = []
+            yield line, 0, len(line)
+        end = block.rfind(b"\n") + 1
+        if end == 0:
+            partial.append(block)
+            continue
+        if start < end:
+            yield block, start, end
+        if end < len(block):
+            partial.append(block[end:])
+    if partial:
+        line = b"".join(partial)
+        yield line, 0, len(line)
+
+
+def get_line_bounds(data):
+    """
+    Returns the start and end offsets of the lines in a buffer, including
+    their newline
+    """
+    ends = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == ord("\n")) + 1
+    if len(ends) == 0 or ends[-1] != len(data):
+        ends = np.append(ends, len(data))
+    starts = np.concatenate(([0], ends[:-1]))
+    return starts, ends
+
+
+class ChunkedWriter:
+    """
+    Batches writes of byte ranges into chunks of at least chunk_size bytes.
+    Ranges which are at least that large are written as they are
+    """
+
+    def __init__(self, writer, chunk_size):
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.pending = []
+        self.pending_size = 0
+
+    def write(self, data):
+        if len(data) >= self.chunk_size:
+            self.flush()
+            self.writer.write(data)
+            return
+        self.pending.append(data)
+        self.pending_size += len(data)
+        if self.pending_size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.writer.write(b"".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+
+
+class BackgroundConsumer:
+    """
+    Applies fn to the items submitted with put() in a background thread, in
+    the order they were submitted. At most queue_depth items are buffered,
+    after which put() blocks. Exceptions raised by fn are raised again in the
+    calling thread by the following put() or by close()
+    """
+
+    def __init__(self, fn, queue_depth):
+        self.fn = fn
+        self.queue = Queue(maxsize=queue_depth)
+        self.error = None
+        self.cancelled = False
+        self.thread = Thread(target=self._consume, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            # Discard pending items and don't mask the original exception
+            self.cancelled = True
+            self.queue.put(_DONE)
+            self.thread.join()
+        else:
+            self.close()
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is _DONE:
+                return
+            if self.error or self.cancelled:
+                continue
+            try:
+                self.fn(item)
+            except BaseException as e:
+                self.error = e
+
+    def put(self, item):
+        if self.error:
+            raise self.error
+        self.queue.put(item)
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(_DONE)
+            self.thread.join()
+        if self.error:
+            raise self.error
@@ -0,0 +1,215 @@
+"""
+Pool of long-lived worker processes, which keep their imported modules,
+clients and caches from one task to the next. Rather than after a number of
+tasks, workers are recycled according to their memory usage: a worker exits
+after a task once its resident set size exceeds the RSS watermark, and the
+pool starts a new one in its place. Workers which die after being sent a
+task, for instance when killed for running out of memory, are replaced as
+well and the task is reported as failed.
+"""
+import logging
+import os
+import resource
+import time
+from collections import deque
+from multiprocessing import Process, Queue
+from queue import Empty
+
+logger = logging.getLogger(__name__)
+
+MAINTAIN_INTERVAL = 1
+
+
+def get_rss():
+    """
+    Returns the resident set size of the current process in bytes, or its
+    peak resident set size where /proc isn't available
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_worker(tasks, results, rss_watermark):
+    """
+    Runs the tasks sent to the worker until the pool is closed or the RSS
+    watermark is exceeded. Each result tells the pool whether the worker is
+    exiting, so that no other task is sent to it
+    """
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        index, fn, args = task
+        try:
+            result = (index, True, fn(*args))
+        except Exception as e:
+            result = (index, False, e)
+        rss = get_rss()
+        exiting = rss > rss_watermark
+        try:
+            results.put(result + (exiting,))
+        except Exception as e:
+            results.put((index, False, RuntimeError(str(e)), exiting))
+        if exiting:
+            logger.info(
+                "Recycling worker %s using %s MiB", str(os.getpid()), str(rss >> 20)
+            )
+            return
+
+
+class WorkerPool:
+    """
+    Process pool whose workers are only replaced once their resident set size
+    exceeds rss_watermark bytes. An rss_watermark of 0 replaces workers after
+    every task. Each worker has its own task queue, and tasks are only sent
+    to idle workers, so the pool knows which task each worker is running
+    from the moment the task is dispatched. Workers are stopped by
+    terminate(), which should be called once the pool is no longer used
+    """
+
+    def __init__(self, processes=None, rss_watermark=0):
+        self.processes = processes or os.cpu_count() or 1
+        self.rss_watermark = rss_watermark
+        self.queued = deque()
+        self.results = Queue()
+        self.workers = []
+        self.pending = set()
+        self.next_task_id = 0
+        self.maintain()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.terminate()
+
+    def maintain(self):
+        """
+        Replaces the workers which have exited, reporting the task a worker
+        was sent as failed if it exited without returning its result, and
+        dispatches the queued tasks to the idle workers
+        """
+        for worker in self.workers:
+            if not worker.is_alive():
+                worker.join()
+                close_queue(worker.tasks)
+                if worker.task_id in self.pending:
+                    # A result sent by the worker before exiting is received
+                    # first, after which this one is discarded
+                    self.results.put(
+                        (
+                            worker.task_id,
+                            False,
+                            RuntimeError(
+                                "Worker exited with code {}".format(worker.exitcode)
+                            ),
+                            True,
+                        )
+                    )
+        self.workers = [worker for worker in self.workers if worker.is_alive()]
+        while len(self.workers) < self.processes:
+            tasks = Queue()
+            worker = Process(
+                target=run_worker, args=(tasks, self.results, self.rss_watermark),
+            )
+            worker.tasks = tasks
+            worker.task_id = None
+            worker.exiting = False
+            # Workers aren't daemonic so that tasks can start processes
+            worker.daemon = False
+            worker.start()
+            self.workers.append(worker)
+        self.dispatch()
+
+    def dispatch(self):
+        for worker in self.workers:
+            if not self.queued:
+                return
+            if worker.task_id is None and not worker.exiting:
+                task = self.queued.popleft()
+                worker.task_id = task[0]
+                worker.tasks.put(task)
+
+    def submit(self, fn, args):
+        """
+        Queues a call of fn with the tuple of arguments args and returns the
+        id of the task, which is run by the first worker available
+        """
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        self.pending.add(task_id)
+        self.queued.append((task_id, fn, args))
+        self.dispatch()
+        return task_id
+
+    def get_result(self, timeout=None):
+        """
+        Waits for the next task to complete and returns its id, whether it
+        succeeded and its result or the exception it raised. Returns None if
+        no task completes within timeout seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = MAINTAIN_INTERVAL
+            if deadline is not None:
+                wait = max(min(wait, deadline - time.monotonic()), 0)
+            try:
+                result = self.results.get(timeout=wait)
+            except Empty:
+                result = None
+            if result:
+                result = self.complete(*result)
+            self.maintain()
+            if result or (deadline is not None and time.monotonic() >= deadline):
+                return result
+
+    def complete(self, task_id, success, value, exiting):
+        """
+        Marks the worker which ran a task as idle, unless it is exiting, and
+        returns the result of the task if it wasn't already reported
+        """
+        for worker in self.workers:
+            if worker.task_id == task_id:
+                worker.task_id = None
+                worker.exiting = exiting
+        if task_id not in self.pending:
+            return None
+        self.pending.remove(task_id)
+        return task_id, success, value
+
+    def starmap(self, fn, iterable):
+        """
+        Like multiprocessing.Pool.starmap, calls fn with each tuple of
+        arguments in the workers and returns the results in order, raising the
+        first exception raised by fn if any
+        """
+        task_ids = [self.submit(fn, args) for args in iterable]
+        completed = {}
+        while len(completed) < len(task_ids):
+            task_id, success, value = self.get_result()
+            completed[task_id] = success, value
+        for task_id in task_ids:
+            success, value = completed[task_id]
+            if not success:
+                raise value
+        return [completed[task_id][1] for task_id in task_ids]
+
+    def terminate(self):
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+            close_queue(worker.tasks)
+        self.workers = []
+
+
+def close_queue(queue):
+    """
+    Closes the task queue of a worker which exited. Tasks it didn't read are
+    dropped rather than waited for when the pool exits
+    """
+    queue.cancel_join_thread()
+    queue.close()
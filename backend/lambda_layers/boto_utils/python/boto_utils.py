@@ -215,6 +215,22 @@ def parse_s3_url(s3_url):
     return s3_url.replace("s3://", "").split("/", 1)
 
 
+def get_match_plan_prefix(job_id):
+    """
+    Returns the prefix of the match plan bucket objects of a job, which are
+    deleted when the job is cleaned up
+    """
+    return "plans/{}/".format(job_id)
+
+
+def get_match_plan_key(job_id, plan_hash):
+    """
+    Returns the key of the match plan bucket object holding the columns and
+    MatchIds of a query, which is named after the hash of its content
+    """
+    return "{}{}.json.gz".format(get_match_plan_prefix(job_id), plan_hash)
+
+
 def get_user_info(event):
     req = event.get("requestContext", {})
     auth = req.get("authorizer", {})
@@ -23,7 +23,31 @@ glue_client = boto3.client("glue")
 PARQUET_HIVE_SERDE = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
 JSON_HIVE_SERDE = "org.apache.hive.hcatalog.data.JsonSerDe"
 JSON_OPENX_SERDE = "org.openx.data.jsonserde.JsonSerDe"
-SUPPORTED_SERDE_LIBS = [PARQUET_HIVE_SERDE, JSON_HIVE_SERDE, JSON_OPENX_SERDE]
+CSV_LAZY_SIMPLE_SERDE = "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe"
+CSV_OPEN_CSV_SERDE = "org.apache.hadoop.hive.serde2.OpenCSVSerde"
+SUPPORTED_SERDE_LIBS = [
+    PARQUET_HIVE_SERDE,
+    JSON_HIVE_SERDE,
+    JSON_OPENX_SERDE,
+    CSV_LAZY_SIMPLE_SERDE,
+    CSV_OPEN_CSV_SERDE,
+]
+CSV_CHARACTER_PARAMS = [
+    "field.delim",
+    "escape.delim",
+    "separatorChar",
+    "quoteChar",
+    "escapeChar",
+]
+# Compression level ranges of the Parquet codecs which accept a level
+PARQUET_COMPRESSION_LEVELS = {
+    "gzip": (1, 9),
+    "brotli": (0, 11),
+    "lz4": (1, 12),
+    "zstd": (1, 22),
+}
+# Compression level range of the codecs of compressed JSON and CSV objects
+OBJECT_COMPRESSION_LEVELS = (0, 9)
 
 
 @with_logging
@@ -84,6 +108,8 @@ def put_data_mapper_handler(event, context):
         "Format": body.get("Format", "parquet"),
         "DeleteOldVersions": body.get("DeleteOldVersions", True),
     }
+    if body.get("FormatOptions"):
+        item["FormatOptions"] = body["FormatOptions"]
     table.put_item(Item=item)
 
     return {"statusCode": 201, "body": json.dumps(item)}
@@ -103,6 +129,7 @@ def delete_data_mapper_handler(event, context):
 
 
 def validate_mapper(mapper):
+    validate_format_options(mapper)
     existing_s3_locations = get_existing_s3_locations(mapper["DataMapperId"])
     if mapper["QueryExecutorParameters"].get("DataCatalogProvider") == "glue":
         table_details = get_table_details_from_mapper(mapper)
@@ -136,6 +163,42 @@ def validate_mapper(mapper):
                         JSON_OPENX_SERDE
                     )
                 )
+        if serde_lib in [CSV_LAZY_SIMPLE_SERDE, CSV_OPEN_CSV_SERDE]:
+            for param in CSV_CHARACTER_PARAMS:
+                value = serde_params.get(param)
+                if value is not None and len(value) != 1 and not value.isdigit():
+                    raise ValueError(
+                        "The parameter {} must be a single character for SerDe library {}".format(
+                            param, serde_lib
+                        )
+                    )
+
+
+def validate_format_options(mapper):
+    """
+    The Compression override only applies to Parquet objects, and the
+    CompressionLevel either to the Compression codec or, without one, to the
+    codec of compressed JSON and CSV objects
+    """
+    format_options = mapper.get("FormatOptions") or {}
+    compression = format_options.get("Compression")
+    level = format_options.get("CompressionLevel")
+    if level is None:
+        return
+    if compression and mapper.get("Format", "parquet") == "parquet":
+        if compression not in PARQUET_COMPRESSION_LEVELS:
+            raise ValueError(
+                "The compression codec {} doesn't support a CompressionLevel".format(
+                    compression
+                )
+            )
+        low, high = PARQUET_COMPRESSION_LEVELS[compression]
+    else:
+        low, high = OBJECT_COMPRESSION_LEVELS
+    if not low <= level <= high:
+        raise ValueError(
+            "The CompressionLevel must be between {} and {}".format(low, high)
+        )
 
 
 def get_existing_s3_locations(current_data_mapper_id):
@@ -10,7 +10,14 @@ from operator import itemgetter
 
 from stats_updater import update_stats
 from status_updater import update_status, skip_cleanup_states
-from boto_utils import DecimalEncoder, deserialize_item, emit_event, utc_timestamp
+from boto_utils import (
+    DecimalEncoder,
+    deserialize_item,
+    emit_event,
+    get_match_plan_prefix,
+    paginate,
+    utc_timestamp,
+)
 from decorators import with_logging
 
 deserializer = TypeDeserializer()
@@ -20,6 +27,8 @@ client = boto3.client("stepfunctions")
 state_machine_arn = getenv("StateMachineArn")
 ddb = boto3.resource("dynamodb")
 q_table = ddb.Table(getenv("DeletionQueueTable"))
+s3 = boto3.client("s3")
+plan_bucket = getenv("MatchPlanBucket")
 
 
 @with_logging
@@ -49,6 +58,7 @@ def handler(event, context):
             updated_job
             and updated_job.get("JobStatus") == "FORGET_COMPLETED_CLEANUP_IN_PROGRESS"
         ):
+            delete_match_plans(job_id)
             try:
                 clear_deletion_queue(updated_job)
                 emit_event(
@@ -62,6 +72,7 @@ def handler(event, context):
                     "StreamProcessor",
                 )
         elif updated_job and updated_job.get("JobStatus") in skip_cleanup_states:
+            delete_match_plans(job_id)
             emit_event(job_id, "CleanupSkipped", utc_timestamp(), "StreamProcessor")
 
 
@@ -106,6 +117,35 @@ def clear_deletion_queue(job):
             batch.delete_item(Key={"DeletionQueueItemId": item["DeletionQueueItemId"]})
 
 
+def delete_match_plans(job_id):
+    """
+    Deletes the match plans offloaded for the deletion queue of a job. Plans
+    which can't be deleted are expired by the bucket lifecycle rules
+    """
+    logger.info("Deleting match plans")
+    try:
+        keys = [
+            obj["Key"]
+            for obj in paginate(
+                s3,
+                s3.list_objects_v2,
+                ["Contents"],
+                Bucket=plan_bucket,
+                Prefix=get_match_plan_prefix(job_id),
+            )
+        ]
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(
+                Bucket=plan_bucket,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[i : i + 1000]],
+                    "Quiet": True,
+                },
+            )
+    except ClientError as e:
+        logger.error("Unable to delete match plans: %s", str(e))
+
+
 def is_operation(record, operation):
     return record.get("eventName") == operation
 
@@ -23,6 +23,7 @@ STRUCT = "struct"
 STRUCT_PREFIX = "struct<"
 STRUCT_SUFFIX = ">"
 SCHEMA_INVALID = "Column schema is not valid"
+CSV_OPEN_CSV_SERDE = "org.apache.hadoop.hive.serde2.OpenCSVSerde"
 ALLOWED_TYPES = [
     "bigint",
     "char",
@@ -71,6 +72,13 @@ def generate_athena_queries(data_mapper, deletion_items):
     }
     if data_mapper.get("RoleArn", None):
         msg["RoleArn"] = data_mapper["RoleArn"]
+    if data_mapper.get("FormatOptions", None):
+        msg["FormatOptions"] = data_mapper["FormatOptions"]
+    if data_mapper["Format"] == "csv":
+        msg["FormatOptions"] = {
+            **get_csv_format_options(table),
+            **msg.get("FormatOptions", {}),
+        }
     if len(partition_keys) == 0:
         queries.append(msg)
     else:
@@ -159,6 +167,38 @@ def get_table(db, table_name):
     return glue_client.get_table(DatabaseName=db, Name=table_name)["Table"]
 
 
+def get_serde_character(value):
+    """
+    Hive reads numeric SerDe delimiter parameters as byte values
+    """
+    return chr(int(value)) if value.isdigit() else value
+
+
+def get_csv_format_options(table):
+    """
+    Returns the options the Fargate task needs to parse the CSV objects of a
+    table: its column names, header lines and the characters of its SerDe
+    """
+    serde_info = table["StorageDescriptor"]["SerdeInfo"]
+    params = serde_info.get("Parameters", {})
+    options = {
+        "ColumnNames": [c["Name"] for c in table["StorageDescriptor"]["Columns"]],
+        "HeaderLineCount": int(
+            table.get("Parameters", {}).get("skip.header.line.count", 0)
+        ),
+    }
+    if serde_info["SerializationLibrary"] == CSV_OPEN_CSV_SERDE:
+        options["FieldDelimiter"] = params.get("separatorChar", ",")
+        options["QuoteChar"] = params.get("quoteChar", '"')
+        options["EscapeChar"] = params.get("escapeChar", "\\")
+    else:
+        delimiter = params.get("field.delim", params.get("serialization.format", "1"))
+        options["FieldDelimiter"] = get_serde_character(delimiter)
+        if "escape.delim" in params:
+            options["EscapeChar"] = get_serde_character(params["escape.delim"])
+    return options
+
+
 def get_partitions(db, table_name):
     return paginate(
         glue_client,
@@ -1,16 +1,21 @@
 """
 Submits results from Athena queries to the Fargate deletion queue
 """
+import gzip
+import hashlib
+import json
 import os
 
 import boto3
 
 from decorators import with_logging
-from boto_utils import paginate, batch_sqs_msgs
+from boto_utils import paginate, batch_sqs_msgs, get_match_plan_key
 
 athena = boto3.client("athena")
+s3 = boto3.client("s3")
 sqs = boto3.resource("sqs")
 queue = sqs.Queue(os.getenv("QueueUrl"))
+bucket = os.getenv("MatchPlanBucket")
 
 
 @with_logging
@@ -31,18 +36,38 @@ def handler(event, context):
     )
 
     paths = [row["Data"][path_field_index]["VarCharValue"] for row in rows]
+    columns_hash = offload_columns(event["JobId"], event["Columns"]) if paths else None
     messages = []
     for p in paths:
         msg = {
             "JobId": event["JobId"],
             "Object": p,
-            "Columns": event["Columns"],
+            "ColumnsHash": columns_hash,
             "RoleArn": event.get("RoleArn", None),
             "DeleteOldVersions": event.get("DeleteOldVersions", True),
             "Format": event.get("Format"),
+            "FormatOptions": event.get("FormatOptions"),
         }
         messages.append({k: v for k, v in msg.items() if v is not None})
 
     batch_sqs_msgs(queue, messages)
 
     return len(paths)
+
+
+def offload_columns(job_id, columns):
+    """
+    Writes the columns and MatchIds of the query to the match plan bucket as
+    compressed JSON, keyed by the job and the SHA-256 hash of the JSON, and
+    returns the hash. Messages only carry the hash, so their size doesn't
+    depend on the number of MatchIds and the Fargate tasks fetch each distinct
+    set once. The plans of a job are deleted when the job is cleaned up
+    """
+    body = json.dumps(columns, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    columns_hash = hashlib.sha256(body).hexdigest()
+    s3.put_object(
+        Bucket=bucket,
+        Key=get_match_plan_key(job_id, columns_hash),
+        Body=gzip.compress(body),
+    )
+    return columns_hash
@@ -16,6 +16,10 @@ DLQ_URL=$(aws cloudformation describe-stacks \
   --stack-name S3F2 \
   --query 'Stacks[0].Outputs[?OutputKey==`DLQUrl`].OutputValue' \
   --output text)
+MATCH_PLAN_BUCKET=$(aws cloudformation describe-stacks \
+  --stack-name S3F2 \
+  --query 'Stacks[0].Outputs[?OutputKey==`MatchPlanBucket`].OutputValue' \
+  --output text)
 ACCOUNT_ID=$(aws sts get-caller-identity --query Account --output text)
 # Assume IAM Role to be passed to container
 SESSION_DATA=$(aws sts assume-role \
@@ -32,6 +36,7 @@ docker run \
 	-e DELETE_OBJECTS_QUEUE="${QUEUE_URL}" \
 	-e DLQ="${DLQ_URL}" \
 	-e JobTable="${JOB_TABLE}" \
+	-e MatchPlanBucket="${MATCH_PLAN_BUCKET}" \
 	-e AWS_DEFAULT_REGION="${REGION}" \
 	-e AWS_ACCESS_KEY_ID="${AWS_ACCESS_KEY_ID}" \
 	-e AWS_SECRET_ACCESS_KEY="${AWS_SECRET_ACCESS_KEY}" \
@@ -130,6 +130,21 @@ test("it should serialize dbs and tables", () => {
   ).toMatchSnapshot();
 });
 
+test("it should serialize csv tables", () => {
+  const csvTable = tableMaker({
+    dbname: "db6",
+    tablename: "csv",
+    columns: [{ Name: "id", Type: "string" }],
+    location: "s3://my-s3-bucket/csv/",
+    serde: {
+      Parameters: { "field.delim": "," },
+      SerializationLibrary: "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe"
+    }
+  });
+  const result = glueSerializer([{ TableList: [csvTable] }]);
+  expect(result.databases[0].tables[0].format).toEqual("csv");
+});
+
 test("it should throw error when deserializing a invalid table", () => {
   const brokenTable = tableMaker({
     dbname: "db5",
@@ -7,6 +7,16 @@ export const glueSerializer = tables => {
     "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe";
   const JSON_OPENX_SERDE = "org.openx.data.jsonserde.JsonSerDe";
   const JSON_HIVE_SERDE = "org.apache.hive.hcatalog.data.JsonSerDe";
+  const CSV_LAZY_SIMPLE_SERDE =
+    "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe";
+  const CSV_OPEN_CSV_SERDE = "org.apache.hadoop.hive.serde2.OpenCSVSerde";
+  const FORMATS = {
+    [PARQUET_SERDE]: "parquet",
+    [JSON_OPENX_SERDE]: "json",
+    [JSON_HIVE_SERDE]: "json",
+    [CSV_LAZY_SIMPLE_SERDE]: "csv",
+    [CSV_OPEN_CSV_SERDE]: "csv"
+  };
 
   const ARRAYSTRUCT = "array<struct>";
   const ARRAYSTRUCTPREFIX = "array<struct<";
@@ -173,10 +183,8 @@ export const glueSerializer = tables => {
   };
 
   tables.forEach(table => {
-    const supportedTables = table.TableList.filter(x =>
-      [JSON_HIVE_SERDE, JSON_OPENX_SERDE, PARQUET_SERDE].includes(
-        x.StorageDescriptor.SerdeInfo.SerializationLibrary
-      )
+    const supportedTables = table.TableList.filter(
+      x => FORMATS[x.StorageDescriptor.SerdeInfo.SerializationLibrary]
     );
 
     if (supportedTables.length > 0)
@@ -185,10 +193,7 @@ export const glueSerializer = tables => {
         tables: supportedTables.map(t => ({
           name: t.Name,
           columns: t.StorageDescriptor.Columns.map(columnMapper),
-          format:
-            t.StorageDescriptor.SerdeInfo.SerializationLibrary === PARQUET_SERDE
-              ? "parquet"
-              : "json"
+          format: FORMATS[t.StorageDescriptor.SerdeInfo.SerializationLibrary]
         }))
       });
   });
@@ -346,8 +346,8 @@ def test_it_rejects_not_supported_tables(
     get_existing_s3_locations.return_value = []
     mock_get_location.return_value = "s3://bucket/prefix/"
     mock_get_format.return_value = (
-        "org.apache.hadoop.hive.serde2.OpenCSVSerde",
-        {"field.delim": ","},
+        "org.apache.hadoop.hive.serde2.RegexSerDe",
+        {"input.regex": "(.*)"},
     )
     with pytest.raises(ValueError) as e:
         handlers.validate_mapper(
@@ -365,7 +365,81 @@ def test_it_rejects_not_supported_tables(
     assert (
         e.value.args[0] == "The format for the specified table is not supported. "
         "The SerDe lib must be one of org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe,"
-        " org.apache.hive.hcatalog.data.JsonSerDe, org.openx.data.jsonserde.JsonSerDe"
+        " org.apache.hive.hcatalog.data.JsonSerDe, org.openx.data.jsonserde.JsonSerDe,"
+        " org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe,"
+        " org.apache.hadoop.hive.serde2.OpenCSVSerde"
+    )
+
+
+@patch("backend.lambdas.data_mappers.handlers.get_existing_s3_locations")
+@patch("backend.lambdas.data_mappers.handlers.get_glue_table_location")
+@patch("backend.lambdas.data_mappers.handlers.get_glue_table_format")
+@patch("backend.lambdas.data_mappers.handlers.get_table_details_from_mapper")
+@pytest.mark.parametrize(
+    "serde_lib,serde_params",
+    [
+        ("org.apache.hadoop.hive.serde2.OpenCSVSerde", {"separatorChar": ","}),
+        ("org.apache.hadoop.hive.serde2.OpenCSVSerde", {}),
+        ("org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe", {"field.delim": "\t"}),
+        ("org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe", {"field.delim": "1"}),
+    ],
+)
+def test_it_accepts_csv_tables(
+    mock_get_details,
+    mock_get_format,
+    mock_get_location,
+    get_existing_s3_locations,
+    serde_lib,
+    serde_params,
+):
+    mock_get_details.return_value = get_table_stub({"Location": "s3://bucket/prefix/"})
+    get_existing_s3_locations.return_value = []
+    mock_get_location.return_value = "s3://bucket/prefix/"
+    mock_get_format.return_value = (serde_lib, serde_params)
+    handlers.validate_mapper(
+        {
+            "DataMapperId": "1234",
+            "Columns": ["column"],
+            "QueryExecutor": "athena",
+            "QueryExecutorParameters": {
+                "DataCatalogProvider": "glue",
+                "Database": "test",
+                "Table": "test",
+            },
+        }
+    )
+
+
+@patch("backend.lambdas.data_mappers.handlers.get_existing_s3_locations")
+@patch("backend.lambdas.data_mappers.handlers.get_glue_table_location")
+@patch("backend.lambdas.data_mappers.handlers.get_glue_table_format")
+@patch("backend.lambdas.data_mappers.handlers.get_table_details_from_mapper")
+def test_it_rejects_csv_with_multi_character_delimiters(
+    mock_get_details, mock_get_format, mock_get_location, get_existing_s3_locations
+):
+    mock_get_details.return_value = get_table_stub({"Location": "s3://bucket/prefix/"})
+    get_existing_s3_locations.return_value = []
+    mock_get_location.return_value = "s3://bucket/prefix/"
+    mock_get_format.return_value = (
+        "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe",
+        {"field.delim": "||"},
+    )
+    with pytest.raises(ValueError) as e:
+        handlers.validate_mapper(
+            {
+                "DataMapperId": "1234",
+                "Columns": ["column"],
+                "QueryExecutor": "athena",
+                "QueryExecutorParameters": {
+                    "DataCatalogProvider": "glue",
+                    "Database": "test",
+                    "Table": "test",
+                },
+            }
+        )
+    assert (
+        e.value.args[0] == "The parameter field.delim must be a single character for "
+        "SerDe library org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe"
     )
 
 
@@ -468,6 +542,51 @@ def test_it_rejects_json_with_column_mapping(
     )
 
 
+@pytest.mark.parametrize(
+    "mapper",
+    [
+        {"FormatOptions": {"CompressionLevel": 3}},
+        {"FormatOptions": {"Compression": "snappy"}},
+        {"FormatOptions": {"Compression": "zstd", "CompressionLevel": 22}},
+        {"FormatOptions": {"Compression": "brotli", "CompressionLevel": 0}},
+        {"Format": "json", "FormatOptions": {"CompressionLevel": 9}},
+    ],
+)
+def test_it_accepts_valid_compression_levels(mapper):
+    handlers.validate_format_options(mapper)
+
+
+@pytest.mark.parametrize(
+    "mapper,message",
+    [
+        (
+            {"FormatOptions": {"Compression": "snappy", "CompressionLevel": 3}},
+            "The compression codec snappy doesn't support a CompressionLevel",
+        ),
+        (
+            {"FormatOptions": {"Compression": "none", "CompressionLevel": 3}},
+            "The compression codec none doesn't support a CompressionLevel",
+        ),
+        (
+            {"FormatOptions": {"Compression": "gzip", "CompressionLevel": 10}},
+            "The CompressionLevel must be between 1 and 9",
+        ),
+        (
+            {"FormatOptions": {"CompressionLevel": -1}},
+            "The CompressionLevel must be between 0 and 9",
+        ),
+        (
+            {"Format": "json", "FormatOptions": {"CompressionLevel": 22}},
+            "The CompressionLevel must be between 0 and 9",
+        ),
+    ],
+)
+def test_it_rejects_invalid_compression_levels(mapper, message):
+    with pytest.raises(ValueError) as e:
+        handlers.validate_format_options(mapper)
+    assert message == e.value.args[0]
+
+
 def test_it_detects_overlaps():
     assert handlers.is_overlap("s3://bucket/prefix/", "s3://bucket/prefix/subprefix/")
     assert handlers.is_overlap("s3://bucket/prefix/subprefix/", "s3://bucket/prefix/")
@@ -0,0 +1,138 @@
+import gzip
+import zlib
+from io import BytesIO
+
+from mock import patch
+
+import pytest
+
+from backend.ecs_tasks.delete_files.compression import (
+    ParallelGzipWriter,
+    detect_codec,
+    get_codec,
+)
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+
+def get_data(size):
+    return b"".join(
+        b'{"customer_id": "%d", "n": %d}\n' % (i, i * 7) for i in range(size)
+    )
+
+
+@pytest.mark.parametrize("block_size", [1, 64, 1000, 1 << 20])
+@pytest.mark.parametrize("workers", [1, 4])
+@pytest.mark.parametrize("size", [0, 10, 200])
+def test_it_writes_single_gzip_member(block_size, workers, size):
+    data = get_data(size)
+    out = BytesIO()
+    with ParallelGzipWriter(out, block_size=block_size, workers=workers) as writer:
+        for i in range(0, len(data), 100):
+            writer.write(memoryview(data)[i : i + 100])
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    assert data == decompressor.decompress(out.getvalue())
+    assert decompressor.eof
+    assert b"" == decompressor.unused_data
+    assert data == gzip.decompress(out.getvalue())
+
+
+@patch("backend.ecs_tasks.delete_files.compression.deflate_block")
+def test_it_uses_compression_level(mock_deflate):
+    mock_deflate.return_value = b""
+    with ParallelGzipWriter(BytesIO(), 1, block_size=10) as writer:
+        writer.write(b"x" * 15)
+    assert [1, 1] == [c[0][2] for c in mock_deflate.call_args_list]
+    assert [False, True] == [c[0][3] for c in mock_deflate.call_args_list]
+
+
+def test_it_defaults_to_zlib_compression_level():
+    data = get_data(1000)
+    out = BytesIO()
+    with ParallelGzipWriter(out, None) as writer:
+        writer.write(data)
+    assert len(gzip.compress(data, 6)) + 10 >= len(out.getvalue())
+
+
+def test_it_primes_blocks_with_previous_block():
+    data = get_data(100)
+    out = BytesIO()
+    with ParallelGzipWriter(out, block_size=len(data)) as writer:
+        writer.write(data * 2)
+    assert len(out.getvalue()) < len(gzip.compress(data)) + 100
+
+
+def test_it_stops_workers_on_error():
+    out = BytesIO()
+    with pytest.raises(RuntimeError):
+        with ParallelGzipWriter(out, block_size=10) as writer:
+            writer.write(b"x" * 100)
+            raise RuntimeError("Failed")
+    assert writer.closed
+    assert writer.executor._shutdown
+    assert not writer.pending
+
+
+@pytest.mark.parametrize(
+    "object_path,expected",
+    [
+        ("s3://bucket/data.json.gz", "gzip"),
+        ("s3://bucket/data.json.ZST", "zstd"),
+        ("s3://bucket/data.json.bz2", "bz2"),
+        ("s3://bucket/data.json.sz", "snappy"),
+        ("s3://bucket/data.lz4", "lz4"),
+        ("s3://bucket/data.json", None),
+    ],
+)
+def test_it_detects_codec_from_extension(object_path, expected):
+    assert expected == detect_codec(object_path)
+
+
+@pytest.mark.parametrize(
+    "head,expected",
+    [
+        (b"\x1f\x8b\x08\x00", "gzip"),
+        (b"\x28\xb5\x2f\xfd\x00", "zstd"),
+        (b"BZh91AY", "bz2"),
+        (b"\xff\x06\x00\x00sNaPpY", "snappy"),
+        (b"\x04\x22\x4d\x18", "lz4"),
+        (b'{"customer_id": 1}\n', None),
+        (b"", None),
+    ],
+)
+def test_it_detects_codec_from_magic_bytes(head, expected):
+    input_file = BytesIO(b"xx" + head)
+    input_file.seek(2)
+    assert expected == detect_codec("s3://bucket/data", input_file)
+    assert 2 == input_file.tell()
+
+
+@pytest.mark.parametrize("codec", ["gzip", "zstd", "bz2", "lz4"])
+def test_it_round_trips_codecs(codec):
+    data = get_data(1000)
+    out = BytesIO()
+    writer = get_codec(codec).writer(out, None)
+    writer.write(memoryview(data))
+    writer.close()
+    assert not out.closed
+    assert codec == detect_codec("s3://bucket/data", BytesIO(out.getvalue()))
+    reader = get_codec(codec).reader(BytesIO(out.getvalue()))
+    assert data == reader.read(len(data) + 1)
+
+
+def test_it_round_trips_snappy_framing_format():
+    pytest.importorskip("snappy")
+    data = get_data(10000)
+    out = BytesIO()
+    writer = get_codec("snappy").writer(out, None)
+    writer.write(memoryview(data))
+    writer.close()
+    reader = get_codec("snappy").reader(BytesIO(out.getvalue()))
+    assert data[:100] == reader.read(100)
+    assert data[100:] == reader.read()
+
+
+def test_it_rejects_unknown_codecs():
+    with pytest.raises(ValueError) as e:
+        get_codec("xz")
+    assert "Unsupported compression codec: xz" == e.value.args[0]
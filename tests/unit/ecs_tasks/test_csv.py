@@ -0,0 +1,183 @@
+import gzip
+
+from mock import patch
+
+import pyarrow as pa
+import pytest
+
+from backend.ecs_tasks.delete_files.csv_handler import delete_matches_from_csv_file
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+OPEN_CSV_OPTIONS = {
+    "ColumnNames": ["customer_id", "name", "amount"],
+    "FieldDelimiter": ",",
+    "QuoteChar": '"',
+    "EscapeChar": "\\",
+}
+
+
+def test_it_generates_new_csv_file_without_matches():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = (
+        b'"12345","Doe, John",1.5\n'
+        b'"23456","Doe, Jane",2\n'
+        b'34567,"Smith ""Jr""",3\n'
+    )
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=OPEN_CSV_OPTIONS
+    )
+    # Assert
+    assert isinstance(out, pa.BufferOutputStream)
+    assert {"ProcessedRows": 3, "DeletedRows": 1} == stats
+    assert out.getvalue().to_pybytes() == (
+        b'"12345","Doe, John",1.5\n' b'34567,"Smith ""Jr""",3\n'
+    )
+
+
+def test_it_compares_numbers_as_numbers():
+    # Arrange
+    to_delete = [
+        {"Column": "customer_id", "MatchIds": [23456, 45678], "Type": "Simple"},
+        {"Column": "amount", "MatchIds": [2.5], "Type": "Simple"},
+    ]
+    data = b"12345,a,1\n023456,b,2\n34567,c,2.50\n45678.0,d,3\nx,e,2.5e0\n"
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=OPEN_CSV_OPTIONS
+    )
+    # Assert
+    assert {"ProcessedRows": 5, "DeletedRows": 3} == stats
+    assert out.getvalue().to_pybytes() == b"12345,a,1\n45678.0,d,3\n"
+
+
+def test_it_compares_bigints_as_numbers():
+    # Arrange
+    to_delete = [
+        {
+            "Column": "customer_id",
+            "MatchIds": [
+                1234567890123456789,
+                9223372036854775807,
+                -9223372036854775808,
+                5,
+            ],
+            "Type": "Simple",
+        }
+    ]
+    data = (
+        b"1234567890123456789,a,1\n"
+        b"+09223372036854775807,b,2\n"
+        b"-9223372036854775808,c,3\n"
+        b"9223372036854775808,d,4\n"
+        b"+5,e,5\n"
+        b"12345678901234567890,f,6\n"
+    )
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=OPEN_CSV_OPTIONS
+    )
+    # Assert
+    assert {"ProcessedRows": 6, "DeletedRows": 4} == stats
+    assert out.getvalue().to_pybytes() == (
+        b"9223372036854775808,d,4\n12345678901234567890,f,6\n"
+    )
+
+
+def test_it_handles_composite_columns():
+    # Arrange
+    to_delete = [
+        {
+            "Columns": ["customer_id", "name"],
+            "MatchIds": [[12345, "a"], [23456, "b"]],
+            "Type": "Composite",
+        }
+    ]
+    data = b"12345,a,1\n12345,b,2\n23456,b,3\n23456,a,4\n"
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=OPEN_CSV_OPTIONS
+    )
+    # Assert
+    assert {"ProcessedRows": 4, "DeletedRows": 2} == stats
+    assert out.getvalue().to_pybytes() == b"12345,b,2\n23456,a,4\n"
+
+
+def test_it_matches_columns_case_insensitively():
+    # Arrange
+    to_delete = [
+        {"Column": "Customer_Id", "MatchIds": ["23456"], "Type": "Simple"},
+        {
+            "Columns": ["customer_id", "NAME"],
+            "MatchIds": [[12345, "a"]],
+            "Type": "Composite",
+        },
+    ]
+    data = b"12345,a,1\n23456,b,2\n34567,c,3\n"
+    format_options = dict(OPEN_CSV_OPTIONS, ColumnNames=["CUSTOMER_ID", "Name", "x"])
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=format_options
+    )
+    # Assert
+    assert {"ProcessedRows": 3, "DeletedRows": 2} == stats
+    assert out.getvalue().to_pybytes() == b"34567,c,3\n"
+
+
+def test_it_keeps_headers_and_empty_lines():
+    # Arrange
+    to_delete = [{"Column": "name", "MatchIds": ["b"], "Type": "Simple"}]
+    data = b"customer_id\tname\tamount\r\n1\ta\t1\r\n\r\n2\tb\t2\r\n\n3\t\t3"
+    format_options = {
+        "ColumnNames": ["customer_id", "name", "amount"],
+        "FieldDelimiter": "\t",
+        "HeaderLineCount": 1,
+    }
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data), to_delete, format_options=format_options
+    )
+    # Assert
+    assert {"ProcessedRows": 3, "DeletedRows": 1} == stats
+    assert out.getvalue().to_pybytes() == (
+        b"customer_id\tname\tamount\r\n1\ta\t1\r\n\r\n\n3\t\t3"
+    )
+
+
+@patch("backend.ecs_tasks.delete_files.csv_handler.READ_BUFFER_SIZE", 32)
+def test_it_handles_rows_spanning_blocks_and_compression():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": [3, 5], "Type": "Simple"}]
+    lines = ["%s,%s,%s\n" % (i, "x" * i, i) for i in range(50)]
+    data = gzip.compress(("header\n" + "".join(lines)).encode("utf-8"))
+    # Act
+    out, stats = delete_matches_from_csv_file(
+        pa.BufferReader(data),
+        to_delete,
+        "gzip",
+        format_options={**OPEN_CSV_OPTIONS, "HeaderLineCount": 1},
+    )
+    # Assert
+    assert {"ProcessedRows": 50, "DeletedRows": 2} == stats
+    expected = [line for i, line in enumerate(lines) if i not in [3, 5]]
+    assert "header\n" + "".join(expected) == gzip.decompress(
+        out.getvalue().to_pybytes()
+    ).decode("utf-8")
+
+
+def test_it_throws_meaningful_error_for_serialization_issues():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = b"12345,a,1\n23456,b\n"
+    # Act
+    with pytest.raises(ValueError) as e:
+        delete_matches_from_csv_file(
+            pa.BufferReader(data), to_delete, format_options=OPEN_CSV_OPTIONS
+        )
+    # Assert
+    assert e.value.args[0].startswith(
+        "Serialization error when processing CSV object: "
+        "CSV parse error: Expected 3 columns, got 2"
+    )
@@ -155,5 +155,16 @@ def test_it_sanitises_int_matches(message_stub):
     )
 
 
+@patch("backend.ecs_tasks.delete_files.events.read_cached_columns")
+def test_it_sanitises_matches_of_offloaded_columns(mock_read, message_stub):
+    mock_read.return_value = [{"Column": "a", "MatchIds": ["12345", "23456"]}]
+    message = json.loads(message_stub(ColumnsHash="abc"))
+    del message["Columns"]
+    assert "This message contains ID *** MATCH ID ***" == sanitize_message(
+        "This message contains ID 12345", json.dumps(message)
+    )
+    mock_read.assert_called_with("abc")
+
+
 def test_sanitiser_handles_malformed_messages():
     assert "an error message" == sanitize_message("an error message", "not json")
@@ -0,0 +1,103 @@
+import time
+from threading import Event, Thread
+from unittest.mock import MagicMock, call
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from backend.ecs_tasks.delete_files.heartbeat import VisibilityHeartbeat
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+
+def get_message(receipt_handle):
+    msg = MagicMock()
+    msg.receipt_handle = receipt_handle
+    return msg
+
+
+def test_it_extends_messages_in_batches():
+    client = MagicMock()
+    client.change_message_visibility_batch.return_value = {"Successful": []}
+    messages = [get_message(str(i)) for i in range(12)]
+    heartbeat = VisibilityHeartbeat(client, "https://queue/url", {}, 600, 0)
+    heartbeat.extend(messages)
+    assert 2 == client.change_message_visibility_batch.call_count
+    assert call(
+        QueueUrl="https://queue/url",
+        Entries=[
+            {"Id": "0", "ReceiptHandle": "10", "VisibilityTimeout": 600},
+            {"Id": "1", "ReceiptHandle": "11", "VisibilityTimeout": 600},
+        ],
+    ) == (client.change_message_visibility_batch.call_args)
+
+
+def test_it_extends_in_flight_messages_until_stopped():
+    client = MagicMock()
+    client.change_message_visibility_batch.return_value = {}
+    in_flight = {0: get_message("a")}
+    with VisibilityHeartbeat(client, "https://queue/url", in_flight, 600, 0.01):
+        time.sleep(0.1)
+    calls = client.change_message_visibility_batch.call_count
+    assert calls > 0
+    client.change_message_visibility_batch.assert_called_with(
+        QueueUrl="https://queue/url",
+        Entries=[{"Id": "0", "ReceiptHandle": "a", "VisibilityTimeout": 600}],
+    )
+    time.sleep(0.05)
+    assert calls == client.change_message_visibility_batch.call_count
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        ClientError(
+            {"Error": {"Code": "InternalError"}}, "ChangeMessageVisibilityBatch"
+        ),
+        EndpointConnectionError(endpoint_url="https://queue/url"),
+    ],
+)
+def test_it_keeps_beating_after_errors(error):
+    client = MagicMock()
+    client.change_message_visibility_batch.side_effect = error
+    in_flight = {0: get_message("a")}
+    with VisibilityHeartbeat(client, "https://queue/url", in_flight, 600, 0.01):
+        time.sleep(0.1)
+    assert client.change_message_visibility_batch.call_count > 1
+
+
+def test_it_discards_messages_once_visibility_change_completes():
+    client = MagicMock()
+    started = Event()
+    release = Event()
+
+    def change_visibility(**kwargs):
+        started.set()
+        release.wait(5)
+        return {}
+
+    client.change_message_visibility_batch.side_effect = change_visibility
+    msg = get_message("a")
+    in_flight = {0: msg}
+    with VisibilityHeartbeat(client, "https://queue/url", in_flight, 600, 0.01) as h:
+        assert started.wait(5)
+        discarded = []
+        thread = Thread(target=lambda: discarded.append(h.discard(0)))
+        thread.start()
+        time.sleep(0.05)
+        # The message is only discarded after the visibility change completes
+        assert [] == discarded
+        release.set()
+        thread.join(5)
+        assert [msg] == discarded
+        calls = client.change_message_visibility_batch.call_count
+        time.sleep(0.05)
+    assert {} == in_flight
+    assert calls == client.change_message_visibility_batch.call_count
+
+
+def test_it_does_not_start_where_disabled():
+    client = MagicMock()
+    with VisibilityHeartbeat(client, "https://queue/url", {0: MagicMock()}, 600, 0):
+        time.sleep(0.05)
+    client.change_message_visibility_batch.assert_not_called()
@@ -1,12 +1,20 @@
-from mock import patch
+from mock import patch, MagicMock
 
 import gzip
+from io import BytesIO
+import json
 import pyarrow as pa
 import pyarrow.parquet as pq
 import pytest
 import pandas as pd
 import tempfile
-from backend.ecs_tasks.delete_files.json_handler import delete_matches_from_json_file
+from backend.ecs_tasks.delete_files import json_handler
+from backend.ecs_tasks.delete_files.compression import get_codec
+from backend.ecs_tasks.delete_files.json_handler import (
+    delete_matches_from_json_file,
+    get_value,
+    resolve_key,
+)
 
 pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
 
@@ -309,6 +317,373 @@ def test_it_throws_meaningful_error_for_serialization_issues():
     )
 
 
+@patch("backend.ecs_tasks.delete_files.json_handler.READ_BUFFER_SIZE", 64)
+@patch("backend.ecs_tasks.delete_files.json_handler.WRITE_BUFFER_SIZE", 64)
+def test_it_streams_compressed_files_to_output_stream():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": [3, 5], "Type": "Simple"}]
+    lines = ['{"customer_id": %s, "d": "%s"}\n' % (i, "x" * i) for i in range(50)]
+    # Multi-member gzip files are read as a single stream
+    data = gzip.compress(bytes("".join(lines[:25]), "utf-8")) + gzip.compress(
+        bytes("".join(lines[25:]), "utf-8")
+    )
+    out_stream = pa.BufferOutputStream()
+    # Act
+    out, stats = delete_matches_from_json_file(
+        pa.BufferReader(data), to_delete, True, out_stream
+    )
+    # Assert
+    assert out is out_stream
+    assert {"ProcessedRows": 50, "DeletedRows": 2} == stats
+    expected = [line for i, line in enumerate(lines) if i not in [3, 5]]
+    assert "".join(expected) == gzip.decompress(out.getvalue()).decode("utf-8")
+
+
+def test_it_handles_files_without_trailing_newline():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = '{"customer_id": "12345"}\n{"customer_id": "23456"}'
+    # Act
+    out, stats = delete_matches_from_json_file(
+        pa.BufferReader(data.encode("utf-8")), to_delete
+    )
+    # Assert
+    assert {"ProcessedRows": 2, "DeletedRows": 1} == stats
+    assert to_json_string(out) == '{"customer_id": "12345"}\n'
+
+
+def test_it_only_parses_lines_which_can_contain_matches():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = (
+        '{"customer_id": "12345"}\n'
+        "not json\n"
+        '{"customer_id": "23456"}\n'
+        '{"customer_id": "34567", "comment": "23456"}\n'
+    )
+    # Act
+    with patch(
+        "backend.ecs_tasks.delete_files.json_handler.decode",
+        side_effect=json_handler.decode,
+    ) as mock_loads:
+        out, stats = delete_matches_from_json_file(to_json_file(data), to_delete)
+    # Assert
+    assert 2 == mock_loads.call_count
+    assert {"ProcessedRows": 4, "DeletedRows": 1} == stats
+    assert to_json_string(out) == (
+        '{"customer_id": "12345"}\n'
+        "not json\n"
+        '{"customer_id": "34567", "comment": "23456"}\n'
+    )
+
+
+def test_it_matches_values_written_differently():
+    # Arrange
+    to_delete = [
+        {"Column": "id", "MatchIds": ["a/b", "\u00e9t\u00e9", 12345], "Type": "Simple"},
+        {"Columns": ["first", "last"], "MatchIds": [["a", 1]], "Type": "Composite"},
+    ]
+    data = (
+        '{"id": "a\\/b"}\n'
+        '{"id": "\\u00e9t\\u00e9"}\n'
+        '{"id": 12345.0}\n'
+        '{"id": 1.2345e4}\n'
+        '{"first": "a", "last": true}\n'
+        '{"id": "12346"}\n'
+    )
+    # Act
+    out, stats = delete_matches_from_json_file(to_json_file(data), to_delete)
+    # Assert
+    assert {"ProcessedRows": 6, "DeletedRows": 5} == stats
+    assert to_json_string(out) == '{"id": "12346"}\n'
+
+
+@pytest.mark.parametrize(
+    "match_ids,data",
+    [
+        ([0.00001], '{"id": 0.00001}\n'),
+        ([1e22], '{"id": 10000000000000000000000}\n'),
+        ([2.5], '{"id": 2.50}\n'),
+        ([True], '{"id": 1}\n'),
+        ([True], '{"id": 1.0}\n'),
+    ],
+)
+def test_it_matches_numbers_and_booleans_written_differently(match_ids, data):
+    # Arrange
+    to_delete = [{"Column": "id", "MatchIds": match_ids, "Type": "Simple"}]
+    # Act
+    out, stats = delete_matches_from_json_file(to_json_file(data), to_delete)
+    # Assert
+    assert {"ProcessedRows": 1, "DeletedRows": 1} == stats
+    assert to_json_string(out) == ""
+
+
+@pytest.mark.parametrize("read_buffer_size", [7, 64, 1024])
+def test_it_keeps_retained_lines_byte_identical(read_buffer_size):
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    lines = [
+        b'{"customer_id":"12345","name":"Jos\xc3\xa9"}\r\n',
+        b'{ "customer_id" : "23456" }\n',
+        b'{"customer_id": "34567", "x": 1.50, "e": "\\u00e9"}   \n',
+        b'{"customer_id": "23456", "x": 2}\n',
+        b'{"customer_id": "45678", "d": "%s"}\n' % (b"x" * 100),
+    ]
+    # Act
+    with patch(
+        "backend.ecs_tasks.delete_files.json_handler.READ_BUFFER_SIZE",
+        read_buffer_size,
+    ):
+        out, stats = delete_matches_from_json_file(
+            pa.BufferReader(b"".join(lines)), to_delete
+        )
+    # Assert
+    assert {"ProcessedRows": 5, "DeletedRows": 2} == stats
+    assert out.getvalue().to_pybytes() == lines[0] + lines[2] + lines[4]
+
+
+@patch("backend.ecs_tasks.delete_files.json_handler.WRITE_BUFFER_SIZE", 64)
+def test_it_writes_contiguous_retained_lines_together():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": [10], "Type": "Simple"}]
+    lines = ['{"customer_id": %s}\n' % i for i in range(20)]
+    out_stream = MagicMock()
+    # Act
+    out, stats = delete_matches_from_json_file(
+        to_json_file("".join(lines)), to_delete, out_stream=out_stream
+    )
+    # Assert
+    assert {"ProcessedRows": 20, "DeletedRows": 1} == stats
+    chunks = [bytes(c[0][0]).decode("utf-8") for c in out.write.call_args_list]
+    assert ["".join(lines[:10]), "".join(lines[11:])] == chunks
+
+
+def test_it_resolves_key_paths_per_object_shape():
+    # Arrange
+    objects = [
+        {"User": {"ID": 1, "name": "a"}},
+        {"user": {"id": 2}},
+        {"USER": {"Id": 3, "iD": 4}},
+        {"User": {"ID": 5, "name": "b"}},
+        {"user": None},
+        {"other": 6},
+    ]
+    resolve_key.cache_clear()
+    # Act
+    values = [get_value("user.Id", obj) for obj in objects]
+    # Assert
+    assert [1, 2, 3, 5, None, None] == values
+    assert 3 == resolve_key.cache_info().hits
+
+
+ENGINE_TEST_LINES = [
+    '{"customerId": "12345", "user": {"Id": 1, "name": "a"}, "x": 1.5}\n',
+    '{"customerId": "23456", "user": {"Id": 2, "name": "b"}, "x": 2}\n',
+    '{"customerId": "34567", "user": null, "x": 0}\n',
+    '{"customerId": "45678", "user": {"Id": 4, "name": "d"}, "x": 3}\n',
+    '{"customerId": "56789", "x": 4.0}\n',
+    '{"customerId": "67890", "user": {"Id": 6, "name": "a"}, "x": 5e0}\n',
+    '{"customerId": "78901", "user": {"Id": 1, "name": "b"}, "x": 6}\n',
+]
+
+
+@pytest.mark.parametrize("read_buffer_size", [100, 1024])
+@pytest.mark.parametrize(
+    "to_delete,expected",
+    [
+        (
+            [{"Column": "customerid", "MatchIds": ["23456", 12345], "Type": "Simple"}],
+            [1],
+        ),
+        ([{"Column": "user.id", "MatchIds": [4, "6", 0], "Type": "Simple"}], [3]),
+        ([{"Column": "x", "MatchIds": [2, 4, 5.0, 0], "Type": "Simple"}], [1, 4, 5]),
+        ([{"Column": "missing", "MatchIds": ["12345"], "Type": "Simple"}], []),
+        (
+            [
+                {
+                    "Columns": ["user.Id", "user.Name"],
+                    "MatchIds": [[1, "b"], [6, "a"]],
+                    "Type": "Composite",
+                }
+            ],
+            [5, 6],
+        ),
+    ],
+)
+def test_arrow_engine_matches_like_line_engine(to_delete, expected, read_buffer_size):
+    # Arrange
+    data = "".join(ENGINE_TEST_LINES)
+    expected_out = "".join(
+        line for i, line in enumerate(ENGINE_TEST_LINES) if i not in expected
+    )
+    results = []
+    # Act
+    with patch(
+        "backend.ecs_tasks.delete_files.json_handler.READ_BUFFER_SIZE",
+        read_buffer_size,
+    ):
+        for engine in ["line", "arrow"]:
+            out, stats = delete_matches_from_json_file(
+                to_json_file(data), to_delete, engine=engine
+            )
+            results.append((to_json_string(out), stats))
+    # Assert
+    stats = {"ProcessedRows": len(ENGINE_TEST_LINES), "DeletedRows": len(expected)}
+    assert [(expected_out, stats)] * 2 == results
+
+
+@patch("backend.ecs_tasks.delete_files.json_handler.get_deleted_lines")
+def test_arrow_engine_parses_blocks_with_arrow(mock_get_deleted_lines):
+    # Arrange
+    to_delete = [{"Column": "customerId", "MatchIds": ["23456"], "Type": "Simple"}]
+    # Act
+    out, stats = delete_matches_from_json_file(
+        to_json_file("".join(ENGINE_TEST_LINES)), to_delete, engine="arrow"
+    )
+    # Assert
+    mock_get_deleted_lines.assert_not_called()
+    assert {"ProcessedRows": 7, "DeletedRows": 1} == stats
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        '{"customer_id": "12345"}\n{"customer_id": 23456}\n{"customer_id": "23456"}\n',
+        '{"customer_id": "2001-01-01"}\n{"customer_id": "23456"}\n',
+        '{"customer_id": "12345", "Customer_Id": 1}\n{"customer_id": "23456"}\n',
+        '{"customer_id": "12345"}\n\n{"customer_id": "23456"}\n',
+    ],
+)
+def test_arrow_engine_falls_back_to_line_engine(data):
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    # Act
+    out, stats = delete_matches_from_json_file(
+        to_json_file(data), to_delete, engine="arrow"
+    )
+    # Assert
+    assert 1 == stats["DeletedRows"]
+    assert '{"customer_id": "23456"}\n' not in to_json_string(out)
+
+
+def test_arrow_engine_reports_serialization_errors():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = '{"customer_id": "12345"}\n{"customer_id": "23456", "d":"invalid\n'
+    # Act
+    with pytest.raises(ValueError) as e:
+        delete_matches_from_json_file(to_json_file(data), to_delete, engine="arrow")
+    # Assert
+    assert e.value.args[0] == (
+        "Serialization error when processing JSON object: "
+        "Unterminated string starting at: line 2 column 30 (char 29)"
+    )
+
+
+@pytest.mark.parametrize(
+    "engine,parallel_threshold,expected_parallel",
+    [("arrow", 0, True), ("arrow", 1e9, False), ("line", 0, True), (None, 1e9, False)],
+)
+@patch("backend.ecs_tasks.delete_files.json_handler.READ_BUFFER_SIZE", 64)
+def test_it_processes_large_files_in_parallel(
+    parallel_threshold, expected_parallel, engine
+):
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": [3, 5, 48], "Type": "Simple"}]
+    lines = ['{"customer_id": %s, "d": "%s"}\n' % (i, "x" * i) for i in range(50)]
+    # Act
+    with patch(
+        "backend.ecs_tasks.delete_files.json_handler.parallel_map",
+        wraps=json_handler.parallel_map,
+    ) as mock_parallel_map:
+        out, stats = delete_matches_from_json_file(
+            to_json_file("".join(lines)),
+            to_delete,
+            engine=engine,
+            parallel_threshold=parallel_threshold,
+            workers=4,
+        )
+    # Assert
+    assert expected_parallel == mock_parallel_map.called
+    assert {"ProcessedRows": 50, "DeletedRows": 3} == stats
+    expected = [line for i, line in enumerate(lines) if i not in [3, 5, 48]]
+    assert "".join(expected) == to_json_string(out)
+
+
+@patch("backend.ecs_tasks.delete_files.json_handler.READ_BUFFER_SIZE", 64)
+def test_it_reports_line_numbers_of_errors_when_processing_in_parallel():
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": [3], "Type": "Simple"}]
+    lines = ['{"customer_id": %s}\n' % i for i in range(50)]
+    lines[40] = '{"customer_id": 3\n'
+    # Act
+    with pytest.raises(ValueError) as e:
+        delete_matches_from_json_file(
+            to_json_file("".join(lines)), to_delete, parallel_threshold=0, workers=4,
+        )
+    # Assert
+    assert e.value.args[0] == (
+        "Serialization error when processing JSON object: "
+        "Expecting ',' delimiter: line 41 column 18 (char 17)"
+    )
+
+
+@pytest.mark.parametrize("codec", ["zstd", "bz2", "lz4"])
+def test_it_writes_output_with_input_codec(codec):
+    # Arrange
+    to_delete = [{"Column": "customer_id", "MatchIds": ["23456"], "Type": "Simple"}]
+    data = '{"customer_id": "12345"}\n{"customer_id": "23456"}\n'
+    compressed = BytesIO()
+    writer = get_codec(codec).writer(compressed, None)
+    writer.write(data.encode("utf-8"))
+    writer.close()
+    # Act
+    out, stats = delete_matches_from_json_file(
+        BytesIO(compressed.getvalue()), to_delete, codec
+    )
+    # Assert
+    assert {"ProcessedRows": 2, "DeletedRows": 1} == stats
+    reader = get_codec(codec).reader(BytesIO(out.getvalue().to_pybytes()))
+    assert b'{"customer_id": "12345"}\n' == reader.read(1000)
+
+
+@pytest.mark.parametrize("decoder", sorted(json_handler.DECODERS))
+@pytest.mark.parametrize(
+    "line,expected",
+    [
+        (b'{"a": 1, "b": [1.5, "x\\u00e9"]}', {"a": 1, "b": [1.5, "x\u00e9"]}),
+        (b'{"a": NaN, "b": Infinity}', {"a": float("nan"), "b": float("inf")}),
+        (
+            b'{"a": 123456789012345678901234567890}',
+            {"a": 123456789012345678901234567890},
+        ),
+        (b'{"a": "\\ud800"}', {"a": "\ud800"}),
+        (b'{"a": 1, "a": 2}', {"a": 2}),
+    ],
+)
+def test_decoders_return_same_values(decoder, line, expected):
+    result = json_handler.get_decoder(decoder)(line)
+    assert json.dumps(expected) == json.dumps(result)
+
+
+@pytest.mark.parametrize("decoder", sorted(json_handler.DECODERS))
+@pytest.mark.parametrize(
+    "line", [b'{"a": 1', b'{"a": "x}', b"not json", b"", b'{"a": 1}}']
+)
+def test_decoders_raise_same_errors(decoder, line):
+    with pytest.raises(json.JSONDecodeError) as expected:
+        json.loads(line.decode("utf-8"))
+    with pytest.raises(json.JSONDecodeError) as e:
+        json_handler.get_decoder(decoder)(line)
+    assert str(expected.value) == str(e.value)
+
+
+def test_it_rejects_unknown_decoders():
+    with pytest.raises(ValueError) as e:
+        json_handler.get_decoder("simdjson")
+    assert "Unsupported JSON decoder: simdjson" == e.value.args[0]
+
+
 def to_json_file(data, compressed=False):
     mode = "wb" if compressed else "w+t"
     tmp = tempfile.NamedTemporaryFile(mode=mode)
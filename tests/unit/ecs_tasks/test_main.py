@@ -1,3 +1,4 @@
+import json
 import os
 from argparse import Namespace
 
@@ -22,11 +23,21 @@ with patch.dict(
         main,
         parse_args,
         delete_matches_from_file,
+        get_columns,
+        get_cached_session,
+        get_session_and_client,
+        load_match_plan,
+        validate_message,
     )
 
 pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
 
 
+@pytest.fixture(autouse=True)
+def clear_sessions():
+    get_cached_session.cache_clear()
+
+
 def get_list_object_versions_error():
     return ClientError(
         {
@@ -51,9 +62,9 @@ def get_list_object_versions_error():
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event")
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 def test_happy_path_when_queue_not_empty(
-    mock_save,
+    mock_upload,
     mock_emit,
     mock_delete,
     mock_s3,
@@ -64,28 +75,59 @@ def test_happy_path_when_queue_not_empty(
     mock_s3.S3FileSystem.return_value = mock_s3
     column = {"Column": "customer_id", "MatchIds": ["12345", "23456"]}
     mock_file = MagicMock(version_id="abc123")
-    mock_save.return_value = "new_version123"
+    mock_stream = MagicMock(version_id="new_version123")
+    mock_upload.return_value.__enter__.return_value = mock_stream
     mock_s3.open.return_value = mock_s3
     mock_s3.__enter__.return_value = mock_file
-    mock_delete.return_value = pa.BufferOutputStream(), {"DeletedRows": 1}
+    mock_delete.return_value = mock_stream, {"DeletedRows": 1}
     execute(
         "https://queue/url",
         message_stub(Object="s3://bucket/path/basic.parquet"),
         "receipt_handle",
     )
     mock_s3.open.assert_called_with("s3://bucket/path/basic.parquet", "rb")
-    mock_delete.assert_called_with(mock_file, [column], "parquet", False)
-    mock_save.assert_called_with(
-        ANY, ANY, ANY, "bucket", "path/basic.parquet", "abc123"
+    mock_upload.assert_called_with(ANY, "bucket", "path/basic.parquet", "abc123")
+    mock_delete.assert_called_with(
+        mock_file, [column], "parquet", None, mock_stream, None
     )
     mock_emit.assert_called()
     mock_session.assert_called_with(None)
     mock_verify_integrity.assert_called_with(
         ANY, "bucket", "path/basic.parquet", "abc123", "new_version123"
     )
-    buf = mock_save.call_args[0][2]
-    assert buf.read
-    assert isinstance(buf, pa.BufferReader)  # must be BufferReader for zero-copy
+
+
+@patch.dict(os.environ, {"JobTable": "test"})
+@patch(
+    "backend.ecs_tasks.delete_files.main.validate_bucket_versioning",
+    MagicMock(return_value=True),
+)
+@patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.s3fs")
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
+@patch("backend.ecs_tasks.delete_files.main.emit_deletion_event")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
+@patch("backend.ecs_tasks.delete_files.main.handle_error")
+def test_it_aborts_upload_when_no_deletions_in_parquet_file(
+    mock_error_handler, mock_upload, mock_emit, mock_delete, mock_s3, message_stub
+):
+    mock_s3.S3FileSystem.return_value = mock_s3
+    mock_s3.open.return_value = mock_s3
+    mock_s3.__enter__.return_value = MagicMock(version_id="abc123")
+    mock_delete.return_value = MagicMock(), {"DeletedRows": 0}
+    execute("https://queue/url", message_stub(), "receipt_handle")
+    exit_args = mock_upload.return_value.__exit__.call_args[0]
+    assert exit_args[0] is ValueError
+    mock_emit.assert_not_called()
+    mock_error_handler.assert_called_with(
+        ANY,
+        ANY,
+        "Unprocessable message: The object s3://bucket/path/basic.parquet was "
+        "processed successfully but no rows required deletion",
+        change_msg_visibility=False,
+    )
 
 
 @patch.dict(os.environ, {"JobTable": "test"})
@@ -100,9 +142,9 @@ def test_happy_path_when_queue_not_empty(
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event")
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 def test_happy_path_when_queue_not_empty_for_compressed_json(
-    mock_save,
+    mock_upload,
     mock_emit,
     mock_delete,
     mock_s3,
@@ -113,28 +155,26 @@ def test_happy_path_when_queue_not_empty_for_compressed_json(
     mock_s3.S3FileSystem.return_value = mock_s3
     column = {"Column": "customer_id", "MatchIds": ["12345", "23456"]}
     mock_file = MagicMock(version_id="abc123")
-    mock_save.return_value = "new_version123"
+    mock_stream = MagicMock(version_id="new_version123")
+    mock_upload.return_value.__enter__.return_value = mock_stream
     mock_s3.open.return_value = mock_s3
     mock_s3.__enter__.return_value = mock_file
-    mock_delete.return_value = pa.BufferOutputStream(), {"DeletedRows": 1}
+    mock_delete.return_value = mock_stream, {"DeletedRows": 1}
     execute(
         "https://queue/url",
         message_stub(Object="s3://bucket/path/basic.json.gz", Format="json"),
         "receipt_handle",
     )
     mock_s3.open.assert_called_with("s3://bucket/path/basic.json.gz", "rb")
-    mock_delete.assert_called_with(mock_file, [column], "json", True)
-    mock_save.assert_called_with(
-        ANY, ANY, ANY, "bucket", "path/basic.json.gz", "abc123"
+    mock_upload.assert_called_with(ANY, "bucket", "path/basic.json.gz", "abc123")
+    mock_delete.assert_called_with(
+        mock_file, [column], "json", "gzip", mock_stream, None
     )
     mock_emit.assert_called()
     mock_session.assert_called_with(None)
     mock_verify_integrity.assert_called_with(
         ANY, "bucket", "path/basic.json.gz", "abc123", "new_version123"
     )
-    buf = mock_save.call_args[0][2]
-    assert buf.read
-    assert isinstance(buf, pa.BufferReader)  # must be BufferReader for zero-copy
 
 
 @patch.dict(os.environ, {"JobTable": "test"})
@@ -149,7 +189,7 @@ def test_happy_path_when_queue_not_empty_for_compressed_json(
 @patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event", MagicMock())
-@patch("backend.ecs_tasks.delete_files.main.save", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_session")
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
@@ -182,17 +222,17 @@ def test_it_assumes_role(mock_delete, mock_s3, mock_session, message_stub):
 @patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 @patch("backend.ecs_tasks.delete_files.main.delete_old_versions")
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 def test_it_removes_old_versions(
-    mock_delete, mock_s3, mock_delete_versions, mock_save, message_stub
+    mock_delete, mock_s3, mock_delete_versions, mock_upload, message_stub
 ):
     mock_s3.S3FileSystem.return_value = mock_s3
     mock_s3.open.return_value = mock_s3
     mock_s3.__enter__.return_value = MagicMock(version_id="abc123")
-    mock_save.return_value = "new_version123"
+    mock_upload.return_value.__enter__.return_value.version_id = "new_version123"
     mock_delete.return_value = pa.BufferOutputStream(), {"DeletedRows": 1}
     execute(
         "https://queue/url",
@@ -219,18 +259,18 @@ def test_it_removes_old_versions(
 @patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 @patch("backend.ecs_tasks.delete_files.main.delete_old_versions")
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 @patch("backend.ecs_tasks.delete_files.main.handle_error")
 def test_it_handles_old_version_delete_failures(
-    mock_handle, mock_delete, mock_s3, mock_delete_versions, mock_save, message_stub,
+    mock_handle, mock_delete, mock_s3, mock_delete_versions, mock_upload, message_stub,
 ):
     mock_s3.S3FileSystem.return_value = mock_s3
     mock_s3.open.return_value = mock_s3
     mock_s3.__enter__.return_value = MagicMock(version_id="abc123")
-    mock_save.return_value = "new_version123"
+    mock_upload.return_value.__enter__.return_value.version_id = "new_version123"
     mock_delete.return_value = pa.BufferOutputStream(), {"DeletedRows": 1}
     mock_delete_versions.side_effect = DeleteOldVersionsError(errors=["access denied"])
     execute(
@@ -243,7 +283,10 @@ def test_it_handles_old_version_delete_failures(
         "receipt_handle",
     )
     mock_handle.assert_called_with(
-        ANY, ANY, "Unable to delete previous versions: access denied"
+        ANY,
+        ANY,
+        "Unable to delete previous versions: access denied",
+        change_msg_visibility=False,
     )
 
 
@@ -258,10 +301,10 @@ def test_it_handles_old_version_delete_failures(
 @patch("backend.ecs_tasks.delete_files.main.s3fs")
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 @patch("backend.ecs_tasks.delete_files.main.emit_deletion_event")
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 @patch("backend.ecs_tasks.delete_files.main.handle_error")
 def test_it_handles_no_deletions(
-    mock_handle, mock_save, mock_emit, mock_delete, mock_s3, message_stub
+    mock_handle, mock_upload, mock_emit, mock_delete, mock_s3, message_stub
 ):
     mock_s3.S3FileSystem.return_value = mock_s3
     column = {"Column": "customer_id", "MatchIds": ["12345", "23456"]}
@@ -272,13 +315,14 @@ def test_it_handles_no_deletions(
         "receipt_handle",
     )
     mock_s3.open.assert_called_with("s3://bucket/path/basic.parquet", "rb")
-    mock_save.assert_not_called()
+    assert mock_upload.return_value.__exit__.call_args[0][0] is ValueError
     mock_emit.assert_not_called()
     mock_handle.assert_called_with(
         ANY,
         ANY,
         "Unprocessable message: The object s3://bucket/path/basic.parquet "
         "was processed successfully but no rows required deletion",
+        change_msg_visibility=False,
     )
 
 
@@ -302,7 +346,7 @@ def test_it_handles_missing_col_exceptions(
     execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Apache Arrow processing error: 'FAIL'"
+        ANY, ANY, "Apache Arrow processing error: 'FAIL'", change_msg_visibility=False
     )
 
 
@@ -324,7 +368,7 @@ def test_it_handles_arrow_exceptions(mock_error_handler, mock_delete, message_st
     execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Apache Arrow processing error: FAIL"
+        ANY, ANY, "Apache Arrow processing error: FAIL", change_msg_visibility=False
     )
 
 
@@ -391,7 +435,7 @@ def test_it_handles_io_errors(mock_error_handler, mock_s3, message_stub):
     execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Unable to retrieve object: an error"
+        ANY, ANY, "Unable to retrieve object: an error", change_msg_visibility=False
     )
 
 
@@ -412,7 +456,10 @@ def test_it_handles_file_too_big(mock_error_handler, mock_s3, message_stub):
     execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Insufficient memory to work on object: Too big"
+        ANY,
+        ANY,
+        "Insufficient memory to work on object: Too big",
+        change_msg_visibility=False,
     )
 
 
@@ -430,10 +477,14 @@ def test_it_handles_generic_error(mock_error_handler, mock_s3, message_stub):
     mock_s3.S3FileSystem.return_value = mock_s3
     mock_s3.open.side_effect = RuntimeError("Some Error")
     # Act
-    execute("https://queue/url", message_stub(), "receipt_handle")
+    deleted = execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
+    assert not deleted
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Unknown error during message processing: Some Error"
+        ANY,
+        ANY,
+        "Unknown error during message processing: Some Error",
+        change_msg_visibility=False,
     )
 
 
@@ -451,7 +502,10 @@ def test_it_handles_unversioned_buckets(
     execute("https://queue/url", message_stub(), "receipt_handle")
     # Assert
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Unprocessable message: Versioning validation Error"
+        ANY,
+        ANY,
+        "Unprocessable message: Versioning validation Error",
+        change_msg_visibility=False,
     )
     mock_versioning.assert_called_with(ANY, "bucket")
 
@@ -467,20 +521,21 @@ def test_it_handles_unversioned_buckets(
 @patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.delete_matches_from_file")
 @patch("backend.ecs_tasks.delete_files.main.handle_error")
-@patch("backend.ecs_tasks.delete_files.main.save")
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream")
 def test_it_provides_logs_for_acl_fail(
-    mock_save, mock_error_handler, mock_delete, message_stub
+    mock_upload, mock_error_handler, mock_delete, message_stub
 ):
-    mock_save.side_effect = ClientError({}, "PutObjectAcl")
+    mock_upload.return_value.__exit__.side_effect = ClientError({}, "PutObjectAcl")
     mock_delete.return_value = pa.BufferOutputStream(), {"DeletedRows": 1}
-    execute("https://queue/url", message_stub(), "receipt_handle")
-    mock_save.assert_called()
+    execute("https://queue/url", message_stub(Format="json"), "receipt_handle")
+    mock_upload.return_value.__exit__.assert_called()
     mock_error_handler.assert_called_with(
         ANY,
         ANY,
         "ClientError: An error occurred (Unknown) when calling the PutObjectAcl "
         "operation: Unknown. Redacted object uploaded successfully but unable to "
         "restore WRITE ACL",
+        change_msg_visibility=False,
     )
 
 
@@ -489,9 +544,7 @@ def test_it_provides_logs_for_acl_fail(
     "backend.ecs_tasks.delete_files.main.validate_bucket_versioning",
     MagicMock(return_value=True),
 )
-@patch(
-    "backend.ecs_tasks.delete_files.main.save", MagicMock(return_value="new_version")
-)
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.s3fs", MagicMock())
@@ -511,7 +564,10 @@ def test_it_provides_logs_for_failed_version_integrity_check_and_performs_rollba
     execute("https://queue/url", message_stub(), "receipt_handle")
     mock_verify_integrity.assert_called()
     mock_error_handler.assert_called_with(
-        ANY, ANY, "Object version integrity check failed: Some error"
+        ANY,
+        ANY,
+        "Object version integrity check failed: Some error",
+        change_msg_visibility=False,
     )
     rollback_mock.assert_called_with(
         ANY, "bucket", "path/basic.parquet", "new_version", on_error=ANY
@@ -523,9 +579,7 @@ def test_it_provides_logs_for_failed_version_integrity_check_and_performs_rollba
     "backend.ecs_tasks.delete_files.main.validate_bucket_versioning",
     MagicMock(return_value=True),
 )
-@patch(
-    "backend.ecs_tasks.delete_files.main.save", MagicMock(return_value="new_version")
-)
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_queue", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.s3fs", MagicMock())
@@ -546,6 +600,7 @@ def test_it_provides_logs_for_get_latest_version_fail(
         "ClientError: An error occurred (InvalidArgument) when calling the "
         "ListObjectVersions operation: Invalid version id specified. Could "
         "not verify redacted object version integrity",
+        change_msg_visibility=False,
     )
 
 
@@ -554,9 +609,7 @@ def test_it_provides_logs_for_get_latest_version_fail(
     "backend.ecs_tasks.delete_files.main.validate_bucket_versioning",
     MagicMock(return_value=True),
 )
-@patch(
-    "backend.ecs_tasks.delete_files.main.save", MagicMock(return_value="new_version")
-)
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.s3fs", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
@@ -576,7 +629,12 @@ def test_it_provides_logs_for_failed_rollback_client_error(
     execute("https://queue/url", message_stub(), "receipt_handle")
     mock_verify_integrity.assert_called()
     assert mock_error_handler.call_args_list == [
-        call(ANY, ANY, "Object version integrity check failed: Some error"),
+        call(
+            ANY,
+            ANY,
+            "Object version integrity check failed: Some error",
+            change_msg_visibility=False,
+        ),
         call(
             ANY,
             ANY,
@@ -593,9 +651,7 @@ def test_it_provides_logs_for_failed_rollback_client_error(
     "backend.ecs_tasks.delete_files.main.validate_bucket_versioning",
     MagicMock(return_value=True),
 )
-@patch(
-    "backend.ecs_tasks.delete_files.main.save", MagicMock(return_value="new_version")
-)
+@patch("backend.ecs_tasks.delete_files.main.MultipartUploadStream", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.validate_message", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.s3fs", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_session", MagicMock())
@@ -615,7 +671,12 @@ def test_it_provides_logs_for_failed_rollback_generic_error(
     execute("https://queue/url", message_stub(), "receipt_handle")
     mock_verify_integrity.assert_called()
     assert mock_error_handler.call_args_list == [
-        call(ANY, ANY, "Object version integrity check failed: Some error"),
+        call(
+            ANY,
+            ANY,
+            "Object version integrity check failed: Some error",
+            change_msg_visibility=False,
+        ),
         call(
             ANY,
             ANY,
@@ -722,6 +783,17 @@ def test_kill_handler_exits_successfully_when_done(mock_error_handler):
         assert 0 == e.value.code
 
 
+@patch("backend.ecs_tasks.delete_files.main.handle_error")
+def test_kill_handler_stops_heartbeat_before_cleaning_up(mock_error_handler):
+    mock_heartbeat = MagicMock()
+    mock_error_handler.side_effect = lambda *_: (
+        mock_heartbeat.stop.assert_called_once()
+    )
+    with pytest.raises(SystemExit):
+        kill_handler([MagicMock()], MagicMock(), mock_heartbeat)
+    mock_error_handler.assert_called_once()
+
+
 @patch("backend.ecs_tasks.delete_files.main.handle_error")
 def test_it_gracefully_handles_cleanup_issues(mock_error_handler):
     with pytest.raises(SystemExit):
@@ -740,13 +812,26 @@ def test_it_inits_arg_parser_with_defaults():
     assert all(
         [
             hasattr(res, attr)
-            for attr in ["wait_time", "max_messages", "sleep_time", "queue_url"]
+            for attr in [
+                "wait_time",
+                "max_messages",
+                "sleep_time",
+                "queue_url",
+                "rss_watermark",
+                "prefetch",
+                "visibility_timeout",
+                "heartbeat_interval",
+            ]
         ]
     )
     assert isinstance(res.wait_time, int)
     assert isinstance(res.max_messages, int)
     assert isinstance(res.sleep_time, int)
     assert isinstance(res.queue_url, str)
+    assert isinstance(res.rss_watermark, int)
+    assert isinstance(res.prefetch, int)
+    assert isinstance(res.visibility_timeout, int)
+    assert isinstance(res.heartbeat_interval, int)
 
 
 @patch("backend.ecs_tasks.delete_files.main.boto3")
@@ -772,7 +857,7 @@ def test_it_does_not_override_user_supplied_endpoint_url(mock_boto):
 
 
 @patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
-@patch("backend.ecs_tasks.delete_files.main.Pool")
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool")
 @patch("backend.ecs_tasks.delete_files.main.get_queue")
 def test_it_starts_subprocesses(mock_queue, mock_pool):
     mock_queue.return_value = mock_queue
@@ -781,19 +866,124 @@ def test_it_starts_subprocesses(mock_queue, mock_pool):
     # Break out of while loop
     mock_pool.return_value = mock_pool
     mock_pool.__enter__.return_value = mock_pool
-    mock_pool.starmap.side_effect = RuntimeError("Break loop")
+    mock_pool.get_result.side_effect = RuntimeError("Break loop")
     with pytest.raises(RuntimeError):
-        main("https://queue/url", 1, 1, 1)
-    mock_pool.assert_called_with(maxtasksperchild=1)
-    mock_pool.starmap.assert_called_with(
-        ANY, [("https://queue/url", mock_message.body, mock_message.receipt_handle)]
+        main("https://queue/url", 1, 1, 1, 1024, 0)
+    mock_pool.assert_called_with(processes=1, rss_watermark=1024 * 1024 * 1024)
+    mock_pool.submit.assert_called_with(
+        ANY, ("https://queue/url", mock_message.body, mock_message.receipt_handle)
     )
     mock_queue.receive_messages.assert_called_with(
         WaitTimeSeconds=1, MaxNumberOfMessages=1
     )
+    mock_pool.get_result.assert_called_with(timeout=None)
+
+
+@patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.handle_error")
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool")
+@patch("backend.ecs_tasks.delete_files.main.get_queue")
+def test_it_receives_messages_as_soon_as_workers_are_free(
+    mock_queue, mock_pool, mock_error_handler
+):
+    mock_queue.return_value = mock_queue
+    messages = [MagicMock(name=str(i)) for i in range(4)]
+    mock_queue.receive_messages.side_effect = [
+        messages[:2],
+        messages[2:3],
+        messages[3:4],
+        RuntimeError("Break loop"),
+    ]
+    mock_pool.return_value = mock_pool
+    mock_pool.__enter__.return_value = mock_pool
+    mock_pool.submit.side_effect = range(4)
+    mock_pool.get_result.side_effect = [(1, True, None), (0, False, ValueError())]
+    with pytest.raises(RuntimeError):
+        main("https://queue/url", 2, 20, 30, 1024, 1)
+    assert [
+        call(WaitTimeSeconds=20, MaxNumberOfMessages=3),
+        call(WaitTimeSeconds=0, MaxNumberOfMessages=1),
+        call(WaitTimeSeconds=0, MaxNumberOfMessages=1),
+        call(WaitTimeSeconds=0, MaxNumberOfMessages=1),
+    ] == mock_queue.receive_messages.call_args_list
+    assert 4 == mock_pool.submit.call_count
+    assert [call(timeout=None), call(timeout=None)] == (
+        mock_pool.get_result.call_args_list
+    )
+    mock_error_handler.assert_called_once_with(
+        messages[0], messages[0].body, "Unable to process message: "
+    )
 
 
-@patch("backend.ecs_tasks.delete_files.main.Pool", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.reset_visibility")
+@patch("backend.ecs_tasks.delete_files.main.VisibilityHeartbeat")
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool")
+@patch("backend.ecs_tasks.delete_files.main.get_queue")
+def test_it_resets_visibility_of_failed_messages_once_discarded(
+    mock_queue, mock_pool, mock_heartbeat, mock_reset
+):
+    mock_queue.return_value = mock_queue
+    messages = [MagicMock(name=str(i)) for i in range(2)]
+    mock_queue.receive_messages.side_effect = [
+        messages,
+        [],
+        RuntimeError("Break loop"),
+    ]
+    mock_pool.return_value = mock_pool
+    mock_pool.__enter__.return_value = mock_pool
+    mock_pool.submit.side_effect = range(2)
+    mock_pool.get_result.side_effect = [(0, True, True), (1, True, False)]
+    heartbeat = mock_heartbeat.return_value.__enter__.return_value
+    # Remove the messages from the in flight dict like the heartbeat does
+    heartbeat.discard.side_effect = lambda task_id: (
+        mock_heartbeat.call_args[0][2].pop(task_id)
+    )
+    mock_reset.side_effect = lambda msg: heartbeat.discard.assert_called_with(1)
+    with pytest.raises(RuntimeError):
+        main("https://queue/url", 2, 20, 30, 1024, 0)
+    assert [call(0), call(1)] == heartbeat.discard.call_args_list
+    mock_reset.assert_called_once_with(messages[1])
+
+
+@patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool")
+@patch("backend.ecs_tasks.delete_files.main.get_queue")
+def test_it_polls_queue_periodically_whilst_workers_are_idle(mock_queue, mock_pool):
+    mock_queue.return_value = mock_queue
+    mock_queue.receive_messages.side_effect = [[MagicMock()], [], []]
+    mock_pool.return_value = mock_pool
+    mock_pool.__enter__.return_value = mock_pool
+    mock_pool.get_result.side_effect = [None, RuntimeError("Break loop")]
+    with pytest.raises(RuntimeError):
+        main("https://queue/url", 2, 20, 30, 1024, 0)
+    assert [call(timeout=30), call(timeout=30)] == (mock_pool.get_result.call_args_list)
+    assert 3 == mock_queue.receive_messages.call_count
+
+
+@patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.VisibilityHeartbeat")
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool")
+@patch("backend.ecs_tasks.delete_files.main.get_queue")
+def test_it_extends_visibility_of_in_flight_messages(
+    mock_queue, mock_pool, mock_heartbeat
+):
+    mock_queue.return_value = mock_queue
+    mock_message = MagicMock()
+    mock_queue.receive_messages.return_value = [mock_message]
+    mock_pool.return_value = mock_pool
+    mock_pool.__enter__.return_value = mock_pool
+    mock_pool.submit.return_value = 0
+    mock_pool.get_result.side_effect = RuntimeError("Break loop")
+    with pytest.raises(RuntimeError):
+        main("https://queue/url", 1, 1, 1, 1024, 0, 600, 60)
+    mock_heartbeat.assert_called_with(
+        mock_queue.meta.client, "https://queue/url", {0: mock_message}, 600, 60
+    )
+    mock_heartbeat.return_value.__exit__.assert_called()
+
+
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.signal", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.get_queue")
 @patch("backend.ecs_tasks.delete_files.main.time")
@@ -807,7 +997,7 @@ def test_it_sleeps_where_no_messages(mock_time, mock_queue):
     mock_time.sleep.assert_called_with(1)
 
 
-@patch("backend.ecs_tasks.delete_files.main.Pool", MagicMock())
+@patch("backend.ecs_tasks.delete_files.main.WorkerPool", MagicMock())
 @patch("backend.ecs_tasks.delete_files.main.signal")
 @patch("backend.ecs_tasks.delete_files.main.get_queue")
 def test_it_sets_kill_handlers(mock_queue, mock_signal):
@@ -826,7 +1016,35 @@ def test_it_deletes_from_json_file(mock_parquet, mock_json):
     f = MagicMock()
     cols = MagicMock()
     delete_matches_from_file(f, cols, "json", False)
-    mock_json.assert_called_with(f, cols, False)
+    mock_json.assert_called_with(
+        f, cols, False, None, engine=None, compression_level=None
+    )
+    mock_parquet.assert_not_called()
+
+
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_json_file")
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_parquet_file")
+def test_it_passes_format_options_to_json_handler(mock_parquet, mock_json):
+    f = MagicMock()
+    cols = MagicMock()
+    delete_matches_from_file(
+        f, cols, "json", format_options={"JsonEngine": "arrow", "CompressionLevel": 1}
+    )
+    mock_json.assert_called_with(
+        f, cols, False, None, engine="arrow", compression_level=1
+    )
+
+
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_csv_file")
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_parquet_file")
+def test_it_deletes_from_csv_file(mock_parquet, mock_csv):
+    f = MagicMock()
+    cols = MagicMock()
+    format_options = {"ColumnNames": ["customer_id"], "CompressionLevel": 1}
+    delete_matches_from_file(f, cols, "csv", "gzip", format_options=format_options)
+    mock_csv.assert_called_with(
+        f, cols, "gzip", None, format_options=format_options, compression_level=1,
+    )
     mock_parquet.assert_not_called()
 
 
@@ -836,5 +1054,87 @@ def test_it_deletes_from_parquet_file(mock_parquet, mock_json):
     f = MagicMock()
     cols = MagicMock()
     delete_matches_from_file(f, cols, "parquet")
-    mock_parquet.assert_called_with(f, cols)
+    mock_parquet.assert_called_with(
+        f, cols, out_stream=None, compression=None, compression_level=None
+    )
     mock_json.assert_not_called()
+
+
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_json_file")
+@patch("backend.ecs_tasks.delete_files.main.delete_matches_from_parquet_file")
+def test_it_passes_format_options_to_parquet_writer(mock_parquet, mock_json):
+    f = MagicMock()
+    cols = MagicMock()
+    delete_matches_from_file(f, cols, "parquet", format_options={"Compression": "zstd"})
+    mock_parquet.assert_called_with(
+        f, cols, out_stream=None, compression="zstd", compression_level=None
+    )
+
+
+def test_it_accepts_messages_with_offloaded_columns(message_stub):
+    message = json.loads(message_stub(ColumnsHash="abc"))
+    del message["Columns"]
+    validate_message(json.dumps(message))
+
+
+def test_it_rejects_messages_without_columns(message_stub):
+    message = json.loads(message_stub())
+    del message["Columns"]
+    with pytest.raises(ValueError):
+        validate_message(json.dumps(message))
+
+
+def test_it_returns_message_columns(message_stub):
+    body = json.loads(message_stub())
+    assert body["Columns"] == get_columns(body)
+
+
+@patch("backend.ecs_tasks.delete_files.main.load_match_plan")
+def test_it_returns_offloaded_columns(mock_load, message_stub):
+    body = json.loads(message_stub(ColumnsHash="abc"))
+    assert mock_load.return_value == get_columns(body)
+    mock_load.assert_called_with("1234", "abc")
+
+
+@patch.dict(os.environ, {"MatchPlanBucket": "plans"})
+@patch("backend.ecs_tasks.delete_files.main.boto3")
+@patch("backend.ecs_tasks.delete_files.main.download_match_plan")
+def test_it_downloads_and_compiles_match_plans_once(mock_download, mock_boto, tmp_path):
+    plan_hash = "b" * 64
+    columns = [{"Column": "customer_id", "MatchIds": ["12345"], "Type": "Simple"}]
+
+    def download(client, bucket, job_id, plan_hash, path):
+        with open(path, "w") as f:
+            json.dump(columns, f)
+
+    mock_download.side_effect = download
+    load_match_plan.cache_clear()
+    with patch(
+        "backend.ecs_tasks.delete_files.main.get_plan_path",
+        MagicMock(return_value=str(tmp_path / "plan.json")),
+    ), patch(
+        "backend.ecs_tasks.delete_files.main.read_cached_columns",
+        lambda plan_hash: json.loads((tmp_path / "plan.json").read_text()),
+    ):
+        plan = load_match_plan("1234", plan_hash)
+        assert plan is load_match_plan("1234", plan_hash)
+        load_match_plan.cache_clear()
+        assert plan is not load_match_plan("1234", plan_hash)
+    mock_download.assert_called_once_with(
+        mock_boto.client.return_value, "plans", "1234", plan_hash, ANY
+    )
+    assert [["12345"]] == plan.columns[0].values
+
+
+@patch("backend.ecs_tasks.delete_files.main.time")
+@patch("backend.ecs_tasks.delete_files.main.get_session")
+def test_it_reuses_sessions_for_a_while(mock_session, mock_time):
+    mock_session.side_effect = lambda role_arn: MagicMock()
+    mock_time.time.return_value = 1000
+    session, client = get_session_and_client("arn:aws:iam::123:role/a")
+    assert (session, client) == get_session_and_client("arn:aws:iam::123:role/a")
+    assert session.client.call_count == 1
+    assert session != get_session_and_client("arn:aws:iam::123:role/b")[0]
+    mock_time.time.return_value = 1000 + 3600
+    assert session != get_session_and_client("arn:aws:iam::123:role/a")[0]
+    assert 3 == mock_session.call_count
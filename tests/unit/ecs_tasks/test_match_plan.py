@@ -0,0 +1,130 @@
+import json
+
+import pyarrow as pa
+import pytest
+from mock import patch
+
+from backend.ecs_tasks.delete_files.match_plan import (
+    MatchPlan,
+    get_match_plan,
+    get_plan_path,
+    read_cached_columns,
+)
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+TO_DELETE = [
+    {"Column": "customerId", "MatchIds": ["12345", 23456, "12345"], "Type": "Simple"},
+    {
+        "Columns": ["user.FirstName", "user.LastName"],
+        "MatchIds": [["John", "Doe"], ["Jane", "Doe"]],
+        "Type": "Composite",
+    },
+]
+
+
+def test_it_compiles_columns():
+    # Act
+    simple, composite = MatchPlan(TO_DELETE)
+    # Assert
+    assert simple.simple
+    assert [("customerid",)] == simple.paths
+    assert [["12345", 23456]] == simple.values
+    assert not composite.simple
+    assert [("user", "firstname"), ("user", "lastname")] == composite.paths
+    assert [("John", "Doe"), ("Jane", "Doe")] == composite.match_ids
+    assert [["John", "Jane"], ["Doe"]] == composite.values
+
+
+def test_it_returns_identifiers_once():
+    # Arrange
+    plan = MatchPlan(TO_DELETE + [TO_DELETE[0]])
+    # Act / Assert
+    assert ["customerId", "user.FirstName", "user.LastName"] == plan.get_identifiers()
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [("12345", True), (23456, True), (23456.0, True), ("23456", False), ({}, False)],
+)
+def test_it_finds_simple_values(value, expected):
+    # Arrange
+    simple, _ = MatchPlan(TO_DELETE)
+    # Act / Assert
+    assert expected == simple.contains(value)
+
+
+@pytest.mark.parametrize(
+    "value,expected",
+    [
+        (["John", "Doe"], True),
+        (["Doe", "John"], False),
+        (["John"], False),
+        (["John", {"a": 1}], False),
+    ],
+)
+def test_it_finds_composite_values(value, expected):
+    # Arrange
+    _, composite = MatchPlan(TO_DELETE)
+    # Act / Assert
+    assert expected == composite.contains(value)
+
+
+def test_it_handles_unhashable_match_ids():
+    # Arrange
+    column = {"Column": "a", "MatchIds": [[1, 2], [1, 2], 3], "Type": "Simple"}
+    (simple,) = MatchPlan([column])
+    # Act / Assert
+    assert [[[1, 2], 3]] == simple.values
+    assert simple.contains([1, 2])
+    assert simple.contains(3)
+    assert not simple.contains([2, 1])
+
+
+def test_it_converts_values_once_per_type():
+    # Arrange
+    calls = []
+
+    def convert(values, arrow_type):
+        calls.append(arrow_type)
+        return pa.array(values, arrow_type)
+
+    _, composite = MatchPlan(TO_DELETE)
+    # Act
+    first = composite.get_typed_values(0, pa.string(), convert)
+    second = composite.get_typed_values(0, pa.string(), convert)
+    composite.get_typed_values(0, pa.large_string(), convert)
+    # Assert
+    assert first is second
+    assert ["John", "Jane"] == first.to_pylist()
+    assert [pa.string(), pa.large_string()] == calls
+
+
+def test_it_doesnt_compile_plans_again():
+    # Arrange
+    plan = MatchPlan(TO_DELETE)
+    # Act / Assert
+    assert plan is get_match_plan(plan)
+    assert isinstance(get_match_plan(TO_DELETE), MatchPlan)
+
+
+@pytest.mark.parametrize("plan_hash", ["../../etc/passwd", "ABC", None, "a" * 63])
+def test_it_rejects_invalid_plan_hashes(plan_hash):
+    with pytest.raises(ValueError):
+        get_plan_path(plan_hash)
+
+
+def test_it_reads_cached_columns(tmp_path):
+    # Arrange
+    plan_hash = "a" * 64
+    with patch(
+        "backend.ecs_tasks.delete_files.match_plan.PLAN_CACHE_DIR", str(tmp_path)
+    ):
+        # Act
+        missing = read_cached_columns(plan_hash)
+        with open(get_plan_path(plan_hash), "w") as f:
+            json.dump(TO_DELETE, f)
+        cached = read_cached_columns(plan_hash)
+    # Assert
+    assert missing is None
+    assert TO_DELETE == cached
@@ -1,5 +1,5 @@
 from io import BytesIO
-from mock import patch
+from mock import patch, call, MagicMock
 
 import pyarrow as pa
 import pyarrow.json as pj
@@ -7,6 +7,7 @@ import pyarrow.parquet as pq
 import pytest
 import pandas as pd
 import tempfile
+from backend.ecs_tasks.delete_files import parquet_handler
 from backend.ecs_tasks.delete_files.parquet_handler import (
     delete_matches_from_parquet_file,
     delete_from_table,
@@ -17,7 +18,7 @@ pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
 
 
 @patch("backend.ecs_tasks.delete_files.parquet_handler.load_parquet")
-@patch("backend.ecs_tasks.delete_files.parquet_handler.delete_from_table")
+@patch("backend.ecs_tasks.delete_files.parquet_handler.get_rows_to_delete")
 def test_it_generates_new_parquet_file_without_matches(mock_delete, mock_load_parquet):
     # Arrange
     column = {
@@ -31,13 +32,12 @@ def test_it_generates_new_parquet_file_without_matches(mock_delete, mock_load_pa
     df.to_parquet(buf)
     br = pa.BufferReader(buf.getvalue())
     f = pq.ParquetFile(br, memory_map=False)
-    mock_df = pd.DataFrame([{"customer_id": "12345"}])
-    mock_delete.return_value = [pa.Table.from_pandas(mock_df), 1]
+    mock_delete.return_value = pa.array([True, False])
     mock_load_parquet.return_value = f
     # Act
-    out, stats = delete_matches_from_parquet_file("input_file.parquet", column)
+    out, stats = delete_matches_from_parquet_file(br, [column])
     assert isinstance(out, pa.BufferOutputStream)
-    assert {"ProcessedRows": 2, "DeletedRows": 1} == stats
+    assert {"ProcessedRows": 2, "DeletedRows": 1, "PrunedRowGroups": 0} == stats
     res = pa.BufferReader(out.getvalue())
     newf = pq.ParquetFile(res, memory_map=False)
     assert 1 == newf.read().num_rows
@@ -64,15 +64,304 @@ def test_it_handles_files_with_multiple_row_groups_and_pandas_indexes(
     f = pq.ParquetFile(br, memory_map=False)
     mock_load_parquet.return_value = f
     # Act
-    out, stats = delete_matches_from_parquet_file("input_file.parquet", columns)
+    out, stats = delete_matches_from_parquet_file(br, columns)
     # Assert
-    assert {"ProcessedRows": 6, "DeletedRows": 3} == stats
+    assert {"ProcessedRows": 6, "DeletedRows": 3, "PrunedRowGroups": 0} == stats
     res = pa.BufferReader(out.getvalue())
     newf = pq.ParquetFile(res, memory_map=False)
     assert 3 == newf.num_row_groups
     assert 3 == newf.read().num_rows
 
 
+@patch("backend.ecs_tasks.delete_files.parquet_handler.load_parquet")
+@patch("backend.ecs_tasks.delete_files.parquet_handler.get_rows_to_delete")
+def test_it_prunes_row_groups_using_statistics(mock_delete, mock_load_parquet):
+    # Arrange
+    columns = [
+        {"Column": "customer_id", "MatchIds": [12345], "Type": "Simple"},
+        {
+            "Columns": ["first_name", "last_name"],
+            "MatchIds": [["john", "doe"]],
+            "Type": "Composite",
+        },
+    ]
+    tables = [
+        pa.Table.from_pydict(
+            {"customer_id": ids, "first_name": first, "last_name": last}
+        )
+        for ids, first, last in [
+            ([12345, 12346], ["mary", "ann"], ["hey", "hey"]),
+            ([23456, 23457], ["john", "jane"], ["hey", "hey"]),
+            ([34567, 34568], ["john", "mary"], ["doe", "hey"]),
+        ]
+    ]
+    buf = BytesIO()
+    with pq.ParquetWriter(buf, tables[0].schema, use_dictionary=False) as writer:
+        for table in tables:
+            writer.write_table(table)
+    br = pa.BufferReader(buf.getvalue())
+    f = pq.ParquetFile(br, memory_map=False)
+    mock_load_parquet.return_value = f
+    mock_delete.side_effect = lambda table, _: pa.array([True, False])
+    # Act
+    out, stats = delete_matches_from_parquet_file(br, columns)
+    # Assert
+    assert {"ProcessedRows": 6, "DeletedRows": 2, "PrunedRowGroups": 1} == stats
+    assert 2 == mock_delete.call_count
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert [12346, 23456, 23457, 34568] == newf.read().column(0).to_pylist()
+
+
+@patch("backend.ecs_tasks.delete_files.parquet_handler.load_parquet")
+def test_it_evaluates_matches_reading_only_identifier_columns(mock_load_parquet,):
+    # Arrange
+    columns = [{"Column": "user.id", "MatchIds": ["12345"], "Type": "Simple"}]
+    table = pa.Table.from_pydict(
+        {
+            "user": [{"id": "12345", "name": "a"}, {"id": "23456", "name": "b"}],
+            "payload": ["x", "y"],
+        }
+    )
+    buf = BytesIO()
+    with pq.ParquetWriter(buf, table.schema, write_statistics=False) as writer:
+        writer.write_table(table.slice(0, 1))
+        writer.write_table(table.slice(1, 1))
+    br = pa.BufferReader(buf.getvalue())
+    f = pq.ParquetFile(br, memory_map=False)
+    mock_load_parquet.return_value = f
+    read_row_group = f.read_row_group
+    f.read_row_group = MagicMock(side_effect=read_row_group)
+    # Act
+    out, stats = delete_matches_from_parquet_file(br, columns)
+    # Assert
+    assert {"ProcessedRows": 2, "DeletedRows": 1, "PrunedRowGroups": 0} == stats
+    assert [
+        call(0, columns=["user.id"]),
+        call(0),
+        call(1, columns=["user.id"]),
+    ] == f.read_row_group.call_args_list
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert {"user": [{"id": "23456", "name": "b"}], "payload": ["y"]} == (
+        newf.read().to_pydict()
+    )
+
+
+def test_it_prunes_row_groups_using_dictionaries():
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b"], "Type": "Simple"}]
+    table = pa.Table.from_pydict({"customer_id": ["a", "c", "c"]})
+    buf = BytesIO()
+    with pq.ParquetWriter(buf, table.schema, write_statistics=False) as writer:
+        writer.write_table(table)
+        writer.write_table(pa.Table.from_pydict({"customer_id": ["a", "b"]}))
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns
+    )
+    # Assert
+    assert {"ProcessedRows": 5, "DeletedRows": 1, "PrunedRowGroups": 1} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert ["a", "c", "c", "a"] == newf.read().column(0).to_pylist()
+
+
+@pytest.mark.parametrize("raw_passthrough", [True, False])
+def test_it_rewrites_only_row_groups_with_matches(raw_passthrough):
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b"], "Type": "Simple"}]
+    table = pa.Table.from_pydict({"customer_id": ["a", "b", "c"], "n": [1, 2, 3]})
+    buf = BytesIO()
+    with pq.ParquetWriter(buf, table.schema, compression="gzip") as writer:
+        writer.write_table(table.slice(0, 1))
+        writer.write_table(table.slice(1, 2))
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns, raw_passthrough
+    )
+    # Assert
+    assert {"ProcessedRows": 3, "DeletedRows": 1, "PrunedRowGroups": 1} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert {"customer_id": ["a", "c"], "n": [1, 3]} == newf.read().to_pydict()
+    assert "GZIP" == newf.metadata.row_group(0).column(0).compression
+    assert "GZIP" == newf.metadata.row_group(1).column(0).compression
+
+
+@pytest.mark.parametrize("raw_passthrough", [True, False])
+def test_it_mirrors_source_writer_settings(raw_passthrough):
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": [3], "Type": "Simple"}]
+    table = pa.Table.from_pydict(
+        {"customer_id": list(range(10)), "name": [str(i) for i in range(10)]}
+    )
+    buf = BytesIO()
+    pq.write_table(
+        table,
+        buf,
+        row_group_size=5,
+        compression={"customer_id": "zstd", "name": "brotli"},
+        use_dictionary=["name"],
+        write_statistics=["customer_id"],
+    )
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns, raw_passthrough
+    )
+    # Assert
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert [4, 5] == [
+        newf.metadata.row_group(i).num_rows for i in range(newf.num_row_groups)
+    ]
+    rewritten = newf.metadata.row_group(0)
+    assert "ZSTD" == rewritten.column(0).compression
+    assert "BROTLI" == rewritten.column(1).compression
+    assert not rewritten.column(0).has_dictionary_page
+    assert rewritten.column(1).has_dictionary_page
+    assert rewritten.column(0).is_stats_set
+    assert not rewritten.column(1).is_stats_set
+
+
+def test_it_overrides_source_codec():
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b"], "Type": "Simple"}]
+    table = pa.Table.from_pydict({"customer_id": ["a", "b", "c"]})
+    buf = BytesIO()
+    pq.write_table(table, buf, compression="gzip")
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()),
+        columns,
+        compression="zstd",
+        compression_level=9,
+    )
+    # Assert
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert "ZSTD" == newf.metadata.row_group(0).column(0).compression
+    assert ["a", "c"] == newf.read().column(0).to_pylist()
+
+
+@pytest.mark.parametrize("compression", [None, "snappy", "none"])
+def test_it_ignores_compression_level_for_codecs_without_levels(compression):
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b"], "Type": "Simple"}]
+    table = pa.Table.from_pydict({"customer_id": ["a", "b", "c"]})
+    buf = BytesIO()
+    pq.write_table(table, buf, compression="snappy")
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()),
+        columns,
+        compression=compression,
+        compression_level=3,
+    )
+    # Assert
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert ["a", "c"] == newf.read().column(0).to_pylist()
+
+
+def test_it_processes_python_file_objects_with_multiple_row_groups():
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": [5, 150], "Type": "Simple"}]
+    table = pa.Table.from_pydict(
+        {"customer_id": list(range(200)), "name": [str(i) for i in range(200)]}
+    )
+    buf = BytesIO()
+    pq.write_table(table, buf, row_group_size=10)
+    buf.seek(0)
+    # Act
+    out, stats = delete_matches_from_parquet_file(buf, columns, queue_depth=1)
+    # Assert
+    assert {"ProcessedRows": 200, "DeletedRows": 2, "PrunedRowGroups": 18} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert 20 == newf.num_row_groups
+    expected = [i for i in range(200) if i not in [5, 150]]
+    assert expected == newf.read().column("customer_id").to_pylist()
+
+
+@pytest.mark.parametrize("parallel_threshold", [0, 2 ** 40])
+def test_it_processes_large_files_in_parallel(parallel_threshold):
+    # Arrange
+    columns = [
+        {"Column": "customer_id", "MatchIds": [5, 150], "Type": "Simple"},
+        {"Column": "name", "MatchIds": ["11", "12"], "Type": "Simple"},
+    ]
+    table = pa.Table.from_pydict(
+        {"customer_id": list(range(200)), "name": [str(i) for i in range(200)]}
+    )
+    buf = BytesIO()
+    pq.write_table(table, buf, row_group_size=10, compression="zstd")
+    source = pa.BufferReader(buf.getvalue())
+    # Act
+    with patch(
+        "backend.ecs_tasks.delete_files.parquet_handler.rewrite_row_group",
+        wraps=parquet_handler.rewrite_row_group,
+    ) as mock_rewrite:
+        out, stats = delete_matches_from_parquet_file(
+            source, columns, parallel_threshold=parallel_threshold, workers=4
+        )
+    # Assert
+    assert (20 if parallel_threshold == 0 else 0) == mock_rewrite.call_count
+    assert {"ProcessedRows": 200, "DeletedRows": 4, "PrunedRowGroups": 17} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert 20 == newf.num_row_groups
+    expected = [i for i in range(200) if i not in [5, 11, 12, 150]]
+    assert expected == newf.read().column("customer_id").to_pylist()
+    assert "ZSTD" == newf.metadata.row_group(0).column(0).compression
+
+
+def test_it_reads_only_pages_which_can_contain_matches():
+    # Arrange
+    columns = [
+        {"Column": "customer_id", "MatchIds": [125, 130], "Type": "Simple"},
+        {"Column": "name", "MatchIds": ["n399"], "Type": "Simple"},
+        {
+            "Columns": ["customer_id", "name"],
+            "MatchIds": [[3, "n3"]],
+            "Type": "Composite",
+        },
+    ]
+    table = pa.Table.from_pydict(
+        {"customer_id": list(range(400)), "name": ["n%s" % i for i in range(400)]}
+    )
+    buf = BytesIO()
+    pq.write_table(
+        table, buf, write_page_index=True, data_page_size=100, write_batch_size=50,
+    )
+    # Act
+    with patch.object(
+        parquet_handler.PageReader,
+        "read_pages",
+        autospec=True,
+        side_effect=parquet_handler.PageReader.read_pages,
+    ) as mock_read_pages:
+        out, stats = delete_matches_from_parquet_file(
+            pa.BufferReader(buf.getvalue()), columns
+        )
+    # Assert
+    assert {"ProcessedRows": 400, "DeletedRows": 4, "PrunedRowGroups": 0} == stats
+    # "n399" is within the string ranges of the first and the last pages
+    assert [1, 2] == [len(c[0][3]) for c in mock_read_pages.call_args_list]
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    expected = [i for i in range(400) if i not in [3, 125, 130, 399]]
+    assert expected == newf.read().column("customer_id").to_pylist()
+
+
+def test_it_falls_back_to_encoding_for_unsupported_schemas():
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b"], "Type": "Simple"}]
+    table = pa.Table.from_pydict(
+        {"customer_id": ["a", "b"], "ts": pa.array([1, 2], type=pa.timestamp("ns")),}
+    )
+    buf = BytesIO()
+    pq.write_table(table, buf, use_deprecated_int96_timestamps=True)
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns
+    )
+    # Assert
+    assert {"ProcessedRows": 2, "DeletedRows": 1, "PrunedRowGroups": 0} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert ["a"] == newf.read().column("customer_id").to_pylist()
+
+
 def test_delete_correct_rows_from_table():
     data = [
         {"customer_id": "12345"},
@@ -222,6 +511,34 @@ def test_delete_correct_rows_from_parquet_table_with_composite_types_multiple_ty
     assert res["customer_id"].values[1] == 34567
 
 
+def test_delete_correct_rows_from_parquet_table_with_composite_keys_overflowing():
+    # 60000 ** 4 keys don't fit in int64
+    count = 60000
+    data = {
+        "a": [0, 1, count - 1, 2],
+        "b": [0, 1, count - 1, 3],
+        "c": [0, 1, count - 1, 2],
+        "d": [0, 1, count - 1, 2],
+    }
+    columns = [
+        {
+            "Columns": ["a", "b", "c", "d"],
+            "MatchIds": [[i, i, i, i] for i in range(count)],
+            "Type": "Composite",
+        }
+    ]
+    table = pa.Table.from_pandas(pd.DataFrame(data))
+    with patch(
+        "backend.ecs_tasks.delete_files.parquet_handler.get_rows_with_positions",
+        wraps=parquet_handler.get_rows_with_positions,
+    ) as mock_get_rows:
+        table, deleted_rows = delete_from_table(table, columns)
+    assert mock_get_rows.called
+    res = table.to_pandas()
+    assert deleted_rows == 3
+    assert res["b"].tolist() == [3]
+
+
 def test_delete_correct_rows_from_parquet_table_with_complex_composite_types():
     data = {
         "customer_id": [12345, 23456, 34567],
@@ -270,6 +587,129 @@ def test_delete_correct_rows_from_parquet_table_with_both_simple_and_composite_t
     assert res["customer_id"].values[0] == 34567
 
 
+def test_it_does_not_match_values_of_different_types():
+    data = {
+        "customer_id": [12345, 23456, 34567],
+        "age": [12.0, 12.5, 13.0],
+    }
+    columns = [
+        {"Column": "customer_id", "MatchIds": ["12345", 23456], "Type": "Simple"},
+        {"Column": "age", "MatchIds": [12, "13.0"], "Type": "Simple"},
+    ]
+    df = pd.DataFrame(data)
+    table = pa.Table.from_pandas(df)
+    table, deleted_rows = delete_from_table(table, columns)
+    assert deleted_rows == 2
+    assert table.to_pydict()["customer_id"] == [34567]
+
+
+def test_it_handles_null_values_in_nested_columns():
+    data = {
+        "customer_id": [12345, 23456, 34567, 45678],
+        "user_info": [
+            {"name": "matteo", "email": None},
+            None,
+            {"name": None, "email": "34567@test.com"},
+            {"name": "chris", "email": "45678@test.com"},
+        ],
+    }
+    columns = [
+        {"Column": "user_info.name", "MatchIds": ["matteo"], "Type": "Simple"},
+        {
+            "Columns": ["user_info.name", "user_info.email"],
+            "MatchIds": [["chris", "45678@test.com"], ["nick", "34567@test.com"]],
+            "Type": "Composite",
+        },
+    ]
+    table = pa.Table.from_pydict(data)
+    table, deleted_rows = delete_from_table(table, columns)
+    assert deleted_rows == 2
+    assert table.to_pydict()["customer_id"] == [23456, 34567]
+
+
+def test_it_handles_dictionary_encoded_columns():
+    data = {
+        "customer_id": ["12345", "23456", "34567"],
+        "country": ["uk", "it", "uk"],
+    }
+    columns = [
+        {"Column": "customer_id", "MatchIds": ["12345"], "Type": "Simple"},
+        {"Columns": ["country"], "MatchIds": [["it"]], "Type": "Composite"},
+    ]
+    df = pd.DataFrame(data).astype("category")
+    table = pa.Table.from_pandas(df)
+    table, deleted_rows = delete_from_table(table, columns)
+    assert deleted_rows == 2
+    assert table.to_pydict()["customer_id"] == ["34567"]
+
+
+def test_it_handles_null_indices_in_dictionary_encoded_columns():
+    ids = pa.array(["a", None, "b", "a"]).dictionary_encode()
+    table = pa.Table.from_arrays([ids, pa.array([1, 2, 3, 4])], ["customer_id", "n"])
+    columns = [
+        {"Column": "customer_id", "MatchIds": ["a"], "Type": "Simple"},
+        {"Columns": ["customer_id", "n"], "MatchIds": [["b", 3]], "Type": "Composite"},
+    ]
+    table, deleted_rows = delete_from_table(table, columns)
+    assert deleted_rows == 3
+    assert table.to_pydict()["n"] == [2]
+
+
+def test_it_matches_dictionary_encoded_columns_in_parquet_files():
+    # Arrange
+    columns = [{"Column": "customer_id", "MatchIds": ["b", "d"], "Type": "Simple"}]
+    table = pa.Table.from_pydict(
+        {"customer_id": ["a", "b", "c", "b"] * 10, "n": list(range(40))}
+    )
+    buf = BytesIO()
+    pq.write_table(table, buf, write_statistics=False)
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns
+    )
+    # Assert
+    assert {"ProcessedRows": 40, "DeletedRows": 20, "PrunedRowGroups": 0} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert ["a", "c"] * 10 == newf.read().column("customer_id").to_pylist()
+    assert pa.string() == newf.schema_arrow.field("customer_id").type
+
+
+@pytest.mark.parametrize(
+    "columns",
+    [
+        [
+            {"Column": "customer_id", "MatchIds": ["bb"], "Type": "Simple"},
+            {"Column": "user.email", "MatchIds": ["c@x"], "Type": "Simple"},
+        ],
+        [
+            {
+                "Columns": ["customer_id", "user.email"],
+                "MatchIds": [["c", "c@x"]],
+                "Type": "Composite",
+            },
+        ],
+    ],
+)
+def test_it_matches_dictionary_encoded_and_nested_columns_in_parquet_files(columns):
+    # Arrange
+    table = pa.Table.from_pydict(
+        {
+            "customer_id": ["a", "b", "c", "b"] * 10,
+            "user": [{"email": "{}@x".format(c)} for c in "abcb"] * 10,
+        }
+    )
+    buf = BytesIO()
+    pq.write_table(table, buf)
+    # Act
+    out, stats = delete_matches_from_parquet_file(
+        pa.BufferReader(buf.getvalue()), columns
+    )
+    # Assert
+    assert {"ProcessedRows": 40, "DeletedRows": 10, "PrunedRowGroups": 0} == stats
+    newf = pq.ParquetFile(pa.BufferReader(out.getvalue()), memory_map=False)
+    assert ["a", "b", "b"] * 10 == newf.read().column("customer_id").to_pylist()
+
+
 def test_it_loads_parquet_files():
     data = [{"customer_id": "12345"}, {"customer_id": "23456"}]
     df = pd.DataFrame(data)
@@ -0,0 +1,133 @@
+import struct
+from io import BytesIO
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from backend.ecs_tasks.delete_files.parquet_raw import (
+    PageReader,
+    RawParquetWriter,
+    UnsupportedParquetFileError,
+    read_file_metadata,
+    serialize_file_metadata,
+)
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+
+def make_parquet(tables, **kwargs):
+    buf = BytesIO()
+    with pq.ParquetWriter(buf, tables[0].schema, **kwargs) as writer:
+        for table in tables:
+            writer.write_table(table)
+    return buf.getvalue()
+
+
+def get_table(ids):
+    return pa.Table.from_pydict(
+        {
+            "customer_id": ids,
+            "user": [{"name": str(i), "age": i % 100} for i in ids],
+            "tags": [[str(i)] for i in ids],
+        }
+    )
+
+
+def test_it_serializes_footer_identically():
+    data = make_parquet([get_table([1, 2, 3])], write_page_index=True)
+    footer_length = struct.unpack("<I", data[-8:-4])[0]
+    file_metadata = read_file_metadata(pa.BufferReader(data))
+    assert data[-8 - footer_length : -8] == serialize_file_metadata(file_metadata)
+
+
+def test_it_copies_row_groups_verbatim():
+    tables = [get_table([1, 2]), get_table([3, 4]), get_table([5, 6])]
+    source = pa.BufferReader(
+        make_parquet(tables, compression="gzip", write_page_index=True)
+    )
+    source_file = pq.ParquetFile(source)
+    schema = source_file.schema_arrow
+    out = pa.BufferOutputStream()
+    with RawParquetWriter(out, source, schema) as writer:
+        writer.copy_row_group(0)
+        writer.write_table(get_table([4]))
+        writer.copy_row_group(2)
+    result = pq.ParquetFile(pa.BufferReader(out.getvalue()))
+    assert 3 == result.num_row_groups
+    assert 5 == result.metadata.num_rows
+    assert [1, 2, 4, 5, 6] == result.read().column("customer_id").to_pylist()
+    assert result.read().to_pylist()[1] == get_table([2]).to_pylist()[0]
+    assert "GZIP" == result.metadata.row_group(0).column(0).compression
+    assert "SNAPPY" == result.metadata.row_group(1).column(0).compression
+
+
+def test_it_skips_empty_tables():
+    source = pa.BufferReader(make_parquet([get_table([1, 2])]))
+    schema = pq.ParquetFile(source).schema_arrow
+    out = pa.BufferOutputStream()
+    with RawParquetWriter(out, source, schema) as writer:
+        writer.write_table(get_table([1]).slice(0, 0))
+    result = pq.ParquetFile(pa.BufferReader(out.getvalue()))
+    assert 0 == result.num_row_groups
+    assert 0 == result.read().num_rows
+
+
+def test_it_rejects_sources_with_different_physical_schema():
+    table = pa.Table.from_pydict(
+        {"ts": pa.array([1, 2], type=pa.timestamp("ns")), "customer_id": [1, 2]}
+    )
+    source = pa.BufferReader(
+        make_parquet([table], use_deprecated_int96_timestamps=True)
+    )
+    schema = pq.ParquetFile(source).schema_arrow
+    with pytest.raises(UnsupportedParquetFileError):
+        RawParquetWriter(pa.BufferOutputStream(), source, schema)
+
+
+def test_it_rejects_invalid_footers():
+    with pytest.raises(UnsupportedParquetFileError):
+        read_file_metadata(pa.BufferReader(b"PAR1" + b"\x00" * 20 + b"PARE"))
+
+
+@pytest.mark.parametrize("use_dictionary", [True, False])
+def test_it_reads_selected_pages(use_dictionary):
+    table = pa.Table.from_pydict(
+        {
+            "customer_id": list(range(400)),
+            "name": [None if i % 3 else str(i).zfill(3) for i in range(400)],
+        }
+    )
+    source = pa.BufferReader(
+        make_parquet(
+            [table],
+            use_dictionary=use_dictionary,
+            write_page_index=True,
+            data_page_size=100,
+            write_batch_size=50,
+        )
+    )
+    reader = PageReader(source)
+    pages = reader.get_pages(0, "customer_id")
+    assert 8 == len(pages)
+    assert (50, 50, 50, 99) == (
+        pages[1].first_row,
+        pages[1].num_rows,
+        pages[1].min_value,
+        pages[1].max_value,
+    )
+    names = reader.get_pages(0, "name")
+    assert (b"000", b"048") == (names[0].min_value, names[0].max_value)
+    values = reader.read_pages(0, "name", [names[1], names[2], names[7]])
+    assert (
+        table.column("name")[50:150].to_pylist()
+        + table.column("name")[350:].to_pylist()
+        == values.to_pylist()
+    )
+
+
+def test_it_ignores_columns_without_page_index():
+    source = pa.BufferReader(make_parquet([get_table([1, 2])]))
+    reader = PageReader(source)
+    assert reader.get_pages(0, "customer_id") is None
+    assert reader.get_pages(0, "user.name") is None
@@ -1,5 +1,8 @@
 import datetime
+import gzip
+import hashlib
 import json
+import os
 
 from mock import patch, MagicMock, call, ANY
 from io import BytesIO
@@ -17,7 +20,8 @@ from backend.ecs_tasks.delete_files.s3 import (
     validate_bucket_versioning,
     verify_object_versions_integrity,
     delete_old_versions,
-    save,
+    download_match_plan,
+    MultipartUploadStream,
     DeleteOldVersionsError,
     IntegrityCheckFailedError,
     rollback_object_version,
@@ -269,114 +273,143 @@ def test_it_gets_grantees_by_type():
     assert {"id=grantee6"} == get_grantees(acl, "WRITE_ACP")
 
 
+@patch("backend.ecs_tasks.delete_files.s3.get_requester_payment")
+@patch("backend.ecs_tasks.delete_files.s3.get_object_info")
+@patch("backend.ecs_tasks.delete_files.s3.get_object_tags")
+@patch("backend.ecs_tasks.delete_files.s3.get_object_acl")
+def test_it_uploads_small_streams_in_a_single_request(
+    mock_acl, mock_tagging, mock_standard, mock_requester
+):
+    mock_client = MagicMock()
+    mock_requester.return_value = {"RequestPayer": "requester"}, {}
+    mock_standard.return_value = ({"Expires": "123"}, {})
+    mock_tagging.return_value = ({"Tagging": "a=b"}, {})
+    mock_acl.return_value = ({"GrantFullControl": "id=abc"}, {"Grants": []})
+    mock_client.put_object.return_value = {"VersionId": "new_version123"}
+    with MultipartUploadStream(
+        mock_client, "bucket", "key", "abc123", part_size=10
+    ) as stream:
+        stream.write(b"abc")
+        stream.write(b"def")
+        assert 6 == stream.tell()
+    assert "new_version123" == stream.version_id
+    mock_client.create_multipart_upload.assert_not_called()
+    mock_client.put_object.assert_called_with(
+        Bucket="bucket",
+        Key="key",
+        Body=b"abcdef",
+        RequestPayer="requester",
+        Expires="123",
+        Tagging="a=b",
+        GrantFullControl="id=abc",
+    )
+    mock_acl.assert_called_with(mock_client, "bucket", "key", "abc123")
+
+
 @patch("backend.ecs_tasks.delete_files.s3.get_requester_payment")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_info")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_tags")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_acl")
 @patch("backend.ecs_tasks.delete_files.s3.get_grantees")
-def test_it_applies_settings_when_saving(
+def test_it_uploads_large_streams_in_parts(
     mock_grantees, mock_acl, mock_tagging, mock_standard, mock_requester
 ):
-    mock_s3 = MagicMock()
-    mock_s3.S3FileSystem.return_value = mock_s3
     mock_client = MagicMock()
-    mock_requester.return_value = {"RequestPayer": "requester"}, {"Payer": "Requester"}
-    mock_standard.return_value = ({"Expires": "123", "Metadata": {}}, {})
-    mock_tagging.return_value = (
-        {"Tagging": "a=b"},
-        {"TagSet": [{"Key": "a", "Value": "b"}]},
+    mock_requester.return_value = {}, {}
+    mock_standard.return_value = ({"ContentType": "text/plain"}, {})
+    mock_tagging.return_value = ({}, {})
+    mock_acl.return_value = ({"GrantFullControl": "id=abc"}, {})
+    mock_grantees.return_value = {"id=123"}
+    mock_client.create_multipart_upload.return_value = {"UploadId": "upload1"}
+    mock_client.upload_part.side_effect = [{"ETag": "a"}, {"ETag": "b"}]
+    mock_client.complete_multipart_upload.return_value = {"VersionId": "v2"}
+    with MultipartUploadStream(
+        mock_client, "bucket", "key", "abc123", part_size=4
+    ) as stream:
+        stream.write(b"abc")
+        stream.write(b"def")
+        stream.write(b"g")
+    assert "v2" == stream.version_id
+    mock_client.create_multipart_upload.assert_called_with(
+        Bucket="bucket", Key="key", ContentType="text/plain", GrantFullControl="id=abc",
     )
-    mock_acl.return_value = (
-        {"GrantFullControl": "id=abc", "GrantRead": "id=123",},
-        {
-            "Owner": {"ID": "owner_id"},
-            "Grants": [
-                {
-                    "Grantee": {"ID": "abc", "Type": "CanonicalUser"},
-                    "Permission": "FULL_CONTROL",
-                },
-                {
-                    "Grantee": {"ID": "123", "Type": "CanonicalUser"},
-                    "Permission": "READ",
-                },
-            ],
+    assert [
+        call(
+            Bucket="bucket", Key="key", UploadId="upload1", PartNumber=1, Body=b"abcdef"
+        ),
+        call(Bucket="bucket", Key="key", UploadId="upload1", PartNumber=2, Body=b"g"),
+    ] == mock_client.upload_part.call_args_list
+    mock_client.complete_multipart_upload.assert_called_with(
+        Bucket="bucket",
+        Key="key",
+        UploadId="upload1",
+        MultipartUpload={
+            "Parts": [{"ETag": "a", "PartNumber": 1}, {"ETag": "b", "PartNumber": 2}]
         },
     )
-    mock_grantees.return_value = ""
-    buf = BytesIO()
-    mock_file = MagicMock(version_id="abc123")
-    mock_s3.open.return_value = mock_s3
-    mock_s3.__enter__.return_value = mock_file
-    resp = save(mock_s3, mock_client, buf, "bucket", "key", "abc123")
-    mock_file.write.assert_called_with(b"")
-    assert "abc123" == resp
-    mock_client.put_object_acl.assert_not_called()
+    mock_client.put_object_acl.assert_called_with(
+        Bucket="bucket",
+        Key="key",
+        VersionId="v2",
+        GrantFullControl="id=abc",
+        GrantWrite="id=123",
+    )
 
 
 @patch("backend.ecs_tasks.delete_files.s3.get_requester_payment")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_info")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_tags")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_acl")
-@patch("backend.ecs_tasks.delete_files.s3.get_grantees")
-def test_it_passes_through_version(
-    mock_grantees, mock_acl, mock_tagging, mock_standard, mock_requester
+def test_it_aborts_uploads_on_errors(
+    mock_acl, mock_tagging, mock_standard, mock_requester
 ):
-    mock_s3 = MagicMock()
     mock_client = MagicMock()
     mock_requester.return_value = {}, {}
     mock_standard.return_value = ({}, {})
     mock_tagging.return_value = ({}, {})
     mock_acl.return_value = ({}, {})
-    mock_grantees.return_value = ""
-    buf = BytesIO()
-    save(mock_s3, mock_client, buf, "bucket", "key", "abc123")
-    mock_acl.assert_called_with(mock_client, "bucket", "key", "abc123")
-    mock_tagging.assert_called_with(mock_client, "bucket", "key", "abc123")
-    mock_standard.assert_called_with(mock_client, "bucket", "key", "abc123")
+    mock_client.create_multipart_upload.return_value = {"UploadId": "upload1"}
+    with pytest.raises(ValueError):
+        with MultipartUploadStream(
+            mock_client, "bucket", "key", "abc123", part_size=2
+        ) as stream:
+            stream.write(b"abc")
+            raise ValueError("No rows required deletion")
+    mock_client.abort_multipart_upload.assert_called_with(
+        Bucket="bucket", Key="key", UploadId="upload1"
+    )
+    mock_client.complete_multipart_upload.assert_not_called()
+    mock_client.put_object.assert_not_called()
+    assert stream.version_id is None
 
 
 @patch("backend.ecs_tasks.delete_files.s3.get_requester_payment")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_info")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_tags")
 @patch("backend.ecs_tasks.delete_files.s3.get_object_acl")
-@patch("backend.ecs_tasks.delete_files.s3.get_grantees")
-def test_it_restores_write_permissions(
-    mock_grantees, mock_acl, mock_tagging, mock_standard, mock_requester
+def test_it_aborts_uploads_which_fail_to_complete(
+    mock_acl, mock_tagging, mock_standard, mock_requester
 ):
-    mock_s3 = MagicMock()
-    mock_s3.S3FileSystem.return_value = mock_s3
     mock_client = MagicMock()
     mock_requester.return_value = {}, {}
     mock_standard.return_value = ({}, {})
     mock_tagging.return_value = ({}, {})
-    mock_acl.return_value = (
-        {"GrantFullControl": "id=abc",},
-        {
-            "Owner": {"ID": "owner_id"},
-            "Grants": [
-                {
-                    "Grantee": {"ID": "abc", "Type": "CanonicalUser"},
-                    "Permission": "FULL_CONTROL",
-                },
-                {
-                    "Grantee": {"ID": "123", "Type": "CanonicalUser"},
-                    "Permission": "WRITE",
-                },
-            ],
-        },
+    mock_acl.return_value = ({}, {})
+    mock_client.create_multipart_upload.return_value = {"UploadId": "upload1"}
+    mock_client.upload_part.return_value = {"ETag": "a"}
+    mock_client.complete_multipart_upload.side_effect = ClientError(
+        {"Error": {"Code": "InternalError"}}, "CompleteMultipartUpload"
     )
-    mock_grantees.return_value = {"id=123"}
-    buf = BytesIO()
-    mock_s3.open.return_value = mock_s3
-    mock_s3.__enter__.return_value = MagicMock(version_id="new_version123")
-    save(mock_s3, mock_client, buf, "bucket", "key", "abc123")
-    mock_client.put_object_acl.assert_called_with(
-        Bucket="bucket",
-        Key="key",
-        VersionId="new_version123",
-        GrantFullControl="id=abc",
-        GrantWrite="id=123",
+    with pytest.raises(ClientError):
+        with MultipartUploadStream(
+            mock_client, "bucket", "key", "abc123", part_size=2
+        ) as stream:
+            stream.write(b"abc")
+    mock_client.abort_multipart_upload.assert_called_once_with(
+        Bucket="bucket", Key="key", UploadId="upload1"
     )
+    mock_client.put_object_acl.assert_not_called()
+    assert stream.version_id is None
 
 
 def test_it_verifies_integrity_happy_path():
@@ -659,3 +692,28 @@ def test_it_handles_error_for_generic_errors():
         "Unknown error: Some issue. Version rollback caused by version integrity "
         "conflict failed"
     )
+
+
+def test_it_downloads_match_plans(tmp_path):
+    columns = b'[{"Column":"customer_id","MatchIds":["12345"],"Type":"Simple"}]'
+    plan_hash = hashlib.sha256(columns).hexdigest()
+    client = MagicMock()
+    client.get_object.return_value = {"Body": BytesIO(gzip.compress(columns))}
+    path = str(tmp_path / "plans" / "{}.json".format(plan_hash))
+    download_match_plan(client, "bucket", "1234", plan_hash, path)
+    client.get_object.assert_called_with(
+        Bucket="bucket", Key="plans/1234/{}.json.gz".format(plan_hash)
+    )
+    with open(path, "rb") as f:
+        assert columns == f.read()
+    assert [os.path.basename(path)] == os.listdir(os.path.dirname(path))
+
+
+def test_it_rejects_match_plans_not_matching_their_hash(tmp_path):
+    plan_hash = hashlib.sha256(b"[]").hexdigest()
+    client = MagicMock()
+    client.get_object.return_value = {"Body": BytesIO(gzip.compress(b"[{}]"))}
+    path = str(tmp_path / "{}.json".format(plan_hash))
+    with pytest.raises(ValueError):
+        download_match_plan(client, "bucket", "1234", plan_hash, path)
+    assert not os.path.exists(path)
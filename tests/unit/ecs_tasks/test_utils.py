@@ -3,7 +3,13 @@ from mock import patch, MagicMock, call
 
 import pytest
 
-from backend.ecs_tasks.delete_files.utils import retry_wrapper, remove_none
+from backend.ecs_tasks.delete_files.utils import (
+    retry_wrapper,
+    remove_none,
+    prefetch,
+    parallel_map,
+    BackgroundConsumer,
+)
 
 pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
 
@@ -74,3 +80,77 @@ def test_it_retries_and_gives_up_fn(sleep_mock):
 
 def test_it_removes_empty_keys():
     assert {"test": "value"} == remove_none({"test": "value", "none": None})
+
+
+def test_it_prefetches_items_in_order():
+    assert [0, 1, 2, 3, 4] == list(prefetch(iter(range(5)), 2))
+
+
+def test_it_raises_prefetch_errors_in_calling_thread():
+    def items():
+        yield 1
+        raise ValueError("fail!")
+
+    result = []
+    with pytest.raises(ValueError) as e:
+        for item in prefetch(items(), 1):
+            result.append(item)
+    assert [1] == result
+    assert e.value.args[0] == "fail!"
+
+
+def test_it_stops_prefetching_when_consumer_stops():
+    produced = []
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            yield i
+
+    generator = prefetch(items(), 1)
+    assert 0 == next(generator)
+    generator.close()
+    assert len(produced) < 100
+
+
+def test_it_maps_items_in_parallel_in_order():
+    assert [0, 2, 4, 6, 8] == list(parallel_map(lambda i: i * 2, range(5), 3, 1))
+
+
+def test_it_raises_parallel_map_errors_in_calling_thread():
+    def fn(i):
+        if i == 2:
+            raise ValueError("fail!")
+        return i
+
+    result = []
+    with pytest.raises(ValueError) as e:
+        for item in parallel_map(fn, range(5), 2, 1):
+            result.append(item)
+    assert [0, 1] == result
+    assert e.value.args[0] == "fail!"
+
+
+def test_it_consumes_items_in_order():
+    result = []
+    with BackgroundConsumer(result.append, 1) as consumer:
+        for i in range(5):
+            consumer.put(i)
+    assert [0, 1, 2, 3, 4] == result
+
+
+def test_it_raises_consumer_errors_in_calling_thread():
+    fn = MagicMock(side_effect=ValueError("fail!"))
+    with pytest.raises(ValueError) as e:
+        with BackgroundConsumer(fn, 1) as consumer:
+            consumer.put(1)
+    assert e.value.args[0] == "fail!"
+
+
+def test_it_discards_pending_items_on_errors():
+    fn = MagicMock()
+    with pytest.raises(NameError):
+        with BackgroundConsumer(fn, 10) as consumer:
+            consumer.put(1)
+            raise NameError("fail!")
+    assert fn.call_count <= 1
@@ -0,0 +1,120 @@
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+
+from backend.ecs_tasks.delete_files.worker_pool import WorkerPool, get_rss
+
+pytestmark = [pytest.mark.unit, pytest.mark.ecs_tasks]
+
+
+def add(a, b):
+    return a + b
+
+
+def fail(message):
+    raise ValueError(message)
+
+
+def get_pid():
+    return os.getpid()
+
+
+def kill():
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def sleep(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def square_in_processes(values):
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        return list(executor.map(pow, values, [2] * len(values)))
+
+
+def test_it_returns_results_in_order():
+    with WorkerPool(processes=2, rss_watermark=2 ** 40) as pool:
+        assert [3, 7, 11] == pool.starmap(add, [(1, 2), (3, 4), (5, 6)])
+
+
+def test_it_raises_first_error():
+    with WorkerPool(processes=2, rss_watermark=2 ** 40) as pool:
+        with pytest.raises(ValueError, match="first"):
+            pool.starmap(fail, [("first",), ("second",)])
+        # Workers are still usable
+        assert [2] == pool.starmap(add, [(1, 1)])
+
+
+def test_it_keeps_workers_below_watermark():
+    with WorkerPool(processes=1, rss_watermark=2 ** 40) as pool:
+        pids = pool.starmap(get_pid, [()] * 3)
+    assert 1 == len(set(pids))
+    assert os.getpid() not in pids
+
+
+def test_it_recycles_workers_above_watermark():
+    with WorkerPool(processes=1, rss_watermark=0) as pool:
+        pids = pool.starmap(get_pid, [()] * 3)
+        assert 1 == len(pool.workers)
+    assert 3 == len(set(pids))
+
+
+def test_it_returns_results_as_tasks_complete():
+    with WorkerPool(processes=2, rss_watermark=2 ** 40) as pool:
+        slow = pool.submit(sleep, (0.5,))
+        fast = pool.submit(sleep, (0,))
+        assert (fast, True, 0) == pool.get_result()
+        assert (slow, True, 0.5) == pool.get_result()
+
+
+def test_it_returns_none_when_no_task_completes():
+    with WorkerPool(processes=1, rss_watermark=2 ** 40) as pool:
+        task_id = pool.submit(sleep, (0.5,))
+        assert pool.get_result(timeout=0.1) is None
+        assert (task_id, True, 0.5) == pool.get_result()
+
+
+def test_it_reports_tasks_of_killed_workers():
+    with WorkerPool(processes=1, rss_watermark=2 ** 40) as pool:
+        killed = pool.submit(kill, ())
+        task_id, success, error = pool.get_result(timeout=10)
+        assert killed == task_id
+        assert not success
+        assert "Worker exited with code -9" == str(error)
+        assert [3] == pool.starmap(add, [(1, 2)])
+        assert 1 == len(pool.workers)
+
+
+def test_it_reports_tasks_of_workers_killed_before_running_them():
+    with WorkerPool(processes=1, rss_watermark=2 ** 40) as pool:
+        worker = pool.workers[0]
+        # The worker dies whilst the task is sent to it
+        os.kill(worker.pid, signal.SIGSTOP)
+        task_id = pool.submit(add, (1, 2))
+        os.kill(worker.pid, signal.SIGKILL)
+        reported, success, error = pool.get_result(timeout=10)
+        assert task_id == reported
+        assert not success
+        assert "Worker exited with code -9" == str(error)
+        assert [3] == pool.starmap(add, [(1, 2)])
+
+
+def test_it_lets_tasks_start_processes():
+    with WorkerPool(processes=1, rss_watermark=2 ** 40) as pool:
+        assert [[1, 4, 9]] == pool.starmap(square_in_processes, [([1, 2, 3],)])
+
+
+def test_it_terminates_workers():
+    pool = WorkerPool(processes=2, rss_watermark=2 ** 40)
+    workers = list(pool.workers)
+    pool.terminate()
+    assert not any(worker.is_alive() for worker in workers)
+    assert [] == pool.workers
+
+
+def test_it_returns_rss():
+    assert get_rss() > 0
@@ -9,7 +9,12 @@ from mock import patch, Mock, ANY
 
 with patch.dict(
     os.environ,
-    {"JobTable": "test", "DeletionQueueTable": "test", "StateMachineArn": "sm-arn"},
+    {
+        "JobTable": "test",
+        "DeletionQueueTable": "test",
+        "StateMachineArn": "sm-arn",
+        "MatchPlanBucket": "plans",
+    },
 ):
     from backend.lambdas.jobs.stream_processor import (
         handler,
@@ -17,6 +22,7 @@ with patch.dict(
         is_record_type,
         process_job,
         clear_deletion_queue,
+        delete_match_plans,
     )
 
 pytestmark = [pytest.mark.unit, pytest.mark.jobs]
@@ -289,8 +295,14 @@ def test_it_handles_execution_failure(mock_emit, mock_client):
 @patch("backend.lambdas.jobs.stream_processor.clear_deletion_queue")
 @patch("backend.lambdas.jobs.stream_processor.emit_event")
 @patch("backend.lambdas.jobs.stream_processor.deserialize_item")
+@patch("backend.lambdas.jobs.stream_processor.delete_match_plans")
 def test_it_cleans_up_on_forget_complete(
-    mock_deserializer, mock_emit, mock_clear, mock_status, mock_is_record
+    mock_delete_plans,
+    mock_deserializer,
+    mock_emit,
+    mock_clear,
+    mock_status,
+    mock_is_record,
 ):
     mock_is_record.side_effect = [False, True]
     mock_deserializer.return_value = {
@@ -325,6 +337,7 @@ def test_it_cleans_up_on_forget_complete(
     )
 
     mock_clear.assert_called()
+    mock_delete_plans.assert_called_with("job123")
     mock_emit.assert_called_with(ANY, "CleanupSucceeded", ANY, ANY)
 
 
@@ -335,6 +348,7 @@ def test_it_cleans_up_on_forget_complete(
 @patch("backend.lambdas.jobs.stream_processor.update_status")
 @patch("backend.lambdas.jobs.stream_processor.clear_deletion_queue")
 @patch("backend.lambdas.jobs.stream_processor.emit_event")
+@patch("backend.lambdas.jobs.stream_processor.delete_match_plans", Mock())
 @patch("backend.lambdas.jobs.stream_processor.deserialize_item")
 def test_it_emits_skipped_event_for_failures(
     mock_deserializer, mock_emit, mock_clear, mock_status, mock_is_record
@@ -386,6 +400,7 @@ def test_it_emits_skipped_event_for_failures(
 @patch("backend.lambdas.jobs.stream_processor.update_status")
 @patch("backend.lambdas.jobs.stream_processor.clear_deletion_queue")
 @patch("backend.lambdas.jobs.stream_processor.emit_event")
+@patch("backend.lambdas.jobs.stream_processor.delete_match_plans", Mock())
 @patch("backend.lambdas.jobs.stream_processor.deserialize_item")
 def test_it_does_not_emit_skipped_event_for_non_failures(
     mock_deserializer, mock_emit, mock_clear, mock_status, mock_is_record
@@ -438,6 +453,7 @@ def test_it_does_not_emit_skipped_event_for_non_failures(
 @patch("backend.lambdas.jobs.stream_processor.update_status")
 @patch("backend.lambdas.jobs.stream_processor.clear_deletion_queue")
 @patch("backend.lambdas.jobs.stream_processor.emit_event")
+@patch("backend.lambdas.jobs.stream_processor.delete_match_plans", Mock())
 @patch("backend.lambdas.jobs.stream_processor.deserialize_item")
 def test_it_emits_event_for_cleanup_error(
     mock_deserializer, mock_emit, mock_clear, mock_status, mock_is_record
@@ -499,3 +515,33 @@ def test_it_clears_queue(mock_writer):
     )
 
     mock_writer.delete_item.assert_called()
+
+
+@patch("backend.lambdas.jobs.stream_processor.s3")
+@patch("backend.lambdas.jobs.stream_processor.paginate")
+def test_it_deletes_match_plans(mock_paginate, mock_s3):
+    mock_paginate.return_value = iter(
+        [{"Key": "plans/job123/{}.json.gz".format(i)} for i in range(1001)]
+    )
+    delete_match_plans("job123")
+    mock_paginate.assert_called_with(
+        mock_s3,
+        mock_s3.list_objects_v2,
+        ["Contents"],
+        Bucket="plans",
+        Prefix="plans/job123/",
+    )
+    assert 2 == mock_s3.delete_objects.call_count
+    mock_s3.delete_objects.assert_called_with(
+        Bucket="plans",
+        Delete={"Objects": [{"Key": "plans/job123/1000.json.gz"}], "Quiet": True},
+    )
+
+
+@patch("backend.lambdas.jobs.stream_processor.s3")
+@patch("backend.lambdas.jobs.stream_processor.paginate")
+def test_it_ignores_match_plan_deletion_errors(mock_paginate, mock_s3):
+    mock_paginate.return_value = iter([{"Key": "plans/job123/abc.json.gz"}])
+    mock_s3.delete_objects.side_effect = ClientError({}, "DeleteObjects")
+    delete_match_plans("job123")
+    mock_s3.delete_objects.assert_called()
@@ -23,6 +23,8 @@ from boto_utils import (
     utc_timestamp,
     get_job_expiry,
     parse_s3_url,
+    get_match_plan_key,
+    get_match_plan_prefix,
     get_user_info,
     get_session,
 )
@@ -355,6 +357,11 @@ def test_it_throws_for_invalid_urls():
         parse_s3_url(["s3://", "not", "string"])
 
 
+def test_it_returns_match_plan_keys():
+    assert "plans/1234/" == get_match_plan_prefix("1234")
+    assert "plans/1234/abc123.json.gz" == get_match_plan_key("1234", "abc123")
+
+
 def test_it_fetches_userinfo_from_lambda_event():
     result = get_user_info(
         {
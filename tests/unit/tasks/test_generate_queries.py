@@ -16,6 +16,7 @@ with patch.dict(os.environ, {"QueryQueue": "test"}):
         get_data_mappers,
         get_inner_children,
         get_nested_children,
+        get_csv_format_options,
     )
 
 pytestmark = [pytest.mark.unit, pytest.mark.task]
@@ -563,6 +564,7 @@ class TestAthenaQueries:
                 },
                 "RoleArn": "arn:aws:iam::accountid:role/rolename",
                 "DeleteOldVersions": True,
+                "FormatOptions": {"Compression": "zstd"},
             },
             [{"MatchId": "hi"}],
         )
@@ -583,6 +585,7 @@ class TestAthenaQueries:
                 ],
                 "RoleArn": "arn:aws:iam::accountid:role/rolename",
                 "DeleteOldVersions": True,
+                "FormatOptions": {"Compression": "zstd"},
             },
             {
                 "DataMapperId": "a",
@@ -599,9 +602,75 @@ class TestAthenaQueries:
                 ],
                 "RoleArn": "arn:aws:iam::accountid:role/rolename",
                 "DeleteOldVersions": True,
+                "FormatOptions": {"Compression": "zstd"},
             },
         ]
 
+    @patch("backend.lambdas.tasks.generate_queries.get_table")
+    @patch("backend.lambdas.tasks.generate_queries.get_partitions")
+    def test_it_adds_csv_format_options(self, get_partitions_mock, get_table_mock):
+        columns = [{"Name": "customer_id"}, {"Name": "name"}]
+        table = table_stub(columns, [])
+        table["StorageDescriptor"]["SerdeInfo"] = {
+            "SerializationLibrary": "org.apache.hadoop.hive.serde2.OpenCSVSerde",
+            "Parameters": {"separatorChar": ";"},
+        }
+        table["Parameters"]["skip.header.line.count"] = "1"
+        get_table_mock.return_value = table
+
+        resp = generate_athena_queries(
+            {
+                "DataMapperId": "a",
+                "QueryExecutor": "athena",
+                "Columns": ["customer_id"],
+                "Format": "csv",
+                "QueryExecutorParameters": {
+                    "DataCatalogProvider": "glue",
+                    "Database": "test_db",
+                    "Table": "test_table",
+                },
+                "FormatOptions": {"CompressionLevel": 1},
+            },
+            [{"MatchId": "hi"}],
+        )
+
+        assert resp[0]["FormatOptions"] == {
+            "ColumnNames": ["customer_id", "name"],
+            "HeaderLineCount": 1,
+            "FieldDelimiter": ";",
+            "QuoteChar": '"',
+            "EscapeChar": "\\",
+            "CompressionLevel": 1,
+        }
+
+    @pytest.mark.parametrize(
+        "params,expected",
+        [
+            (
+                {"field.delim": ",", "serialization.format": ","},
+                {"FieldDelimiter": ","},
+            ),
+            ({"serialization.format": "\t"}, {"FieldDelimiter": "\t"}),
+            ({"serialization.format": "1"}, {"FieldDelimiter": "\x01"}),
+            ({}, {"FieldDelimiter": "\x01"}),
+            (
+                {"field.delim": "|", "escape.delim": "\\"},
+                {"FieldDelimiter": "|", "EscapeChar": "\\"},
+            ),
+        ],
+    )
+    def test_it_gets_lazy_simple_serde_format_options(self, params, expected):
+        table = table_stub([{"Name": "customer_id"}], [])
+        table["StorageDescriptor"]["SerdeInfo"] = {
+            "SerializationLibrary": "org.apache.hadoop.hive.serde2.lazy.LazySimpleSerDe",
+            "Parameters": params,
+        }
+        assert get_csv_format_options(table) == {
+            "ColumnNames": ["customer_id"],
+            "HeaderLineCount": 0,
+            **expected,
+        }
+
     @patch("backend.lambdas.tasks.generate_queries.get_table")
     @patch("backend.lambdas.tasks.generate_queries.get_partitions")
     def test_it_filters_users_from_non_applicable_tables(
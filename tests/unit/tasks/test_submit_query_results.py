@@ -1,18 +1,22 @@
+import gzip
+import hashlib
+import json
 import os
 from types import SimpleNamespace
 
 import pytest
 from mock import patch, ANY
 
-with patch.dict(os.environ, {"QueueUrl": "test"}):
-    from backend.lambdas.tasks.submit_query_results import handler
+with patch.dict(os.environ, {"QueueUrl": "test", "MatchPlanBucket": "plans"}):
+    from backend.lambdas.tasks.submit_query_results import handler, offload_columns
 
 pytestmark = [pytest.mark.unit, pytest.mark.task]
 
 
+@patch("backend.lambdas.tasks.submit_query_results.offload_columns")
 @patch("backend.lambdas.tasks.submit_query_results.batch_sqs_msgs")
 @patch("backend.lambdas.tasks.submit_query_results.paginate")
-def test_it_returns_only_paths(paginate_mock, batch_sqs_msgs_mock):
+def test_it_returns_only_paths(paginate_mock, batch_sqs_msgs_mock, offload_mock):
     paginate_mock.return_value = iter(
         [
             {"Data": [{"VarCharValue": "$path"},]},
@@ -34,9 +38,12 @@ def test_it_returns_only_paths(paginate_mock, batch_sqs_msgs_mock):
     assert 2 == resp
 
 
+@patch("backend.lambdas.tasks.submit_query_results.offload_columns")
 @patch("backend.lambdas.tasks.submit_query_results.batch_sqs_msgs")
 @patch("backend.lambdas.tasks.submit_query_results.paginate")
-def test_it_submits_results_to_be_batched(paginate_mock, batch_sqs_msgs_mock):
+def test_it_submits_results_to_be_batched(
+    paginate_mock, batch_sqs_msgs_mock, offload_mock
+):
     paginate_mock.return_value = iter(
         [
             {"Data": [{"VarCharValue": "$path"},]},
@@ -45,6 +52,7 @@ def test_it_submits_results_to_be_batched(paginate_mock, batch_sqs_msgs_mock):
         ]
     )
     columns = [{"Column": "customer_id", "MatchIds": ["2732559"]}]
+    offload_mock.return_value = "columns_hash"
 
     handler(
         {"JobId": "1234", "QueryId": "123", "Columns": columns,}, SimpleNamespace(),
@@ -54,13 +62,13 @@ def test_it_submits_results_to_be_batched(paginate_mock, batch_sqs_msgs_mock):
         [
             {
                 "JobId": "1234",
-                "Columns": columns,
+                "ColumnsHash": "columns_hash",
                 "Object": "s3://mybucket/mykey1",
                 "DeleteOldVersions": True,
             },
             {
                 "JobId": "1234",
-                "Columns": columns,
+                "ColumnsHash": "columns_hash",
                 "Object": "s3://mybucket/mykey2",
                 "DeleteOldVersions": True,
             },
@@ -68,9 +76,12 @@ def test_it_submits_results_to_be_batched(paginate_mock, batch_sqs_msgs_mock):
     )
 
 
+@patch("backend.lambdas.tasks.submit_query_results.offload_columns")
 @patch("backend.lambdas.tasks.submit_query_results.batch_sqs_msgs")
 @patch("backend.lambdas.tasks.submit_query_results.paginate")
-def test_it_propagates_optional_properties(paginate_mock, batch_sqs_msgs_mock):
+def test_it_propagates_optional_properties(
+    paginate_mock, batch_sqs_msgs_mock, offload_mock
+):
     paginate_mock.return_value = iter(
         [
             {"Data": [{"VarCharValue": "$path"},]},
@@ -78,6 +89,7 @@ def test_it_propagates_optional_properties(paginate_mock, batch_sqs_msgs_mock):
         ]
     )
     columns = [{"Column": "customer_id", "MatchIds": ["2732559"]}]
+    offload_mock.return_value = "columns_hash"
 
     handler(
         {
@@ -94,10 +106,64 @@ def test_it_propagates_optional_properties(paginate_mock, batch_sqs_msgs_mock):
         [
             {
                 "JobId": "1234",
-                "Columns": columns,
+                "ColumnsHash": "columns_hash",
                 "Object": "s3://mybucket/mykey1",
                 "RoleArn": "arn:aws:iam:accountid:role/rolename",
                 "DeleteOldVersions": False,
             },
         ],
     )
+
+
+@patch("backend.lambdas.tasks.submit_query_results.offload_columns")
+@patch("backend.lambdas.tasks.submit_query_results.batch_sqs_msgs")
+@patch("backend.lambdas.tasks.submit_query_results.paginate")
+def test_it_offloads_columns_once_per_query(
+    paginate_mock, batch_sqs_msgs_mock, offload_mock
+):
+    paginate_mock.return_value = iter(
+        [
+            {"Data": [{"VarCharValue": "$path"},]},
+            {"Data": [{"VarCharValue": "s3://mybucket/mykey1"},]},
+            {"Data": [{"VarCharValue": "s3://mybucket/mykey2"},]},
+        ]
+    )
+    columns = [{"Column": "customer_id", "MatchIds": ["2732559"]}]
+
+    handler(
+        {"JobId": "1234", "QueryId": "123", "Columns": columns,}, SimpleNamespace(),
+    )
+    offload_mock.assert_called_once_with("1234", columns)
+
+
+@patch("backend.lambdas.tasks.submit_query_results.offload_columns")
+@patch("backend.lambdas.tasks.submit_query_results.batch_sqs_msgs")
+@patch("backend.lambdas.tasks.submit_query_results.paginate")
+def test_it_doesnt_offload_columns_without_results(
+    paginate_mock, batch_sqs_msgs_mock, offload_mock
+):
+    paginate_mock.return_value = iter([{"Data": [{"VarCharValue": "$path"},]}])
+    columns = [{"Column": "customer_id", "MatchIds": ["2732559"]}]
+
+    resp = handler(
+        {"JobId": "1234", "QueryId": "123", "Columns": columns,}, SimpleNamespace(),
+    )
+    assert 0 == resp
+    offload_mock.assert_not_called()
+
+
+@patch("backend.lambdas.tasks.submit_query_results.s3")
+def test_it_offloads_columns_by_content_hash(s3_mock):
+    columns = [{"Column": "customer_id", "MatchIds": ["2732559"], "Type": "Simple"}]
+    reordered = [{"Type": "Simple", "MatchIds": ["2732559"], "Column": "customer_id"}]
+
+    columns_hash = offload_columns("1234", columns)
+
+    body = s3_mock.put_object.call_args[1]["Body"]
+    expected = hashlib.sha256(gzip.decompress(body)).hexdigest()
+    assert expected == columns_hash
+    assert columns == json.loads(gzip.decompress(body))
+    s3_mock.put_object.assert_called_with(
+        Bucket="plans", Key="plans/1234/{}.json.gz".format(expected), Body=ANY
+    )
+    assert columns_hash == offload_columns("1234", reordered)